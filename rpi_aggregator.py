@@ -0,0 +1,577 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Many Pis, one collector: every Pi runs an agent which reads its sensors and
+# pushes the readings over one TCP connection, the collector keeps the latest
+# value of every sensor of every agent with the status of its thresholds.
+#   collector: python rpi_aggregator.py collector --port 9106 --http-port 9107
+#   agent:     python rpi_aggregator.py agent --collector nagios:9106 \
+#                  --job 1 "DS18B20 -n 1 -w 30 -c 35" --job 10 "DHT -t 22 -p 4 -w 30 -w 80 -c 35 -c 90"
+#   latest values: http://collector:9107/latest (JSON)
+#
+# Frames: length of the payload (4 bytes), kind (1 byte), sequence number (4 bytes)
+#   HELLO   agent -> collector, JSON: agent name, session, thresholds per sensor
+#   BATCH   agent -> collector, readings of about one --batch-interval
+#   ACK     collector -> agent, every BATCH up to the sequence number is stored
+# BATCH payload: time of the first reading (8 bytes, micro seconds since 1970),
+# number of strings and readings (2 bytes each), the strings (1 byte length +
+# utf-8, sensor names and unit shortcodes), then per reading: sensor and unit
+# (string numbers, 2 bytes each), position of the value in the reading and type
+# of the value (1 byte each), micro seconds since the reading before (varint),
+# value (double, string number or nothing for True/False/None).
+# A reading of one value is ~16 bytes instead of ~60 of the Nagios text.
+#
+# The agent keeps every BATCH until it is acknowledged and sends the ones left
+# again after a reconnect, the collector acknowledges resent ones it already has
+# without storing them twice. The collector handles all agents in one thread
+# with select (python 2 has no asyncio), the HTTP page is served from another.
+###############################################################################
+
+import BaseHTTPServer,SocketServer,argparse,collections,errno,json,random,select,socket,struct,sys,threading,time
+import rpi_thresholds
+
+KIND_HELLO=1
+KIND_BATCH=2
+KIND_ACK=3
+
+_header=struct.Struct("<IBI")
+_batch=struct.Struct("<qHH")
+_reading=struct.Struct("<HHBB")
+_double=struct.Struct("<d")
+_string=struct.Struct("<H")
+max_payload=1<<20
+
+VALUE_NUMBER=0
+VALUE_FALSE=1
+VALUE_TRUE=2
+VALUE_STRING=3
+VALUE_NONE=4
+
+class ProtocolError(Exception):
+    pass
+
+def frame(kind,seq,payload=""):
+    return _header.pack(len(payload),kind,seq)+payload
+
+def encode_varint(value):
+    data=bytearray()
+    while value > 0x7f:
+        data.append((value&0x7f)|0x80)
+        value>>=7
+    data.append(value)
+    return str(data)
+
+#value and the offset behind it
+def decode_varint(data,offset):
+    value=0
+    shift=0
+    while True:
+        if offset >= len(data):
+            raise ProtocolError("varint cut off")
+        byte=ord(data[offset])
+        offset+=1
+        value|=(byte&0x7f)<<shift
+        if not byte&0x80:
+            return value,offset
+        shift+=7
+
+#readings: (sensor, shortcode, position, value, epoch), sent sorted by time
+def encode_batch(readings):
+    readings=sorted(readings,key=lambda reading: reading[4])
+    strings={}
+    table=[]
+    def number(text):
+        #names are utf-8 byte strings (e.g. -N "Küche"), a cut character is left out
+        text=text.decode("utf-8","replace") if isinstance(text,str) else unicode(text)
+        text=text.encode("utf-8")[:255].decode("utf-8","ignore").encode("utf-8")
+        if text not in strings:
+            strings[text]=len(table)
+            table.append(text)
+        return strings[text]
+    body=[]
+    base=int(readings[0][4]*1e6) if readings else 0
+    last=base
+    for sensor,shortcode,position,value,epoch in readings:
+        micros=int(epoch*1e6)
+        if isinstance(value,bool):
+            kind,data=(VALUE_TRUE if value else VALUE_FALSE),""
+        elif isinstance(value,(int,long,float)):
+            kind,data=VALUE_NUMBER,_double.pack(value)
+        elif value is None:
+            kind,data=VALUE_NONE,""
+        else:
+            kind,data=VALUE_STRING,_string.pack(number(value))
+        body.append(_reading.pack(number(sensor),number(shortcode),position,kind)+encode_varint(max(0,micros-last))+data)
+        last=max(last,micros)
+    return _batch.pack(base,len(table),len(readings))+"".join(chr(len(text))+text for text in table)+"".join(body)
+
+def decode_batch(payload):
+    try:
+        base,strings,count=_batch.unpack_from(payload,0)
+        offset=_batch.size
+        table=[]
+        for i in range(strings):
+            length=ord(payload[offset])
+            table.append(payload[offset+1:offset+1+length].decode("utf-8"))
+            offset+=1+length
+        readings=[]
+        micros=base
+        for i in range(count):
+            sensor,shortcode,position,kind=_reading.unpack_from(payload,offset)
+            delta,offset=decode_varint(payload,offset+_reading.size)
+            micros+=delta
+            if kind == VALUE_NUMBER:
+                value=_double.unpack_from(payload,offset)[0]
+                offset+=_double.size
+            elif kind == VALUE_STRING:
+                value=table[_string.unpack_from(payload,offset)[0]]
+                offset+=_string.size
+            else:
+                value={VALUE_FALSE:False,VALUE_TRUE:True,VALUE_NONE:None}[kind]
+            readings.append((table[sensor],table[shortcode],position,value,micros/1e6))
+    except (struct.error,IndexError,KeyError,UnicodeDecodeError) as e:
+        raise ProtocolError("broken batch: "+str(e))
+    return readings
+
+#collects bytes and gives back the complete frames
+class FrameReader(object):
+    def __init__(self):
+        self.buffer=""
+
+    def feed(self,data):
+        self.buffer+=data
+        frames=[]
+        offset=0
+        while len(self.buffer)-offset >= _header.size:
+            length,kind,seq=_header.unpack_from(self.buffer,offset)
+            if length > max_payload:
+                raise ProtocolError("frame of "+str(length)+" bytes")
+            end=offset+_header.size+length
+            if end > len(self.buffer):
+                break
+            frames.append((kind,seq,self.buffer[offset+_header.size:end]))
+            offset=end
+        self.buffer=self.buffer[offset:]
+        return frames
+
+#Agent side: readings are batched every <batch_interval> seconds, a batch is
+#kept until the collector acknowledged it (at most <max_frames>, the oldest go first)
+class Agent(object):
+    def __init__(self,address,name,thresholds=None,batch_interval=1.0,max_frames=3600,retry=5):
+        self.address=address
+        self.name=name
+        self.thresholds=thresholds or {}
+        self.batch_interval=batch_interval
+        self.max_frames=max_frames
+        self.retry=retry
+        #a new session tells the collector the sequence numbers start again
+        self.session=random.getrandbits(31)
+        self.lock=threading.Lock()
+        self.readings=[]
+        self.seq=0
+        #seq -> frame, sent but not acknowledged
+        self.unacked=collections.OrderedDict()
+        self.dropped=0
+        self.sent=0
+        self.acked=0
+        self.reconnects=0
+        self.errors=0
+        self.sock=None
+
+    #the values of one readSensor
+    def add(self,sensor,meas):
+        with self.lock:
+            for position,unit in enumerate(meas):
+                self.readings.append((sensor,unit.shortcode,position,unit.value,unit.epoch))
+
+    #readings added since the last batch as a new frame
+    def batch(self):
+        with self.lock:
+            readings,self.readings=self.readings,[]
+        if not readings:
+            return None
+        self.seq+=1
+        data=frame(KIND_BATCH,self.seq,encode_batch(readings))
+        self.unacked[self.seq]=data
+        while len(self.unacked) > self.max_frames:
+            self.unacked.popitem(last=False)
+            self.dropped+=1
+        return data
+
+    def acknowledge(self,seq):
+        for number in list(self.unacked):
+            if number > seq:
+                break
+            del self.unacked[number]
+            self.acked+=1
+
+    #connects, says hello and sends what is not acknowledged yet
+    def connect(self):
+        sock=socket.create_connection(self.address,self.retry)
+        sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        hello=json.dumps({"agent":self.name,"session":self.session,"thresholds":self.thresholds})
+        sock.sendall(frame(KIND_HELLO,0,hello))
+        self.sock=sock
+        self.reader=FrameReader()
+        #the collector answers the hello with the last sequence number it has
+        self.receive(self.retry)
+        pending=list(self.unacked.values())
+        if pending:
+            sock.sendall("".join(pending))
+            self.sent+=len(pending)
+
+    #reads the acknowledgements, waits at most <timeout> seconds for them
+    def receive(self,timeout):
+        ready,_,_=select.select([self.sock],[],[],timeout)
+        if not ready:
+            return
+        data=self.sock.recv(65536)
+        if not data:
+            raise socket.error("collector closed the connection")
+        for kind,seq,payload in self.reader.feed(data):
+            if kind == KIND_ACK:
+                self.acknowledge(seq)
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+        self.sock=None
+
+    #sends a batch every <batch_interval> seconds until <stopped> is set
+    def run(self,stopped):
+        next_batch=time.time()
+        while not stopped.is_set():
+            try:
+                if self.sock is None:
+                    self.connect()
+                now=time.time()
+                if now >= next_batch:
+                    next_batch=max(next_batch+self.batch_interval,now)
+                    data=self.batch()
+                    if data:
+                        self.sock.sendall(data)
+                        self.sent+=1
+                self.receive(max(0.0,next_batch-time.time()))
+            except (socket.error,ProtocolError):
+                self.close()
+                self.reconnects+=1
+                #readings are batched meanwhile and sent after the reconnect
+                if stopped.wait(self.retry):
+                    break
+                self.batch()
+            except Exception as e:
+                #the readings of the batch are lost, the frames not acknowledged
+                #are sent again on a new connection
+                self.close()
+                self.errors+=1
+                sys.stderr.write("agent: "+e.__class__.__name__+": "+str(e)+"\n")
+                if stopped.wait(self.batch_interval):
+                    break
+        self.close()
+
+    def stats(self):
+        return {"sent":self.sent,"acked":self.acked,"unacked":len(self.unacked),"dropped":self.dropped,"reconnects":self.reconnects,"errors":self.errors}
+
+#one agent connection of the collector
+class Connection(object):
+    def __init__(self,sock,address):
+        self.sock=sock
+        self.address=address
+        self.reader=FrameReader()
+        self.agent=None
+        self.out=""
+
+#latest value of one position of a sensor with its rule
+class Value(object):
+    __slots__=("value","shortcode","epoch","rule","status")
+
+    def __init__(self):
+        self.value=None
+        self.shortcode=None
+        self.epoch=0.0
+        self.rule=None
+        self.status=None
+
+#Collector side: all agent connections in one select loop
+class Collector(object):
+    def __init__(self):
+        self.lock=threading.Lock()
+        #agent -> {"session", "seq", "thresholds", "address", "connected", "seen"}
+        self.agents={}
+        #(agent, sensor) -> [Value per position]
+        self.latest={}
+        self.connections={}
+        self.frames=0
+        self.readings=0
+        self.errors=0
+
+    def hello(self,connection,payload):
+        message=json.loads(payload)
+        name=message["agent"]
+        with self.lock:
+            agent=self.agents.get(name)
+            if agent is None or agent["session"] != message.get("session"):
+                agent=self.agents[name]={"session":message.get("session"),"seq":0}
+            thresholds=message.get("thresholds") or {}
+            #new thresholds apply to the next readings, unchanged ones keep their state (hysteresis)
+            if agent.get("thresholds") != thresholds:
+                for (agent_name,sensor),values in self.latest.items():
+                    if agent_name == name:
+                        for value in values:
+                            value.rule=None
+            agent.update(thresholds=thresholds,address=connection.address[0],connected=True,seen=time.time())
+        connection.agent=name
+        connection.out+=frame(KIND_ACK,agent["seq"])
+
+    #thresholds of the agent for a position of a sensor, None without
+    def rule(self,agent,sensor,position):
+        thresholds=self.agents[agent]["thresholds"].get(sensor)
+        if not thresholds or position >= len(thresholds):
+            return None
+        warning,critical,hysteresis=(list(thresholds[position])+[0.0])[:3]
+        return rpi_thresholds.Rule(warning,critical,hysteresis)
+
+    def ingest(self,agent,readings):
+        with self.lock:
+            for sensor,shortcode,position,value,epoch in readings:
+                values=self.latest.setdefault((agent,sensor),[])
+                while len(values) <= position:
+                    values.append(Value())
+                entry=values[position]
+                if epoch < entry.epoch:
+                    continue
+                entry.value,entry.shortcode,entry.epoch=value,shortcode,epoch
+                if entry.rule is None:
+                    entry.rule=self.rule(agent,sensor,position)
+                if entry.rule is not None:
+                    entry.status=entry.rule.evaluate(value)
+                    entry.rule.state=entry.status
+            self.readings+=len(readings)
+            self.agents[agent]["seen"]=time.time()
+
+    def handle(self,connection,kind,seq,payload):
+        self.frames+=1
+        if kind == KIND_HELLO:
+            self.hello(connection,payload)
+            return None
+        if connection.agent is None:
+            raise ProtocolError("no hello")
+        if kind != KIND_BATCH:
+            raise ProtocolError("unexpected frame "+str(kind))
+        agent=self.agents[connection.agent]
+        #resent after a reconnect and already stored
+        if seq > agent["seq"]:
+            self.ingest(connection.agent,decode_batch(payload))
+            agent["seq"]=seq
+        return agent["seq"]
+
+    def read(self,connection):
+        try:
+            data=connection.sock.recv(65536)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN,errno.EINTR):
+                return
+            data=""
+        if not data:
+            self.drop(connection)
+            return
+        try:
+            ack=None
+            for kind,seq,payload in connection.reader.feed(data):
+                ack=self.handle(connection,kind,seq,payload) or ack
+        except (ProtocolError,ValueError,KeyError):
+            self.errors+=1
+            self.drop(connection)
+            return
+        #one acknowledgement for all frames of this read
+        if ack is not None:
+            connection.out+=frame(KIND_ACK,ack)
+        self.write(connection)
+
+    def write(self,connection):
+        if not connection.out:
+            return
+        try:
+            sent=connection.sock.send(connection.out)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN,errno.EINTR):
+                return
+            self.drop(connection)
+            return
+        connection.out=connection.out[sent:]
+
+    def drop(self,connection):
+        self.connections.pop(connection.sock,None)
+        connection.sock.close()
+        if connection.agent:
+            with self.lock:
+                if not any(other.agent == connection.agent for other in self.connections.values()):
+                    self.agents[connection.agent]["connected"]=False
+
+    #select loop over the listening socket and all agents until <stopped> is set
+    def serve(self,listener,stopped):
+        listener.setblocking(0)
+        while not stopped.is_set():
+            sockets=list(self.connections)
+            writing=[sock for sock,connection in self.connections.items() if connection.out]
+            readable,writable,_=select.select([listener]+sockets,writing,[],0.5)
+            for sock in readable:
+                if sock is listener:
+                    try:
+                        client,address=listener.accept()
+                    except socket.error:
+                        continue
+                    client.setblocking(0)
+                    client.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+                    self.connections[client]=Connection(client,address)
+                elif sock in self.connections:
+                    self.read(self.connections[sock])
+            for sock in writable:
+                if sock in self.connections:
+                    self.write(self.connections[sock])
+        for connection in self.connections.values():
+            connection.sock.close()
+        self.connections={}
+
+    #{agent: {"connected", "seen", "sensors": {sensor: [{"value", "unit", "time", "status", "warning", "critical"}]}}}
+    def snapshot(self):
+        with self.lock:
+            result={}
+            for name,agent in self.agents.items():
+                result[name]={"connected":agent.get("connected",False),"seen":agent.get("seen"),"address":agent.get("address"),"sensors":{}}
+            for (name,sensor),values in self.latest.items():
+                entries=[]
+                for value in values:
+                    entry={"value":value.value,"unit":value.shortcode,"time":value.epoch,"status":value.status}
+                    if value.rule is not None:
+                        entry["warning"]=value.rule.warning.spec
+                        entry["critical"]=value.rule.critical.spec
+                    entries.append(entry)
+                result[name]["sensors"][sensor]=entries
+            return result
+
+    def stats(self):
+        with self.lock:
+            return {"agents":len(self.agents),"connected":len(self.connections),"frames":self.frames,"readings":self.readings,"errors":self.errors}
+
+class LatestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version="HTTP/1.1"
+
+    def do_GET(self):
+        path=self.path.split("?")[0]
+        if path == "/latest":
+            body=json.dumps(self.server.collector.snapshot())
+        elif path == "/stats":
+            body=json.dumps(self.server.collector.stats())
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        pass
+
+class LatestServer(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+    daemon_threads=True
+    allow_reuse_address=True
+
+    def __init__(self,address,collector):
+        BaseHTTPServer.HTTPServer.__init__(self,address,LatestHandler)
+        self.collector=collector
+
+def listen(address,backlog=128):
+    listener=socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+    listener.bind(address)
+    listener.listen(backlog)
+    return listener
+
+#host:port -> (host, port)
+def parse_address(text,port=9106):
+    host,_,number=text.rpartition(":")
+    if not host:
+        return text,port
+    return host,int(number)
+
+def GetArgs():
+    parser = argparse.ArgumentParser(description='Collects the readings of many Pis (collector) or sends them (agent)')
+    parser.add_argument('role',          choices=("collector","agent"),     action='store', help='collector or agent')
+    parser.add_argument(      '--listen',    default='',                    action='store', help='Collector: address to listen on')
+    parser.add_argument(      '--port',      type=int, default=9106,        action='store', help='Collector: port of the agents')
+    parser.add_argument(      '--http-port', type=int, default=9107,        action='store', help='Collector: port of the /latest page')
+    parser.add_argument(      '--collector', default=None,                  action='store', help='Agent: host:port of the collector')
+    parser.add_argument(      '--name',      default=socket.gethostname(),  action='store', help='Agent: name of this Pi')
+    parser.add_argument('-j', '--job',       nargs=2,                      action='append', metavar=('SECONDS','SENSOR'), help='Agent: interval and sensor like rpi_nagios.py -b, thresholds with -w/-c')
+    parser.add_argument(      '--batch-interval', type=float, default=1, action='store', help='Agent: seconds of readings sent in one frame')
+    parser.add_argument(      '--max-frames', type=int, default=3600,       action='store', help='Agent: frames kept while the collector is not reachable')
+    parser.add_argument(      '--workers',   type=int, default=0,           action='store', help='Agent: threads reading sensors')
+    args=parser.parse_args()
+    if args.role == "agent" and not (args.collector and args.job):
+        parser.error("an agent needs --collector and --job")
+    return args
+
+def collector(args):
+    collector=Collector()
+    server=LatestServer((args.listen,args.http_port),collector)
+    thread=threading.Thread(target=server.serve_forever)
+    thread.daemon=True
+    thread.start()
+    stopped=threading.Event()
+    try:
+        collector.serve(listen((args.listen,args.port)),stopped)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+def agent(args):
+    import rpi_nagios,rpi_scheduler,rpi_sensors
+    args.output="standard"
+    args.decimals=1
+    args.socket=None
+    args.state=None
+    jobs=[]
+    thresholds={}
+    for interval,spec in args.job:
+        specargs=rpi_nagios.parseSpec(spec,args)
+        sensor=rpi_nagios.getSensor(specargs)
+        if not sensor:
+            raise ValueError("Did not get sensor back: "+spec)
+        if specargs.warning and specargs.critical:
+            hysteresis=specargs.hysteresis or []
+            thresholds[sensor.name]=[[warning,critical,hysteresis[i] if i < len(hysteresis) else 0.0]
+                                     for i,(warning,critical) in enumerate(zip(specargs.warning,specargs.critical))]
+        jobs.append((float(interval),sensor))
+    sender=Agent(parse_address(args.collector),args.name,thresholds,args.batch_interval,args.max_frames)
+    def on_result(job):
+        if not job.error:
+            sender.add(job.sensor.name,job.measurements)
+    scheduler=rpi_scheduler.Scheduler(args.workers,on_result=on_result)
+    for interval,sensor in jobs:
+        scheduler.add(sensor,interval)
+    thread=threading.Thread(target=sender.run,args=(scheduler.stopped,))
+    thread.daemon=True
+    thread.start()
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+    finally:
+        rpi_sensors.cleanup()
+        sys.stderr.write(str(sender.stats())+"\n")
+
+def main():
+    args=GetArgs()
+    if args.role == "collector":
+        collector(args)
+    else:
+        agent(args)
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,390 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Benchmarks for the things that make a check slow
+#
+# startup: cold start of a check per sensor type. Every run is a new python
+#          process (like NRPE does it) which imports rpi_nagios and loads the
+#          drivers the sensor type needs. The time of every import is listed
+#          like "python -X importtime" would do it (not available in python 2)
+#
+# estimators: updates per second of rpi_estimators.SlidingWindow (add a sample,
+#          trimmed mean, median and MAD) compared to sorting the whole window
+#          and cutting it like measure_average did before, plus the batch path
+#          for tuples, for windows from 5 to 10000 samples
+#
+# history: appends and time range queries per second of rpi_history with
+#          1M records in memory mapped files (put --dir on the SD card to
+#          measure it), plus the size of the files and the time of a flush
+#
+# The following run on the fake hardware of rpi_fakes, so they measure the
+# code and give the same numbers on every machine (not only on a Pi):
+#
+# latency: time of one check per sensor type, median and 95th percentile
+#
+# coldstart: a whole rpi_nagios.py check in a new process (fake 1-wire tree,
+#          GPIO and I2C bus installed before it runs)
+#
+# sweep:   reading N DS18B20 one after the other (one conversion each) compared
+#          to one conversion for all (rpi_sensors.OneWireBus)
+#
+# averaging: checks and samples per second of --accuracy N on a sensor which
+#          answers at once
+#
+# --save keeps the results as JSON with the git revision, --compare prints the
+# change against such a file, e.g. before and after a change:
+# python rpi_benchmark.py latency --save /tmp/before.json
+# python rpi_benchmark.py latency --compare /tmp/before.json
+#
+# python rpi_benchmark.py startup --runs 20
+# python rpi_benchmark.py estimators
+# python rpi_benchmark.py history --dir /var/lib/rpi_sensors/bench --records 1000000
+###############################################################################
+
+import argparse,collections,json,os,random,subprocess,sys,time
+
+#drivers loaded by rpi_sensors.load_driver() for each sensor type
+sensor_drivers={
+    "RPI":(),
+    "DS18B20":(),
+    "DHT":(),
+    "BMP085":("bmp085",),
+    "PIR":("gpio",),
+    "ULTRASONIC":("gpio",),
+}
+
+#runs in the new process, prints the time of every step in microseconds
+startup_code='''
+import json,sys,time
+steps=[]
+start=time.time()
+for module in ("argparse","rpi_version","rpi_sensors","rpi_nagios"):
+    t=time.time()
+    __import__(module)
+    steps.append((module,(time.time()-t)*1e6))
+import rpi_sensors
+for driver in sys.argv[1:]:
+    t=time.time()
+    try:
+        rpi_sensors.load_driver(driver)
+    except ImportError:
+        pass
+    steps.append(("driver "+driver,(time.time()-t)*1e6))
+steps.append(("total",(time.time()-start)*1e6))
+print json.dumps(steps)
+'''
+
+def median(values):
+    values=sorted(values)
+    middle=len(values)//2
+    if len(values)%2:
+        return values[middle]
+    return (values[middle-1]+values[middle])/2.0
+
+#cold start of one sensor type, returns the medians in microseconds
+def bench_startup(sensor,runs=10,python=sys.executable):
+    here=os.path.dirname(os.path.abspath(__file__))
+    steps={}
+    order=[]
+    for run in range(runs):
+        start=time.time()
+        output=subprocess.check_output([python,"-c",startup_code]+list(sensor_drivers[sensor]),cwd=here)
+        wall=(time.time()-start)*1e6
+        for step,usec in json.loads(output)+[["process",wall]]:
+            if step not in steps:
+                order.append(step)
+                steps[step]=[]
+            steps[step].append(usec)
+    return [(step,median(steps[step])) for step in order]
+
+estimator_windows=(5,50,500,5000,10000)
+
+#what measure_average did for every new value: sort everything, pop the outer thirds
+def sorted_trimmed_mean(samples):
+    measurements=sorted(samples)
+    for round in range(0,len(measurements)//3):
+        measurements.pop()
+        measurements.pop(0)
+    return sum(measurements)/len(measurements)
+
+#updates per second, the number of updates is limited by time
+def rate(function,seconds=0.5):
+    count=0
+    start=time.time()
+    while time.time()-start < seconds:
+        function()
+        count+=1
+    return count/(time.time()-start)
+
+def bench_estimators(windows=estimator_windows):
+    import rpi_estimators
+    results=[]
+    for size in windows:
+        window=rpi_estimators.SlidingWindow(size)
+        samples=[]
+        for i in range(size):
+            value=random.gauss(20,2)
+            window.add(value)
+            samples.append(value)
+        def update_window():
+            window.add(random.gauss(20,2))
+            window.trimmed_mean()
+            window.median()
+            window.mad()
+        def update_sorted():
+            samples.pop(0)
+            samples.append(random.gauss(20,2))
+            sorted_trimmed_mean(samples)
+        tuples=[(random.gauss(20,2),random.gauss(50,5)) for i in range(size)]
+        results.append(("window %d" % size,[
+            ("SlidingWindow",rate(update_window)),
+            ("sort and cut",rate(update_sorted)),
+            ("tuples batch",rate(lambda: rpi_estimators.trimmed_mean_columns(tuples))),
+        ]))
+    return results
+
+def bench_history(directory,records=1000000,queries=10000):
+    import rpi_history,shutil,tempfile
+    directory=tempfile.mkdtemp(dir=directory)
+    try:
+        results=[]
+        start=1400000000
+        #raw ring buffer only, then the same with the minute and hour tiers
+        ring=rpi_history.RingBuffer(records,os.path.join(directory,"ring"))
+        t=time.time()
+        for i in xrange(records):
+            ring.append((int((start+i)*1e9),20.0))
+        results.append(("ring append",records/(time.time()-t)))
+        t=time.time()
+        ring.flush()
+        results.append(("ring flush",time.time()-t,"s"))
+        series=rpi_history.SeriesHistory(records,path=os.path.join(directory,"series"))
+        t=time.time()
+        for i in xrange(records):
+            series.append(start+i,20.0+(i%600)/100.0)
+        results.append(("series append",records/(time.time()-t)))
+        t=time.time()
+        for i in xrange(queries):
+            begin=start+random.randint(0,records-600)
+            series.query(begin,begin+600)
+        results.append(("10min query",queries/(time.time()-t)))
+        t=time.time()
+        for i in xrange(queries):
+            begin=start+random.randint(0,records-86400)
+            series.query_tier(3600,begin,begin+86400)
+        results.append(("1 day hour tier",queries/(time.time()-t)))
+        t=time.time()
+        series.flush()
+        results.append(("series flush",time.time()-t,"s"))
+        results.append(("on disk",sum(os.path.getsize(os.path.join(directory,name)) for name in os.listdir(directory))/1e6,"MB"))
+        ring.close()
+        series.close()
+        return [("history %d records" % records,results)]
+    finally:
+        shutil.rmtree(directory)
+
+#median and 95th percentile of <runs> calls in milli seconds
+def latency(function,runs):
+    times=[]
+    for run in range(runs):
+        start=time.time()
+        function()
+        times.append((time.time()-start)*1e3)
+    times.sort()
+    return median(times),times[min(len(times)-1,int(len(times)*0.95))]
+
+def bench_latency(runs=20):
+    import rpi_dht,rpi_fakes,rpi_sensors,shutil,tempfile
+    directory=tempfile.mkdtemp()
+    try:
+        gpio=rpi_fakes.FakeGPIO()
+        gpio.echo(23,24,100.0)
+        gpio.echo(25,26,100.0)
+        tree=rpi_fakes.FakeW1Tree(1,directory=os.path.join(directory,"w1"))
+        faulty=rpi_fakes.FakeW1Tree(1,crc_error_rate=0.1,power_on_rate=0.1,directory=os.path.join(directory,"w1 faulty"),seed=1)
+        driver=rpi_fakes.write_dht_driver(os.path.join(directory,"dht"),fail_rate=0.2)
+        parser=rpi_dht.AdafruitParser()
+        worker=rpi_dht.DHTWorker(driver,sudo=False)
+        checks=[
+            ("DS18B20",tree.devices()[0].readSensor),
+            ("DS18B20 20% faults",faulty.devices()[0].readSensor),
+            ("BMP085",rpi_sensors.BMP085("BMP085",bus=rpi_fakes.FakeBMP085Bus()).readSensor),
+            ("ULTRASONIC poll",rpi_sensors.UltraSonic("ULTRASONIC",23,24,gpio=gpio).readSensor),
+            ("ULTRASONIC 5 pings",rpi_sensors.UltraSonic("ULTRASONIC",25,26,pings=5,gpio=gpio).readSensor),
+            ("PIR events",rpi_sensors.PIR("PIR",17,events=True,gpio=gpio).readSensor),
+            ("DHT driver",lambda: rpi_dht.read_with_retries(lambda: rpi_dht.run_driver(driver,22,4),parser)),
+            ("DHT worker",lambda: worker.read(22,4)),
+        ]
+        results=[]
+        for name,check in checks:
+            middle,high=latency(check,runs)
+            results.append((name,middle,"ms"))
+            results.append((name+" p95",high,"ms"))
+        worker.close()
+        return [("latency",results)]
+    finally:
+        shutil.rmtree(directory)
+
+#runs in the new process: fake hardware, then rpi_nagios.py with the given arguments
+coldstart_code='''
+import sys
+base_dir=sys.argv.pop(1)
+import rpi_fakes
+gpio=rpi_fakes.FakeGPIO()
+gpio.echo(23,24,100.0)
+rpi_fakes.install(base_dir,gpio)
+import rpi_nagios
+sys.argv[0]="rpi_nagios.py"
+rpi_nagios.main()
+'''
+
+coldstart_checks=("DS18B20 -n 1","DS18B20 --all","BMP085","ULTRASONIC --trigger 23 --echo 24")
+
+def bench_coldstart(runs=10,python=sys.executable):
+    import rpi_fakes,shlex
+    here=os.path.dirname(os.path.abspath(__file__))
+    tree=rpi_fakes.FakeW1Tree(3)
+    results=[]
+    try:
+        with open(os.devnull,"w") as devnull:
+            commands=[("python",[python,"-c","pass"])]
+            commands+=[(check,[python,"-c",coldstart_code,tree.base_dir,"-s"]+shlex.split(check)) for check in coldstart_checks]
+            for name,command in commands:
+                times=[]
+                for run in range(runs):
+                    start=time.time()
+                    if subprocess.call(command,cwd=here,stdout=devnull):
+                        raise RuntimeError("check failed: "+name)
+                    times.append((time.time()-start)*1e3)
+                results.append((name,median(times),"ms"))
+    finally:
+        tree.close()
+    return [("coldstart",results)]
+
+def bench_sweep(counts=(1,2,5,10,20),conversion_time=0.75):
+    import rpi_fakes,rpi_sensors
+    results=[]
+    for count in counts:
+        tree=rpi_fakes.FakeW1Tree(count,conversion_time=conversion_time,bulk=False,simultaneous=True)
+        try:
+            devices=tree.devices()
+            start=time.time()
+            for device in devices:
+                device.read_temp()
+            results.append(("%d one by one" % count,time.time()-start,"s"))
+            bus=rpi_sensors.OneWireBus("DS18B20",devices,tree.base_dir,conversion_time)
+            start=time.time()
+            bus.read_temps()
+            results.append(("%d one conversion" % count,time.time()-start,"s"))
+        finally:
+            tree.close()
+    return [("sweep",results)]
+
+def bench_averaging(accuracies=(1,3,10,30,100)):
+    import rpi_estimators,rpi_fakes
+    tree=rpi_fakes.FakeW1Tree(1)
+    try:
+        device=tree.devices()[0]
+        results=[]
+        for accuracy in accuracies:
+            checks=rate(lambda: rpi_estimators.measure_sensor(device,accuracy))
+            results.append(("accuracy %d checks" % accuracy,checks))
+            results.append(("accuracy %d samples" % accuracy,checks*accuracy))
+    finally:
+        tree.close()
+    return [("averaging",results)]
+
+#git revision of the tree the benchmark ran on, None outside of git
+def revision():
+    try:
+        with open(os.devnull,"w") as devnull:
+            return subprocess.check_output(["git","rev-parse","--short","HEAD"],cwd=os.path.dirname(os.path.abspath(__file__)),stderr=devnull).strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def save_results(path,benchmark,results):
+    with open(path,"w") as f:
+        json.dump({"benchmark":benchmark,"revision":revision(),"time":time.time(),"results":results},f,indent=2)
+
+#{"title / name": value} of the results of any benchmark
+def flatten(results):
+    values=collections.OrderedDict()
+    for title,rows in results.items():
+        for row in rows:
+            values[title+" / "+row[0]]=row[1]
+    return values
+
+def print_comparison(path,results):
+    with open(path) as f:
+        saved=json.load(f)
+    before=flatten(saved["results"])
+    print "compared to",saved.get("revision") or path
+    for name,value in flatten(results).items():
+        if name in before and before[name]:
+            print "  %-40s %12.3f %12.3f %+8.1f%%" % (name,before[name],value,(value-before[name])*100.0/before[name])
+        else:
+            print "  %-40s %12s %12.3f" % (name,"-",value)
+
+#(name, value) is a rate per second, (name, value, unit) anything else
+def print_rates(title,rates):
+    print title
+    for rate in rates:
+        if len(rate) == 2:
+            print "  %-20s %10.0f /s" % rate
+        else:
+            print "  %-20s %10.3f %s" % rate
+
+def print_steps(title,steps):
+    print title
+    for step,usec in steps:
+        print "  %-20s %10.0f us" % (step,usec)
+
+def GetArgs():
+    parser = argparse.ArgumentParser(description='Benchmarks for rpi_sensors')
+    parser.add_argument('benchmark',  choices=("startup","estimators","history","latency","coldstart","sweep","averaging"), action='store', help='Benchmark to run')
+    parser.add_argument('-s', '--sensor',                               action='append', help='Sensor type (default: all)')
+    parser.add_argument('--runs',     type=int, default=10,             action='store', help='Number of runs')
+    parser.add_argument('--dir',      default=None,                     action='store', help='Directory for the history files (default: temp dir)')
+    parser.add_argument('--records',  type=int, default=1000000,        action='store', help='Records for the history benchmark')
+    parser.add_argument('--conversion', type=float, default=0.75,     action='store', help='Seconds of a DS18B20 conversion in the sweep')
+    parser.add_argument('--json',     default=False,               action='store_true', help='Print results as JSON')
+    parser.add_argument('--save',     default=None,                     action='store', help='Store the results as JSON in this file')
+    parser.add_argument('--compare',  default=None,                     action='store', help='Compare the results with the ones saved in this file')
+    return parser.parse_args()
+
+def main():
+    args=GetArgs()
+    results={}
+    if args.benchmark=="startup":
+        for sensor in args.sensor or sorted(sensor_drivers):
+            sensor=sensor.upper()
+            results[sensor]=bench_startup(sensor,args.runs)
+    elif args.benchmark=="estimators":
+        results=collections.OrderedDict(bench_estimators())
+    elif args.benchmark=="history":
+        results=collections.OrderedDict(bench_history(args.dir,args.records))
+    elif args.benchmark=="latency":
+        results=collections.OrderedDict(bench_latency(args.runs))
+    elif args.benchmark=="coldstart":
+        results=collections.OrderedDict(bench_coldstart(args.runs))
+    elif args.benchmark=="sweep":
+        results=collections.OrderedDict(bench_sweep(conversion_time=args.conversion))
+    elif args.benchmark=="averaging":
+        results=collections.OrderedDict(bench_averaging())
+    if args.save:
+        save_results(args.save,args.benchmark,results)
+    if args.compare:
+        print_comparison(args.compare,results)
+    elif args.json:
+        print json.dumps(results,indent=2)
+    elif args.benchmark=="startup":
+        for title in sorted(results):
+            print_steps(title,results[title])
+    else:
+        for title in results:
+            print_rates(title,results[title])
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Collector daemon: keeps the Sensor objects open, refreshes them in the
+# background and answers rpi_nagios.py over a local unix socket, so a check
+# does not have to import the drivers and read the hardware every time
+#
+# start:  python rpi_collector.py --socket /var/run/rpi_sensors.sock
+# check:  python rpi_nagios.py --socket /var/run/rpi_sensors.sock -s DHT -t 22 -p 4 -o nagios -w 30 -w 80 -c 35 -c 90
+#
+# A sensor is opened the first time a check asks for it and is refreshed every
+# --interval seconds until nobody asked for it for --idle seconds.
+# Reads are done one after the other in the main thread, every read with the
+# deadline of its sensor class (rpi_deadline).
+###############################################################################
+
+import SocketServer,Queue,argparse,json,os,socket,threading,time
+import rpi_nagios,rpi_sensors
+
+#the arguments of rpi_nagios.py which select a sensor
+spec_keys=("sensor","type","port","number","trigger","echo","edge","pings","events","oversampling","wire1","all","name")
+
+class CollectorUnavailable(Exception):
+    pass
+
+#one opened sensor with its last reading
+class Entry(object):
+    def __init__(self,spec):
+        self.spec=spec
+        self.sensor=None
+        self.name=spec.get("name") or spec.get("sensor")
+        self.measurements=[]
+        self.error=None
+        self.updated=0
+        self.requested=time.time()
+        self.ready=threading.Event()
+
+    def close(self):
+        if self.sensor:
+            self.sensor.close()
+            self.sensor=None
+
+    def reply(self):
+        if self.error:
+            return {"error":self.error}
+        return {"name":self.name,
+                "measurements":[(unit.value,unit.shortcode,unit.epoch) for unit in self.measurements]}
+
+class Collector(object):
+    def __init__(self,interval=60,idle=900,wait=30,dht_worker=None,history=None):
+        self.interval=interval
+        self.history=history
+        self.idle=idle
+        self.wait=wait
+        self.dht_worker=dht_worker
+        self.entries={}
+        self.lock=threading.Lock()
+        self.pending=Queue.Queue()
+
+    #called from the socket threads. new sensors are handed to the main thread
+    def get(self,spec):
+        key=tuple(spec.get(k) for k in spec_keys)
+        with self.lock:
+            entry=self.entries.get(key)
+            if entry is None:
+                entry=Entry(spec)
+                self.entries[key]=entry
+                self.pending.put(key)
+        entry.requested=time.time()
+        if not entry.ready.wait(self.wait):
+            return {"error":"sensor "+str(entry.name)+" not read yet"}
+        return entry.reply()
+
+    def refresh(self,entry):
+        try:
+            if entry.sensor is None:
+                entry.sensor=rpi_nagios.getSensor(argparse.Namespace(**entry.spec))
+                if not entry.sensor:
+                    raise ValueError("Did not get sensor back")
+                entry.name=entry.sensor.name
+                #all DHT share one driver worker instead of a sudo per read
+                if self.dht_worker and isinstance(entry.sensor,rpi_sensors.DHT):
+                    entry.sensor.worker=self.dht_worker
+                #RPi internals from open sysfs files and a cached voltage
+                if isinstance(entry.sensor,rpi_sensors.RPiSens) and not entry.sensor.sampler:
+                    entry.sensor.sampler=rpi_sensors.RPiSampler()
+            meas=entry.sensor.readSensor()
+            if not meas:
+                raise AttributeError("No measurements found")
+            entry.measurements=meas
+            entry.error=None
+            if self.history:
+                import rpi_history
+                self.history.record(rpi_history.series_name(entry.sensor),meas)
+        except Exception as e:
+            entry.error=str(e)
+        entry.updated=time.time()
+        entry.ready.set()
+
+    #closes the sensors no check asked for within <idle> seconds
+    #the edge detection of a PIR or UltraSonic is removed, so the pin can be set up again
+    def drop_idle(self,now):
+        idle=[]
+        with self.lock:
+            for key,entry in self.entries.items():
+                if now-entry.requested > self.idle:
+                    idle.append(self.entries.pop(key))
+        for entry in idle:
+            entry.close()
+
+    #main loop: read new sensors at once, the others when they are due
+    def run(self):
+        while True:
+            now=time.time()
+            self.drop_idle(now)
+            with self.lock:
+                due=[e for e in self.entries.values() if e.updated and now-e.updated >= self.interval]
+                nextdue=min([e.updated+self.interval for e in self.entries.values() if e.updated] or [now+self.interval])
+            for entry in due:
+                self.refresh(entry)
+            try:
+                key=self.pending.get(timeout=max(0,nextdue-time.time()))
+            except Queue.Empty:
+                continue
+            entry=self.entries.get(key)
+            if entry:
+                self.refresh(entry)
+
+    def close(self):
+        with self.lock:
+            entries=self.entries.values()
+            self.entries={}
+        for entry in entries:
+            entry.close()
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        try:
+            spec=json.loads(self.rfile.readline())
+            reply=self.server.collector.get(dict((k,spec.get(k)) for k in spec_keys))
+        except ValueError as e:
+            reply={"error":str(e)}
+        self.wfile.write(json.dumps(reply)+"\n")
+
+class CollectorServer(SocketServer.ThreadingUnixStreamServer):
+    daemon_threads=True
+
+    def __init__(self,path,collector,mode=0660):
+        if os.path.exists(path):
+            os.unlink(path)
+        SocketServer.ThreadingUnixStreamServer.__init__(self,path,RequestHandler)
+        os.chmod(path,mode)
+        self.collector=collector
+
+#client side used by rpi_nagios.py --socket
+#returns the same (name, measurements) as reading the sensor directly
+def query(path,args,timeout=35):
+    try:
+        sock=socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(path)
+    except socket.error as e:
+        raise CollectorUnavailable(str(e))
+    try:
+        sock.sendall(json.dumps(dict((k,getattr(args,k,None)) for k in spec_keys))+"\n")
+        reply=json.loads(sock.makefile("r").readline())
+    finally:
+        sock.close()
+    if "error" in reply:
+        raise ValueError(reply["error"])
+    meas=[]
+    for value,shortcode,timestamp in reply["measurements"]:
+        unit=rpi_sensors.MeasurementType(value,shortcode)
+        unit.epoch=timestamp
+        meas.append(unit)
+    return reply["name"],meas
+
+def GetArgs():
+    parser = argparse.ArgumentParser(description='Collector daemon serving cached sensor readings for rpi_nagios.py')
+    parser.add_argument('--socket',   required=True,                    action='store', help='Path of the unix socket')
+    parser.add_argument('--interval', type=float, default=60,           action='store', help='Seconds between two reads of a sensor')
+    parser.add_argument('--idle',     type=float, default=900,          action='store', help='Close a sensor when no check asked for it for this many seconds')
+    parser.add_argument('--mode',     default='660',                    action='store', help='Permissions of the unix socket (octal)')
+    parser.add_argument('--history',  default=None,                     action='store', help='Keep the measurements in ring buffers in this directory')
+    parser.add_argument('--dht-driver', default='/etc/nagios/nrpe.d/Adafruit_DHT', action='store', help='DHT driver used by the DHT worker, another one than the default runs without sudo')
+    parser.add_argument('--no-dht-worker', default=False,          action='store_true', help='Call the DHT driver with sudo for every read')
+    return parser.parse_args()
+
+def main():
+    args=GetArgs()
+    dht_worker=None
+    if not args.no_dht_worker:
+        import rpi_dht
+        dht_worker=rpi_dht.DHTWorker(args.dht_driver,sudo=args.dht_driver == rpi_dht.default_driver)
+    history=None
+    if args.history:
+        import rpi_history
+        history=rpi_history.HistoryStore(args.history)
+    collector=Collector(args.interval,args.idle,dht_worker=dht_worker,history=history)
+    server=CollectorServer(args.socket,collector,int(args.mode,8))
+    thread=threading.Thread(target=server.serve_forever)
+    thread.daemon=True
+    thread.start()
+    try:
+        collector.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        os.unlink(args.socket)
+        collector.close()
+        if dht_worker:
+            dht_worker.close()
+        if history:
+            history.close()
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Deadlines for sensor reads which work in every thread (the timeout module
+# uses SIGALRM: main thread only and one alarm per process).
+#
+# @timeout() starts a deadline for the read in the current thread. The budget
+# is the one of the sensor class, defaults below, overridden by the config file:
+#   [budgets]
+#   DHT = 30
+#   OneWire = 10
+#   [isolate]
+#   classes = OneWire
+# The reads give up at checkpoints: check(), sleep() and wait_readable() raise
+# DeadlineExceeded when the deadline passed or the read was cancelled, so the
+# loops of the sensors stop between two steps and leave the driver and the GPIO
+# pins in a known state. Driver binaries (DHT, vcgencmd) run with communicate(),
+# which kills them at the deadline. Classes listed in [isolate] (none by
+# default) are read in a child process which is terminated at the deadline, for
+# reads which may hang in the kernel (e.g. a w1_slave of a broken 1-wire bus),
+# which a checkpoint can not stop like the SIGALRM of the timeout module could.
+# That costs a fork per read, and a fork of a process with other threads (the
+# scheduler, the collector) may inherit a lock held by one of them, so a read is
+# only isolated while no other thread runs. A sensor with in_process=True
+# (fakes, replayed traces, their answers are in this process) is never isolated.
+###############################################################################
+
+import contextlib,functools,subprocess,threading,time
+
+config_file="/etc/nagios/nrpe.d/rpi_sensors.cfg"
+default_budget=10
+#seconds per read of a sensor class, the DHT needs pauses between its retries
+budgets={"DHT":30,"OneWire":10,"OneWireBus":15,"UltraSonic":5,"BMP085":5,"PIR":2,"RPiSens":10}
+#sensor classes read in a child process, e.g. "OneWire" ([isolate] classes)
+isolated=set()
+_loaded=False
+
+class DeadlineExceeded(Exception):
+    pass
+
+#reads the budgets and isolated classes of a config file, a missing file keeps the defaults
+def load_config(path=None):
+    global _loaded
+    import ConfigParser
+    config=ConfigParser.RawConfigParser()
+    config.optionxform=str
+    config.read(path or config_file)
+    if config.has_section("budgets"):
+        for name,seconds in config.items("budgets"):
+            budgets[name]=float(seconds)
+    if config.has_option("isolate","classes"):
+        isolated.clear()
+        isolated.update(name.strip() for name in config.get("isolate","classes").split(",") if name.strip())
+    _loaded=True
+
+#budget of a class or of the nearest base class with one
+def get_budget(cls):
+    if not _loaded:
+        load_config()
+    for base in cls.__mro__:
+        if base.__name__ in budgets:
+            return budgets[base.__name__]
+    return default_budget
+
+def is_isolated(cls):
+    if not _loaded:
+        load_config()
+    return any(base.__name__ in isolated for base in cls.__mro__)
+
+#rpi_sensors imports this module, so it is imported at the first call
+def _now():
+    import rpi_sensors
+    return rpi_sensors.monotonic()
+
+#children and cancel() of the deadlines of all threads
+_cancel_lock=threading.Lock()
+
+#A deadline is never later than the one it is nested in,
+#cancelling the outer one cancels the inner ones too (sets their event, so a
+#sleep() on the innermost one wakes up)
+class Deadline(object):
+    def __init__(self,seconds=None,parent=None):
+        self.end=None if seconds is None else _now()+seconds
+        self.parent=parent
+        if parent is not None and parent.end is not None and (self.end is None or parent.end < self.end):
+            self.end=parent.end
+        self.cancelled=threading.Event()
+        self.children=[]
+        if parent is not None:
+            with _cancel_lock:
+                parent.children.append(self)
+                if parent.cancelled.is_set():
+                    self.cancelled.set()
+
+    def cancel(self):
+        with _cancel_lock:
+            deadlines=[self]
+            while deadlines:
+                deadline=deadlines.pop()
+                deadline.cancelled.set()
+                deadlines.extend(deadline.children)
+
+    #the nested deadline is over
+    def close(self):
+        if self.parent is not None:
+            with _cancel_lock:
+                self.parent.children.remove(self)
+
+    def is_cancelled(self):
+        deadline=self
+        while deadline is not None:
+            if deadline.cancelled.is_set():
+                return True
+            deadline=deadline.parent
+        return False
+
+    #seconds left, None without a limit
+    def remaining(self):
+        if self.end is None:
+            return None
+        return max(0.0,self.end-_now())
+
+    def expired(self):
+        return self.is_cancelled() or self.remaining() == 0.0
+
+_local=threading.local()
+
+#innermost deadline of the current thread or None
+def current():
+    stack=getattr(_local,"stack",None)
+    return stack[-1] if stack else None
+
+@contextlib.contextmanager
+def deadline(seconds=None):
+    stack=getattr(_local,"stack",None)
+    if stack is None:
+        stack=_local.stack=[]
+    stack.append(Deadline(seconds,stack[-1] if stack else None))
+    try:
+        yield stack[-1]
+    finally:
+        stack.pop().close()
+
+#checkpoint: raises DeadlineExceeded if the read has to give up
+def check():
+    deadline=current()
+    if deadline is not None and deadline.expired():
+        raise DeadlineExceeded("cancelled" if deadline.is_cancelled() else "deadline exceeded")
+
+#sleep() returns at once in this thread, e.g. when replaying a trace the pauses
+#are already in the recorded times
+@contextlib.contextmanager
+def no_sleep():
+    previous=getattr(_local,"no_sleep",False)
+    _local.no_sleep=True
+    try:
+        yield
+    finally:
+        _local.no_sleep=previous
+
+#time.sleep which wakes up when the read is cancelled and does not sleep past the deadline
+def sleep(seconds):
+    if getattr(_local,"no_sleep",False):
+        check()
+        return
+    deadline=current()
+    if deadline is None:
+        time.sleep(seconds)
+        return
+    remaining=deadline.remaining()
+    if remaining is not None and remaining < seconds:
+        deadline.cancelled.wait(remaining)
+        raise DeadlineExceeded("deadline exceeded")
+    deadline.cancelled.wait(seconds)
+    check()
+
+#waits until a file (pipe) can be read without blocking past the deadline
+def wait_readable(stream):
+    import select
+    deadline=current()
+    remaining=deadline.remaining() if deadline else None
+    ready,_,_=select.select([stream],[],[],remaining)
+    if not ready:
+        raise DeadlineExceeded("deadline exceeded")
+    check()
+
+#Popen(args).communicate() which kills the process at the deadline
+#returns stdout like communicate()[0]
+def communicate(args):
+    process=subprocess.Popen(args,stdout=subprocess.PIPE)
+    deadline=current()
+    remaining=deadline.remaining() if deadline else None
+    killed=[]
+    def kill():
+        killed.append(True)
+        try:
+            process.kill()
+        except OSError:
+            pass
+    timer=None
+    if remaining is not None:
+        timer=threading.Timer(remaining,kill)
+        timer.daemon=True
+        timer.start()
+    try:
+        output=process.communicate()[0]
+    finally:
+        if timer:
+            timer.cancel()
+    if killed:
+        raise DeadlineExceeded("killed "+args[0]+" at the deadline")
+    return output
+
+#the read stats (rpi_stats) of the child go back with the result
+def _child(function,args,kwargs,connection):
+    import rpi_stats
+    #the counts of the parent came along with the fork
+    rpi_stats.reset()
+    try:
+        ok,result=True,function(*args,**kwargs)
+    except Exception as e:
+        ok,result=False,e
+    connection.send((ok,result,rpi_stats.snapshot() if rpi_stats.enabled else None))
+    connection.close()
+
+#runs function in a child process which is terminated at the deadline
+#the result (and an exception) must be picklable
+def call_in_process(function,*args,**kwargs):
+    #only reads of isolated classes need it, a check does not pay for the import
+    import multiprocessing
+    receiver,sender=multiprocessing.Pipe(False)
+    process=multiprocessing.Process(target=_child,args=(function,args,kwargs,sender))
+    process.daemon=True
+    process.start()
+    sender.close()
+    try:
+        #in steps, so a cancelled read is noticed before its deadline
+        while not receiver.poll(0.1):
+            check()
+        try:
+            ok,result,stats=receiver.recv()
+        except EOFError:
+            raise IOError("read process died")
+        import rpi_stats
+        rpi_stats.add(stats)
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        receiver.close()
+    if not ok:
+        raise result
+    return result
+
+#decorator for readSensor: the read runs with the budget of the sensor class
+#(or <seconds>), in a child process if the class is isolated and this is the only thread
+def timeout(seconds=None):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(self,*args,**kwargs):
+            with deadline(seconds if seconds is not None else get_budget(self.__class__)):
+                if is_isolated(self.__class__) and not getattr(self,"in_process",False) and threading.active_count() == 1:
+                    return call_in_process(function,self,*args,**kwargs)
+                return function(self,*args,**kwargs)
+        return wrapper
+    return decorator
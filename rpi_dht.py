@@ -0,0 +1,245 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# DHT11/DHT22/AM2302 driver output parsing and a long-lived worker for it
+#
+# The worker is started once (with sudo, the driver needs root) and is asked for
+# readings over its stdin/stdout. Every message is a frame: 4 bytes length (big
+# endian) followed by a JSON object.
+#   request:  {"type": 22, "port": 4}
+#   reply:    {"temp": 21.3, "hum": 45.2, "time": 1400000000.0, "cached": false}
+#             {"error": "..."}
+# The worker never reads a sensor faster than its minimum sampling interval and
+# answers with the last good reading instead. Failed reads are retried a few
+# times with a growing pause, never endlessly. After a failed read the last good
+# reading is only given while it is younger than max_age seconds, a dead sensor
+# is an error.
+#
+# Run with sudo the worker only runs default_driver, so the sudoers entry
+# of rpi_dht.py gives no other binary root rights. Run the worker by hand (e.g.
+# against a fake driver script):
+# python rpi_dht.py --driver ./fake_dht
+###############################################################################
+
+import argparse,json,os,struct,subprocess,sys,threading,time
+import rpi_deadline,rpi_stats
+
+default_driver="/etc/nagios/nrpe.d/Adafruit_DHT"
+
+#seconds a sensor needs between two reads
+min_intervals={"11":1.0,"22":2.0,"2302":2.0}
+#seconds the last good reading stands in for a failed read
+max_age=30
+
+class DHTError(Exception):
+    pass
+
+#the driver gave no (complete) reading this time, reading again may help
+class DHTRetry(DHTError):
+    pass
+
+#parses the output of the Adafruit_DHT binary:
+#  Using pin #4
+#  Data (40): 0x2 0x8c 0x0 0xd5 0x63
+#  Temp =  21.3 *C, Hum = 65.2 %
+class AdafruitParser(object):
+    def parse(self,lines):
+        if len(lines)<1:
+            raise DHTError("no such file or not enough rights")
+        if len(lines)==1:
+            raise DHTError(str(lines))
+        #check if DHT is connected
+        if lines[1].find("Data (0): 0x0 0x0 0x0 0x0 0x0") != -1:
+            raise DHTError("DHT not connected")
+        if len(lines) != 3:
+            raise DHTRetry("incomplete reading")
+        temp_pos = lines[2].find('Temp = ')
+        hum_pos = lines[2].find('Hum = ')
+        if temp_pos == -1 or hum_pos == -1:
+            raise DHTRetry("incomplete reading")
+        #Filter empty tuples due to double spaces in Adafruit Driver
+        filtered_output=filter(None, lines[2].split(' '))
+        temp_c = round(float(filtered_output[2]), 3)
+        hum = float(filtered_output[6])
+        return temp_c, hum
+
+parsers={"adafruit":AdafruitParser}
+
+#runs the driver once and returns its output lines
+#the driver is killed when the deadline of the read (rpi_deadline) passes
+def run_driver(driver,type,port,sudo=False):
+    args = (driver, str(type), str(port))
+    if sudo:
+        args = ("sudo",)+args
+    rpi_stats.count("spawns")
+    with rpi_stats.timer("driver"):
+        return rpi_deadline.communicate(args).strip().split("\n")
+
+#reads with the parser until it gets a reading, at most <retries> times
+#the pause between two tries starts at <backoff> seconds and doubles every time
+def read_with_retries(read_raw,parser,retries=5,backoff=0.3,max_backoff=5.0):
+    delay=backoff
+    for attempt in range(retries):
+        if attempt:
+            rpi_stats.count("retries")
+            rpi_deadline.sleep(delay)
+            delay=min(delay*2,max_backoff)
+        try:
+            return parser.parse(read_raw())
+        except DHTRetry:
+            pass
+    raise DHTRetry("no reading after "+str(retries)+" tries")
+
+def write_frame(stream,message):
+    data=json.dumps(message)
+    stream.write(struct.pack(">I",len(data))+data)
+    stream.flush()
+
+#None when the other side closed the pipe
+def read_frame(stream):
+    header=stream.read(4)
+    if len(header) < 4:
+        return None
+    length,=struct.unpack(">I",header)
+    return json.loads(stream.read(length))
+
+#worker side: the driver calls and the last good reading per sensor
+class DHTServer(object):
+    def __init__(self,driver=default_driver,parser=None,retries=5,max_age=max_age):
+        self.driver=driver
+        self.parser=parser or AdafruitParser()
+        self.retries=retries
+        self.max_age=max_age
+        #(type, port) -> (time of the last read, last good reply)
+        self.sensors={}
+
+    def read(self,type,port):
+        key=(str(type),str(port))
+        last_read,last_good=self.sensors.get(key,(0,None))
+        min_interval=min_intervals.get(key[0],2.0)
+        now=time.time()
+        if last_good and now-last_read < min_interval:
+            return dict(last_good,cached=True)
+        #the sensor must rest before it can be read again
+        if now-last_read < min_interval:
+            time.sleep(min_interval-(now-last_read))
+        try:
+            temp_c,hum=read_with_retries(lambda: run_driver(self.driver,type,port),self.parser,self.retries,min_interval)
+        except DHTError as e:
+            #a reading older than max_age is not given again, the check gets UNKNOWN
+            if last_good and time.time()-last_good["time"] > self.max_age:
+                last_good=None
+            self.sensors[key]=(time.time(),last_good)
+            if last_good:
+                return dict(last_good,cached=True)
+            return {"error":str(e)}
+        reply={"temp":temp_c,"hum":hum,"time":time.time(),"cached":False}
+        self.sensors[key]=(reply["time"],reply)
+        return reply
+
+    def serve(self,instream,outstream):
+        while True:
+            request=read_frame(instream)
+            if request is None:
+                break
+            try:
+                reply=self.read(request["type"],request["port"])
+            except Exception as e:
+                reply={"error":str(e)}
+            write_frame(outstream,reply)
+
+#client side: starts the worker on first use and restarts it if it died
+class DHTWorker(object):
+    def __init__(self,driver=default_driver,sudo=True,parser="adafruit",python=sys.executable):
+        self.args=[python,os.path.abspath(__file__).replace(".pyc",".py"),"--parser",parser]
+        if sudo:
+            #the worker runs no other driver as root
+            if driver != default_driver:
+                raise ValueError("only "+default_driver+" runs with sudo")
+            self.args=["sudo"]+self.args
+        elif driver != default_driver:
+            self.args+=["--driver",driver]
+        self.process=None
+        #workers given up on which may still run, waited for when they have quit
+        self.abandoned=[]
+        self.lock=threading.Lock()
+
+    def start(self):
+        self.reap()
+        rpi_stats.count("spawns")
+        self.process=subprocess.Popen(self.args,stdin=subprocess.PIPE,stdout=subprocess.PIPE)
+
+    #the worker is not asked again, it quits when it sees its stdin closed
+    #(its stdout stays open until then, so it can still write the reply)
+    def abandon(self):
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        self.abandoned.append(self.process)
+        self.process=None
+        self.reap()
+
+    #waits for the abandoned workers which have quit, so they leave no zombies
+    def reap(self):
+        running=[]
+        for process in self.abandoned:
+            if process.poll() is None:
+                running.append(process)
+            else:
+                process.stdout.close()
+        self.abandoned=running
+
+    #returns (temperature, humidity) or None like DHT.read_temp_hum
+    def read(self,type,port):
+        with self.lock:
+            for attempt in range(2):
+                if self.process is None or self.process.poll() is not None:
+                    self.start()
+                try:
+                    write_frame(self.process.stdin,{"type":type,"port":port})
+                    rpi_deadline.wait_readable(self.process.stdout)
+                    reply=read_frame(self.process.stdout)
+                except IOError:
+                    reply=None
+                except rpi_deadline.DeadlineExceeded:
+                    #the reply would be read by the next request, the worker is left
+                    #to finish it
+                    self.abandon()
+                    raise
+                if reply is not None:
+                    break
+                self.abandon()
+            else:
+                raise DHTError("DHT worker died")
+        if "error" in reply:
+            print reply["error"]
+            return None
+        return reply["temp"],reply["hum"]
+
+    def close(self):
+        with self.lock:
+            if self.process and self.process.poll() is None:
+                self.process.stdin.close()
+                self.process.wait()
+            self.process=None
+            self.reap()
+
+def GetArgs():
+    parser = argparse.ArgumentParser(description='DHT worker answering reading requests on stdin/stdout')
+    parser.add_argument('--driver',    default=default_driver,          action='store', help='DHT driver binary or a fake driver script')
+    parser.add_argument('--parser',    default='adafruit',              action='store', help='Parser of the driver output', choices=sorted(parsers))
+    parser.add_argument('--retries',   type=int, default=5,             action='store', help='Tries per reading')
+    return parser.parse_args()
+
+def main():
+    args=GetArgs()
+    #sudo must not run any binary given on the command line (sudo sets SUDO_UID)
+    if os.geteuid() == 0 and "SUDO_UID" in os.environ and args.driver != default_driver:
+        sys.exit("--driver is not allowed as root")
+    DHTServer(args.driver,parsers[args.parser](),args.retries).serve(sys.stdin,sys.stdout)
+
+if __name__=="__main__":
+    main()
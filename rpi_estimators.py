@@ -0,0 +1,265 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Estimators for noisy sensors: trimmed mean, median and MAD (median absolute
+# deviation) over a sliding window of the last N samples.
+#
+# SlidingWindow keeps the samples sorted in an indexable skiplist. Every link of
+# the skiplist knows how many samples it skips and their sum, so adding a sample,
+# dropping the oldest one and all three estimates cost O(log n) instead of
+# sorting the whole window again.
+#
+# trimmed_mean_columns()/median_columns() are the batch path for tuples of
+# values (e.g. temperature and humidity of a DHT). They use numpy if installed.
+###############################################################################
+
+import collections,math,random,time
+
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
+#samples cut on each side: the two outer thirds like measure_average always did
+#this only makes sense from 4 samples
+def trim_count(n):
+    if n > 3:
+        return n//3
+    return 0
+
+class _Node(object):
+    __slots__=("value","next","width","sum")
+    def __init__(self,value,levels):
+        self.value=value
+        self.next=[None]*levels
+        #width: samples skipped by the link, sum: their sum (incl. the target)
+        self.width=[1]*levels
+        self.sum=[0.0]*levels
+
+#Sorted container with O(log n) insert, remove, access by index and prefix sums
+#Based on the indexable skiplist recipe of Raymond Hettinger
+class IndexableSkiplist(object):
+    def __init__(self,expected_size=100):
+        self.size=0
+        self.maxlevels=int(1+math.log(max(expected_size,2),2))
+        self.nil=_Node(float("inf"),0)
+        self.head=_Node(None,self.maxlevels)
+        self.head.next=[self.nil]*self.maxlevels
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self,i):
+        if i < 0:
+            i+=self.size
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        node=self.head
+        i+=1
+        for level in reversed(range(self.maxlevels)):
+            while node.width[level] <= i:
+                i-=node.width[level]
+                node=node.next[level]
+        return node.value
+
+    def __iter__(self):
+        node=self.head.next[0]
+        while node is not self.nil:
+            yield node.value
+            node=node.next[0]
+
+    def insert(self,value):
+        chain=[None]*self.maxlevels
+        steps_at_level=[0]*self.maxlevels
+        sums_at_level=[0.0]*self.maxlevels
+        node=self.head
+        for level in reversed(range(self.maxlevels)):
+            while node.next[level].value <= value:
+                steps_at_level[level]+=node.width[level]
+                sums_at_level[level]+=node.sum[level]
+                node=node.next[level]
+            chain[level]=node
+        levels=min(self.maxlevels,1-int(math.log(1.0-random.random(),2.0)))
+        newnode=_Node(value,levels)
+        steps=0
+        sums=0.0
+        for level in range(levels):
+            prevnode=chain[level]
+            newnode.next[level]=prevnode.next[level]
+            prevnode.next[level]=newnode
+            newnode.width[level]=prevnode.width[level]-steps
+            newnode.sum[level]=prevnode.sum[level]-sums
+            prevnode.width[level]=steps+1
+            prevnode.sum[level]=sums+value
+            steps+=steps_at_level[level]
+            sums+=sums_at_level[level]
+        for level in range(levels,self.maxlevels):
+            chain[level].width[level]+=1
+            chain[level].sum[level]+=value
+        self.size+=1
+
+    def remove(self,value):
+        chain=[None]*self.maxlevels
+        node=self.head
+        for level in reversed(range(self.maxlevels)):
+            while node.next[level].value < value:
+                node=node.next[level]
+            chain[level]=node
+        node=chain[0].next[0]
+        if node is self.nil or node.value != value:
+            raise KeyError(value)
+        levels=len(node.next)
+        for level in range(levels):
+            prevnode=chain[level]
+            prevnode.width[level]+=node.width[level]-1
+            prevnode.sum[level]+=node.sum[level]-value
+            prevnode.next[level]=node.next[level]
+        for level in range(levels,self.maxlevels):
+            chain[level].width[level]-=1
+            chain[level].sum[level]-=value
+        self.size-=1
+
+    #number of values smaller than value
+    def rank(self,value):
+        node=self.head
+        count=0
+        for level in reversed(range(self.maxlevels)):
+            while node.next[level].value < value:
+                count+=node.width[level]
+                node=node.next[level]
+        return count
+
+    #sum of the smallest count values
+    def prefix_sum(self,count):
+        node=self.head
+        total=0.0
+        for level in reversed(range(self.maxlevels)):
+            while node.width[level] <= count:
+                count-=node.width[level]
+                total+=node.sum[level]
+                node=node.next[level]
+        return total
+
+#The last <size> samples with O(log n) trimmed mean, median and MAD
+class SlidingWindow(object):
+    def __init__(self,size):
+        self.samples=collections.deque()
+        self.size=size
+        self.sorted=IndexableSkiplist(size)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self,value):
+        if len(self.samples) == self.size:
+            self.sorted.remove(self.samples.popleft())
+        self.samples.append(value)
+        self.sorted.insert(value)
+
+    def median(self):
+        n=len(self.sorted)
+        if n == 0:
+            return None
+        if n%2:
+            return self.sorted[n//2]
+        return (self.sorted[n//2-1]+self.sorted[n//2])/2.0
+
+    #mean without the <cut> smallest and largest samples
+    def trimmed_mean(self,cut=None):
+        n=len(self.sorted)
+        if cut is None:
+            cut=trim_count(n)
+        if n-2*cut <= 0:
+            return None
+        return (self.sorted.prefix_sum(n-cut)-self.sorted.prefix_sum(cut))/(n-2*cut)
+
+    #median of the distances to the median. The distances of the samples below
+    #and above the median are two sorted sequences, so the k-th smallest distance
+    #is found by a binary search over both (O(log^2 n))
+    def mad(self):
+        n=len(self.sorted)
+        if n == 0:
+            return None
+        center=self.median()
+        below=self.sorted.rank(center)
+        above=n-below
+        def lower(i):
+            return center-self.sorted[below-1-i]
+        def upper(i):
+            return self.sorted[below+i]-center
+        def kth(k):
+            lo,hi=max(0,k+1-above),min(k+1,below)
+            while lo < hi:
+                i=(lo+hi)//2
+                j=k+1-i
+                if j > 0 and i < below and upper(j-1) > lower(i):
+                    lo=i+1
+                else:
+                    hi=i
+            j=k+1-lo
+            candidates=[]
+            if lo > 0:
+                candidates.append(lower(lo-1))
+            if j > 0:
+                candidates.append(upper(j-1))
+            return max(candidates)
+        if n%2:
+            return kth(n//2)
+        return (kth(n//2-1)+kth(n//2))/2.0
+
+#trimmed mean of every column of a list of tuples
+def trimmed_mean_columns(samples,cut=None):
+    n=len(samples)
+    if cut is None:
+        cut=trim_count(n)
+    if n-2*cut <= 0:
+        return None
+    if numpy is not None:
+        values=numpy.sort(numpy.asarray(samples,dtype=float),axis=0)
+        return tuple(values[cut:n-cut].mean(axis=0).tolist())
+    columns=[sorted(column)[cut:n-cut] for column in zip(*samples)]
+    return tuple(sum(column)/float(len(column)) for column in columns)
+
+#median of every column of a list of tuples
+def median_columns(samples):
+    if not samples:
+        return None
+    if numpy is not None:
+        return tuple(numpy.median(numpy.asarray(samples,dtype=float),axis=0).tolist())
+    n=len(samples)
+    columns=[sorted(column) for column in zip(*samples)]
+    if n%2:
+        return tuple(column[n//2] for column in columns)
+    return tuple((column[n//2-1]+column[n//2])/2.0 for column in columns)
+
+def is_numeric(value):
+    return isinstance(value,(int,long,float)) and not isinstance(value,bool)
+
+#Reads a sensor <accuracy> times and returns its measurements with the trimmed
+#mean of every numeric value (rpi_nagios.py --accuracy).
+#Other values (e.g. motion detected) are the ones of the last read
+def measure_sensor(sensor,accuracy,sleeptime=0):
+    import rpi_sensors
+    readings=[]
+    for round in range(accuracy):
+        if round and sleeptime:
+            time.sleep(sleeptime)
+        meas=sensor.readSensor()
+        if meas:
+            readings.append(meas)
+    if not readings:
+        return []
+    last=readings[-1]
+    #only positions which were read every time and are numbers
+    readings=[meas for meas in readings if len(meas) == len(last)]
+    numeric=[index for index,unit in enumerate(last) if all(is_numeric(meas[index].value) for meas in readings)]
+    means=trimmed_mean_columns([tuple(meas[index].value for index in numeric) for meas in readings]) if numeric else ()
+    values=dict(zip(numeric,means))
+    result=[]
+    for index,unit in enumerate(last):
+        averaged=rpi_sensors.MeasurementType(values.get(index,unit.value),unit.shortcode,unit.longname,unit.shortname,unit.mtype)
+        averaged.epoch=unit.epoch
+        result.append(averaged)
+    return result
@@ -0,0 +1,201 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Prometheus exporter: serves the sensors on http://<pi>:9105/metrics
+#   python rpi_exporter.py -b "DHT -t 22 -p 4" -b "DS18B20 --all" -b "RPI" --fresh 15
+#
+# rpi_sensor_<type>{sensor="<name>",unit="<shortcode>"} per value, the type
+# comes from the mtype of the measurement (t: temperature, h: humidity, ...)
+# plus read duration, reads, errors and the time of the last good reading per sensor.
+#
+# A reading is kept for --fresh seconds. Scrapes in that time get the cached
+# reading and never touch the hardware. When it is too old the first scrape
+# reads the sensor, scrapes coming in meanwhile get the old reading (or wait for
+# the very first one), so the hardware is read at most once per --fresh seconds
+# however many Prometheus servers scrape. The page is only rendered again when
+# a reading changed.
+###############################################################################
+
+import BaseHTTPServer,SocketServer,argparse,threading,time
+import rpi_nagios,rpi_sensors
+
+#metric name per mtype
+metric_names={"t":"temperature","h":"humidity","p":"pressure","m":"distance","b":"motion","s":"frequency",
+               "v":"voltage","n":"count","time":"seconds_since","r":"ratio"}
+
+def metric_name(mtype):
+    return "rpi_sensor_"+metric_names.get(mtype,mtype)
+
+#label value with \, " and newlines escaped
+def escape(value):
+    return str(value).strip().replace("\\","\\\\").replace("\"","\\\"").replace("\n","\\n")
+
+#one sensor with its last reading and a lock so only one thread reads it
+class CachedSensor(object):
+    def __init__(self,sensor,accuracy=None):
+        self.sensor=sensor
+        self.accuracy=accuracy
+        self.lock=threading.Lock()
+        self.done=threading.Condition(self.lock)
+        self.reading=False
+        self.measurements=None
+        #monotonic time of the last read, also of a failed one
+        self.attempted=0.0
+        self.epoch=None
+        self.duration=0.0
+        self.reads=0
+        self.errors=0
+        self.version=0
+
+    #the last reading, read again if it is older than <fresh> seconds
+    def get(self,fresh):
+        with self.lock:
+            if self.measurements is not None and rpi_sensors.monotonic()-self.attempted < fresh:
+                return self.measurements
+            if self.reading:
+                #another scrape is reading, wait only if there is nothing to give yet
+                while self.reading and self.measurements is None:
+                    self.done.wait()
+                return self.measurements
+            self.reading=True
+        start=rpi_sensors.monotonic()
+        measurements=None
+        try:
+            if self.accuracy:
+                import rpi_estimators
+                measurements=rpi_estimators.measure_sensor(self.sensor,self.accuracy)
+            else:
+                measurements=self.sensor.readSensor()
+        except Exception:
+            pass
+        end=rpi_sensors.monotonic()
+        with self.lock:
+            self.reading=False
+            self.reads+=1
+            self.duration=end-start
+            self.attempted=end
+            #DHT gives an empty list when the driver got no reading
+            if not measurements:
+                self.errors+=1
+                #keep the last reading, a broken sensor is tried once per <fresh> too
+                if self.measurements is None:
+                    self.measurements=[]
+            else:
+                self.measurements=measurements
+                self.epoch=time.time()
+            self.version+=1
+            self.done.notify_all()
+            return self.measurements
+
+class Exporter(object):
+    def __init__(self,sensors,fresh=10):
+        self.sensors=sensors
+        self.fresh=fresh
+        self.lock=threading.Lock()
+        self.page=None
+        self.page_versions=None
+
+    def metrics(self):
+        for sensor in self.sensors:
+            sensor.get(self.fresh)
+        versions=tuple(sensor.version for sensor in self.sensors)
+        with self.lock:
+            if versions != self.page_versions:
+                self.page=self.render()
+                self.page_versions=versions
+            return self.page
+
+    #Prometheus text format, the samples of one metric grouped under its TYPE line
+    def render(self):
+        families={}
+        for cached in self.sensors:
+            name=escape(cached.sensor.name)
+            with cached.lock:
+                measurements=cached.measurements or []
+                stats=(cached.duration,cached.reads,cached.errors,cached.epoch)
+            labels=[(unit.mtype,unit.shortcode) for unit in measurements]
+            for unit in measurements:
+                if isinstance(unit.value,bool):
+                    value=int(unit.value)
+                elif isinstance(unit.value,(int,long,float)):
+                    value=unit.value
+                else:
+                    continue
+                label='sensor="'+name+'",unit="'+escape(unit.shortcode)+'"'
+                #e.g. all DS18B20 of a bus: the device id is in the longname
+                if labels.count((unit.mtype,unit.shortcode)) > 1:
+                    label+=',device="'+escape(unit.longname.replace(rpi_sensors.units.get(unit.shortcode,rpi_sensors.undefined_unit)[0],""))+'"'
+                families.setdefault((metric_name(unit.mtype),"gauge"),[]).append("{"+label+"} "+repr(float(value)))
+            duration,reads,errors,epoch=stats
+            label='{sensor="'+name+'"} '
+            families.setdefault(("rpi_sensor_read_duration_seconds","gauge"),[]).append(label+repr(duration))
+            families.setdefault(("rpi_sensor_reads_total","counter"),[]).append(label+str(reads))
+            families.setdefault(("rpi_sensor_read_errors_total","counter"),[]).append(label+str(errors))
+            if epoch:
+                families.setdefault(("rpi_sensor_last_reading_timestamp_seconds","gauge"),[]).append(label+repr(epoch))
+        lines=[]
+        for (family,kind),samples in sorted(families.items()):
+            lines.append("# TYPE "+family+" "+kind)
+            lines.extend(family+sample for sample in samples)
+        return "\n".join(lines)+"\n"
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    #keep-alive, a scraper reuses its connection
+    protocol_version="HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body=self.server.exporter.metrics()
+        self.send_response(200)
+        self.send_header("Content-Type","text/plain; version=0.0.4")
+        self.send_header("Content-Length",str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    #no line on stderr for every scrape
+    def log_message(self,format,*args):
+        pass
+
+class ExporterServer(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+    daemon_threads=True
+    allow_reuse_address=True
+
+    def __init__(self,address,exporter):
+        BaseHTTPServer.HTTPServer.__init__(self,address,MetricsHandler)
+        self.exporter=exporter
+
+def GetArgs():
+    parser = argparse.ArgumentParser(description='Prometheus exporter of the sensors')
+    parser.add_argument('-b', '--batch',     required=True,           action='append', help='Sensor with the options of rpi_nagios.py, e.g. "DHT -t 22 -p 4"')
+    parser.add_argument(      '--fresh',     type=float, default=10,  action='store', help='Seconds a reading is served without reading the sensor again')
+    parser.add_argument(      '--listen',    default='',              action='store', help='Address to listen on')
+    parser.add_argument(      '--port',      type=int, default=9105,  action='store', help='Port to listen on')
+    return parser.parse_args()
+
+def main():
+    args=GetArgs()
+    args.output="standard"
+    args.decimals=1
+    args.socket=None
+    sensors=[]
+    for spec in args.batch:
+        specargs=rpi_nagios.parseSpec(spec,args)
+        sensor=rpi_nagios.getSensor(specargs)
+        if not sensor:
+            raise ValueError("Did not get sensor back: "+spec)
+        sensors.append(CachedSensor(sensor,specargs.accuracy))
+    server=ExporterServer((args.listen,args.port),Exporter(sensors,args.fresh))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        rpi_sensors.cleanup()
+
+if __name__=="__main__":
+    main()
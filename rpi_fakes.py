@@ -0,0 +1,294 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Fake hardware to run the sensors without a Pi (benchmarks, trying things out)
+#
+# FakeBMP085Bus: smbus with the register map of a BMP085, counts the bus
+#                transactions. Default values are the example of the datasheet
+#                (15.0 deg C, 69964 Pa in every oversampling mode)
+# FakeW1Tree:    temp dir with the sysfs tree of a w1 master and N DS18B20.
+#                Reads can fail with a wrong CRC or give the power on value of
+#                85 deg C at a given rate. A read of a w1_slave takes
+#                conversion_time like on the bus, simultaneous adds the owfs
+#                files to convert all at once (simultaneous, latesttemperature)
+# FakeGPIO:      RPi.GPIO with scripted edges: the echo of an HC-SR04 after
+#                every trigger pulse and the motions of a PIR
+# write_dht_driver: script printing the output of the Adafruit DHT driver
+# install():     makes rpi_sensors and rpi_nagios use the fakes
+#
+# bus=rpi_fakes.FakeBMP085Bus()
+# sensor=rpi_sensors.BMP085("BMP085",bus=bus)
+#
+# tree=rpi_fakes.FakeW1Tree(10,crc_error_rate=0.05)
+# sensors=tree.devices()
+#
+# gpio=rpi_fakes.FakeGPIO()
+# gpio.echo(23,24,distance=120)
+# sensor=rpi_sensors.UltraSonic("US",23,24,edge=True,gpio=gpio)
+###############################################################################
+
+import heapq,itertools,os,random,shutil,stat,struct,sys,tempfile,threading,time
+import rpi_sensors
+
+#AC1 AC2 AC3 AC4 AC5 AC6 B1 B2 MB MC MD of the datasheet example
+datasheet_calibration=(408,-72,-14383,32741,32757,23153,6190,4,-32768,-8711,2868)
+
+class FakeBMP085Bus(object):
+    def __init__(self,calibration=datasheet_calibration,raw_temp=27898,raw_pressure=23843,address=0x77):
+        self.address=address
+        self.raw_temp=raw_temp
+        self.raw_pressure=raw_pressure
+        self.registers=[0]*256
+        self.registers[0xAA:0xC0]=[ord(byte) for byte in struct.pack(">hhhHHHhhhhh",*calibration)]
+        self.transactions=0
+        self.reads=0
+        self.writes=0
+
+    def check(self,address):
+        self.transactions+=1
+        if address != self.address:
+            raise IOError("no device at address "+hex(address))
+
+    #a write to 0xF4 starts a conversion, its result is at 0xF6
+    def write_byte_data(self,address,register,value):
+        self.check(address)
+        self.writes+=1
+        self.registers[register]=value
+        if register == 0xF4:
+            if value == 0x2E:
+                self.registers[0xF6:0xF8]=[self.raw_temp>>8,self.raw_temp&0xFF]
+            elif value & 0x3F == 0x34:
+                #raw_pressure is UP of oss 0, with oss <mode> the same pressure
+                #gives UP<<mode, which the driver reads as the top 16+mode of 24 bits
+                mode=value>>6
+                raw=(self.raw_pressure<<mode)<<(8-mode)
+                self.registers[0xF6:0xF9]=[(raw>>16)&0xFF,(raw>>8)&0xFF,raw&0xFF]
+
+    def read_byte_data(self,address,register):
+        self.check(address)
+        self.reads+=1
+        return self.registers[register]
+
+    def read_i2c_block_data(self,address,register,length=32):
+        self.check(address)
+        self.reads+=1
+        return self.registers[register:register+length]
+
+#smbus module whose buses are one FakeBMP085Bus
+class FakeSMBus(object):
+    def __init__(self,bus=None):
+        self.bus=bus or FakeBMP085Bus()
+
+    def SMBus(self,busnum):
+        return self.bus
+
+#content of a w1_slave file, t= in milli degree Celsius
+def w1_slave(millis,crc=True):
+    return "72 01 4b 46 7f ff 0e 10 57 : crc=57 "+("YES" if crc else "NO")+"\n72 01 4b 46 7f ff 0e 10 57 t="+str(millis)+"\n"
+
+class FakeW1Tree(object):
+    def __init__(self,count=1,temp=21.5,crc_error_rate=0.0,power_on_rate=0.0,conversion_time=0.0,bulk=True,simultaneous=False,directory=None,seed=None):
+        self.directory=directory or tempfile.mkdtemp(prefix="rpi_w1_")
+        self.base_dir=os.path.join(self.directory,"")
+        self.crc_error_rate=crc_error_rate
+        self.power_on_rate=power_on_rate
+        self.conversion_time=conversion_time
+        self.simultaneous=simultaneous
+        self.random=random.Random(seed)
+        self.reads=0
+        self.crc_errors=0
+        self.power_on_values=0
+        self.device_ids=["28-%012x" % (0x4a2b3c40+i) for i in range(count)]
+        master=os.path.join(self.directory,"w1_bus_master1")
+        os.makedirs(master)
+        with open(os.path.join(master,"w1_master_slaves"),"w") as f:
+            f.write("".join(device_id+"\n" for device_id in self.device_ids))
+        if bulk:
+            with open(os.path.join(master,"therm_bulk_read"),"w") as f:
+                f.write("1\n")
+        if simultaneous:
+            os.makedirs(os.path.join(self.directory,"simultaneous"))
+            with open(os.path.join(self.directory,"simultaneous","temperature"),"w") as f:
+                f.write("0")
+        for i,device_id in enumerate(self.device_ids):
+            os.makedirs(os.path.join(self.directory,device_id))
+            self.set_temp(i,temp+i/10.0)
+
+    def set_temp(self,index,temp):
+        with open(os.path.join(self.directory,self.device_ids[index],"w1_slave"),"w") as f:
+            f.write(w1_slave(int(round(temp*1000))))
+        if self.simultaneous:
+            with open(os.path.join(self.directory,self.device_ids[index],"latesttemperature"),"w") as f:
+                f.write(str(temp)+"\n")
+
+    #read_temp_raw of an attached OneWire, the failures are decided per read
+    def read(self,device_file):
+        self.reads+=1
+        if self.conversion_time:
+            time.sleep(self.conversion_time)
+        with open(device_file,"r") as f:
+            lines=f.readlines()
+        chance=self.random.random()
+        if chance < self.crc_error_rate:
+            self.crc_errors+=1
+            return w1_slave(0,crc=False).splitlines(True)
+        if chance < self.crc_error_rate+self.power_on_rate:
+            self.power_on_values+=1
+            return w1_slave(85000).splitlines(True)
+        return lines
+
+    #the failures are counted in this process, so the device is never read in a child (rpi_deadline)
+    def attach(self,device):
+        device.read_temp_raw=lambda: self.read(device.device_file)
+        device.in_process=True
+        return device
+
+    #OneWire sensors of all devices, reading through the failure injection
+    def devices(self):
+        return [self.attach(device) for device in rpi_sensors.init_onewire_devices(self.base_dir)]
+
+    def bus(self,name="DS18B20"):
+        return rpi_sensors.OneWireBus(name,self.devices(),self.base_dir)
+
+    def close(self):
+        shutil.rmtree(self.directory,ignore_errors=True)
+
+#RPi.GPIO with scripted input edges. The edges are applied at their time by a
+#thread which calls the event callbacks (like the GPIO library does) and by
+#input(), so polling sees them even between two runs of the thread
+class FakeGPIO(object):
+    BCM=11
+    BOARD=10
+    OUT=0
+    IN=1
+    LOW=0
+    HIGH=1
+    RISING=31
+    FALLING=32
+    BOTH=33
+    PUD_OFF=20
+    PUD_DOWN=21
+    PUD_UP=22
+    #the HC-SR04 starts the echo ~0.5ms after the trigger pulse
+    echo_delay=0.0005
+
+    def __init__(self):
+        self.mode=None
+        self.levels={}
+        self.directions={}
+        self.callbacks={}
+        #trigger pin -> (echo pin, distance in cm or None for no echo)
+        self.echoes={}
+        self.events=[]
+        self.counter=itertools.count()
+        self.lock=threading.Condition()
+        self.thread=None
+        self.outputs=0
+
+    def setmode(self,mode):
+        self.mode=mode
+
+    def setwarnings(self,flag):
+        pass
+
+    def setup(self,pin,direction,pull_up_down=None,initial=None):
+        self.directions[pin]=direction
+        self.levels.setdefault(pin,initial or 0)
+
+    def output(self,pin,value):
+        self.outputs+=1
+        previous=self.levels.get(pin,0)
+        self.levels[pin]=int(bool(value))
+        #falling edge of the trigger pulse: the echo follows
+        if previous and not value and pin in self.echoes:
+            echo,distance=self.echoes[pin]
+            if distance is not None:
+                self.script(echo,[(self.echo_delay,1),(self.echo_delay+distance*2/34300.0,0)])
+
+    def input(self,pin):
+        self.advance()
+        return self.levels.get(pin,0)
+
+    def add_event_detect(self,pin,edge,callback=None,bouncetime=None):
+        #like RPi.GPIO, a pin has one edge detection at most
+        if pin in self.callbacks:
+            raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+        self.callbacks[pin]=(edge,callback)
+
+    def remove_event_detect(self,pin):
+        self.callbacks.pop(pin,None)
+
+    def cleanup(self,pin=None):
+        if pin is None:
+            self.callbacks.clear()
+        else:
+            self.callbacks.pop(pin,None)
+
+    #every trigger pulse on <trigger> gives an echo on <echo> as long as <distance> cm take
+    def echo(self,trigger,echo,distance):
+        self.echoes[trigger]=(echo,distance)
+
+    #edges of an input: list of (seconds from now, level), e.g. the motions of a PIR
+    def script(self,pin,edges):
+        now=rpi_sensors.monotonic()
+        with self.lock:
+            for seconds,level in edges:
+                heapq.heappush(self.events,(now+seconds,next(self.counter),pin,level))
+            if self.thread is None:
+                self.thread=threading.Thread(target=self.run)
+                self.thread.daemon=True
+                self.thread.start()
+            self.lock.notify()
+
+    #applies the edges which are due and calls the callbacks
+    def advance(self):
+        now=rpi_sensors.monotonic()
+        fired=[]
+        with self.lock:
+            while self.events and self.events[0][0] <= now:
+                due,count,pin,level=heapq.heappop(self.events)
+                if self.levels.get(pin,0) != level:
+                    self.levels[pin]=level
+                    edge,callback=self.callbacks.get(pin,(None,None))
+                    if callback and edge in (self.BOTH,self.RISING if level else self.FALLING):
+                        fired.append((callback,pin))
+        for callback,pin in fired:
+            callback(pin)
+
+    def run(self):
+        while True:
+            with self.lock:
+                if self.events:
+                    delay=self.events[0][0]-rpi_sensors.monotonic()
+                    if delay > 0:
+                        self.lock.wait(delay)
+                else:
+                    self.lock.wait()
+            self.advance()
+
+#writes an executable script which prints what the Adafruit DHT driver prints
+#fail_rate of the reads are incomplete (the driver missed the timing)
+def write_dht_driver(path,temp=21.3,hum=45.2,fail_rate=0.0,delay=0.0):
+    with open(path,"w") as f:
+        f.write("""#!%s
+import random,sys,time
+time.sleep(%r)
+print "Using pin #"+sys.argv[2]
+print "Data (40): 0x2 0x8c 0x0 0xd5 0x63"
+if random.random() >= %r:
+    print "Temp =  %%.1f *C, Hum = %%.1f %%%%" %% (%r,%r)
+""" % (sys.executable,delay,fail_rate,temp,hum))
+    os.chmod(path,os.stat(path).st_mode|stat.S_IXUSR|stat.S_IXGRP|stat.S_IXOTH)
+    return path
+
+#rpi_sensors and rpi_nagios use the fakes: GPIO, smbus (a FakeBMP085Bus) and the
+#1-wire tree in base_dir. rpi_nagios accepts every GPIO port
+def install(base_dir=None,gpio=None,bus=None):
+    rpi_sensors.set_driver("gpio",gpio or FakeGPIO())
+    rpi_sensors.set_driver("smbus",FakeSMBus(bus))
+    if base_dir:
+        rpi_sensors.w1_base_dir=base_dir
+    import rpi_nagios
+    rpi_nagios.ports=tuple(range(28))
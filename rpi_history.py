@@ -0,0 +1,326 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# History of the measurements of every sensor in fixed-size ring buffers.
+#
+# Every buffer is a file which is memory mapped, so the history survives a
+# restart without a database and the file never grows:
+#   header:  magic, version, record size, capacity, head, count, one spare record
+#   records: capacity * record, the first field of a record is always the time
+#            in nanoseconds since 1970
+# Raw values are (time, value). Every tier (e.g. 1 minute, 1 hour) keeps
+# (time, min, max, mean, count) per bucket. The bucket which is still filling up
+# is the spare record in the header of the tier, so it survives a restart too.
+#
+# Appending is O(1), a time range is found by binary search. Writers lock the
+# raw file (flock), so the collector and single checks can share a directory.
+# Their records can come in out of order, a late one is inserted at its place
+# (the records behind it are moved), so the records stay sorted by time.
+# A file of another capacity is migrated: its newest records are copied to a
+# file of the new capacity. A file of another format is an error.
+# Without a directory the buffers are kept in memory only.
+#
+# Every value of a sensor has its own series: <name>.<shortcode>, a value with
+# its own longname (e.g. a DS18B20 of a bus, the spread of an UltraSonic) gets
+# the longname too. The name tells the device apart (series_name()), so two
+# DS18B20 read with -n 1 and -n 2 keep their own history.
+###############################################################################
+
+import fcntl,mmap,os,re,struct,time
+
+raw_format="<qd"
+tier_format="<qdddq"
+#seconds per bucket and number of buckets: 2 days of minutes, 60 days of hours
+default_tiers=((60,2880),(3600,1440))
+
+_header=struct.Struct("<4sIIQQQ")
+_magic="RSRB"
+_version=1
+
+class RingBuffer(object):
+    def __init__(self,capacity,path=None,record_format=raw_format):
+        self.record=struct.Struct(record_format)
+        self.capacity=capacity
+        self.data_offset=_header.size+self.record.size
+        size=self.data_offset+capacity*self.record.size
+        self.file=None
+        if path is None:
+            self.buffer=bytearray(size)
+            self.write_header(0,0)
+            return
+        header=read_header(path)
+        if header:
+            magic,version,record_size,file_capacity=header[:4]
+            if magic != _magic or version != _version or record_size != self.record.size:
+                raise ValueError(path+" is no history of this format")
+            if file_capacity != capacity:
+                migrate(path,file_capacity,capacity,record_format)
+        exists=header is not None
+        if exists and os.path.getsize(path) != size:
+            raise ValueError(path+" is no history of "+str(capacity)+" records")
+        self.file=open(path,"r+b" if exists else "w+b")
+        if not exists:
+            self.file.truncate(size)
+        self.buffer=mmap.mmap(self.file.fileno(),size)
+        if not exists:
+            self.write_header(0,0)
+
+    def write_header(self,head,count):
+        _header.pack_into(self.buffer,0,_magic,_version,self.record.size,self.capacity,head,count)
+
+    #head and count are always read from the header, another process may have appended
+    def state(self):
+        return _header.unpack_from(self.buffer,0)[4:]
+
+    def __len__(self):
+        return self.state()[1]
+
+    def append(self,record):
+        head,count=self.state()
+        self.record.pack_into(self.buffer,self.data_offset+head*self.record.size,*record)
+        self.write_header((head+1)%self.capacity,min(count+1,self.capacity))
+
+    #adds a record at the place of its time. Behind the newest one it is append(),
+    #a late one moves the records after it. False if the buffer is full and the
+    #record is older than all of them
+    def insert(self,record):
+        head,count=self.state()
+        if not count or self[count-1][0] <= record[0]:
+            self.append(record)
+            return True
+        index=self.bisect(record[0]+1)
+        if index == 0 and count == self.capacity:
+            return False
+        later=[self[i] for i in xrange(index,count)]
+        self.write_header((head-len(later))%self.capacity,index)
+        self.append(record)
+        for item in later:
+            self.append(item)
+        return True
+
+    #i=0 is the oldest record
+    def __getitem__(self,i):
+        head,count=self.state()
+        if i < 0:
+            i+=count
+        if not 0 <= i < count:
+            raise IndexError(i)
+        return self.record.unpack_from(self.buffer,self.data_offset+((head-count+i)%self.capacity)*self.record.size)
+
+    def __setitem__(self,i,record):
+        head,count=self.state()
+        if i < 0:
+            i+=count
+        if not 0 <= i < count:
+            raise IndexError(i)
+        self.record.pack_into(self.buffer,self.data_offset+((head-count+i)%self.capacity)*self.record.size,*record)
+
+    def last(self):
+        return self[-1] if len(self) else None
+
+    #the spare record in the header
+    def get_spare(self):
+        record=self.record.unpack_from(self.buffer,_header.size)
+        if record[0] == 0:
+            return None
+        return record
+
+    def set_spare(self,record):
+        self.record.pack_into(self.buffer,_header.size,*record)
+
+    #index of the first record with a time >= timestamp (ns)
+    def bisect(self,timestamp):
+        head,count=self.state()
+        lo,hi=0,count
+        while lo < hi:
+            middle=(lo+hi)//2
+            if self.record.unpack_from(self.buffer,self.data_offset+((head-count+middle)%self.capacity)*self.record.size)[0] < timestamp:
+                lo=middle+1
+            else:
+                hi=middle
+        return lo
+
+    #records with start <= time < end (ns)
+    def range(self,start,end):
+        head,count=self.state()
+        records=[]
+        unpack_from=self.record.unpack_from
+        for i in xrange(self.bisect(start),count):
+            record=unpack_from(self.buffer,self.data_offset+((head-count+i)%self.capacity)*self.record.size)
+            if record[0] >= end:
+                break
+            records.append(record)
+        return records
+
+    def flush(self):
+        if self.file:
+            self.buffer.flush()
+
+    def close(self):
+        if self.file:
+            self.buffer.close()
+            self.file.close()
+            self.file=None
+
+#magic, version, record size, capacity, head, count of a buffer file, None if
+#there is no file (or not even a header, e.g. it was never written)
+def read_header(path):
+    try:
+        with open(path,"rb") as f:
+            data=f.read(_header.size)
+    except IOError:
+        return None
+    if len(data) < _header.size:
+        return None
+    return _header.unpack(data)
+
+#copies the newest records of a buffer file to one of another capacity
+def migrate(path,old_capacity,capacity,record_format):
+    old=RingBuffer(old_capacity,path,record_format)
+    try:
+        fcntl.flock(old.file.fileno(),fcntl.LOCK_EX)
+        #migrated by another process meanwhile
+        if os.fstat(old.file.fileno()).st_ino != os.stat(path).st_ino:
+            return
+        temp=path+".migrate"
+        if os.path.exists(temp):
+            os.unlink(temp)
+        new=RingBuffer(capacity,temp,record_format)
+        for i in xrange(max(0,len(old)-capacity),len(old)):
+            new.append(old[i])
+        spare=old.get_spare()
+        if spare:
+            new.set_spare(spare)
+        new.flush()
+        new.close()
+        os.rename(temp,path)
+    finally:
+        old.close()
+
+#bucket of a tier with one value more
+def add_to_bucket(bucket,value):
+    count=bucket[4]+1
+    return (bucket[0],min(bucket[1],value),max(bucket[2],value),bucket[3]+(value-bucket[3])/count,count)
+
+#History of one value of a sensor: raw values and the downsampled tiers
+class SeriesHistory(object):
+    def __init__(self,capacity=10080,tiers=default_tiers,path=None):
+        self.path=path
+        self.raw=RingBuffer(capacity,path and path+".raw",raw_format)
+        self.tiers=[(width,RingBuffer(buckets,path and path+"."+str(width)+"s",tier_format)) for width,buckets in tiers]
+
+    #epoch in seconds
+    def append(self,epoch,value):
+        if self.path:
+            fcntl.flock(self.raw.file.fileno(),fcntl.LOCK_EX)
+        try:
+            timestamp=int(epoch*1e9)
+            self.raw.insert((timestamp,value))
+            for width,tier in self.tiers:
+                bucket=timestamp//int(width*1e9)*int(width*1e9)
+                pending=tier.get_spare()
+                if pending and bucket < pending[0]:
+                    #late value of a bucket which is closed already
+                    index=tier.bisect(bucket)
+                    if index < len(tier) and tier[index][0] == bucket:
+                        tier[index]=add_to_bucket(tier[index],value)
+                    else:
+                        tier.insert((bucket,value,value,value,1))
+                    continue
+                if pending and pending[0] != bucket:
+                    tier.append(pending)
+                    pending=None
+                if pending is None:
+                    pending=(bucket,value,value,value,1)
+                else:
+                    pending=add_to_bucket(pending,value)
+                tier.set_spare(pending)
+        finally:
+            if self.path:
+                fcntl.flock(self.raw.file.fileno(),fcntl.LOCK_UN)
+
+    #(epoch, value) from start to end (seconds)
+    def query(self,start,end=None):
+        if end is None:
+            end=time.time()+1
+        return [(timestamp/1e9,value) for timestamp,value in self.raw.range(int(start*1e9),int(end*1e9))]
+
+    #(epoch, min, max, mean, count) of the buckets of a tier, including the one still filling up
+    def query_tier(self,width,start,end=None):
+        if end is None:
+            end=time.time()+1
+        for tier_width,tier in self.tiers:
+            if tier_width == width:
+                records=tier.range(int(start*1e9),int(end*1e9))
+                pending=tier.get_spare()
+                if pending and int(start*1e9) <= pending[0] < int(end*1e9):
+                    records.append(pending)
+                return [(record[0]/1e9,)+tuple(record[1:]) for record in records]
+        raise ValueError("No tier of "+str(width)+" seconds")
+
+    #change of the value over the last <seconds>, e.g. for "rising 2 degrees in 10 minutes"
+    def change(self,seconds):
+        last=self.raw.last()
+        if last is None:
+            return None
+        first=self.raw[self.raw.bisect(last[0]-int(seconds*1e9))]
+        return last[1]-first[1]
+
+    def flush(self):
+        for buffer in [self.raw]+[tier for width,tier in self.tiers]:
+            buffer.flush()
+
+    def close(self):
+        for buffer in [self.raw]+[tier for width,tier in self.tiers]:
+            buffer.close()
+
+#name of the history of a sensor: its name with its 1-wire device or GPIO ports
+def series_name(sensor):
+    device_id=getattr(sensor,"device_id",None)
+    if device_id:
+        return sensor.name+" "+device_id()
+    ports=[str(getattr(sensor,port)) for port in ("read_port","trigger","echo") if getattr(sensor,port,None) is not None]
+    return " ".join([sensor.name]+ports)
+
+#Histories of all sensors, one per sensor name and value (shortcode, longname)
+class HistoryStore(object):
+    def __init__(self,directory=None,capacity=10080,tiers=default_tiers):
+        self.directory=directory
+        self.capacity=capacity
+        self.tiers=tiers
+        self.series={}
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    #longname: only for a value which is not the default of its shortcode
+    def get(self,name,shortcode,longname=None):
+        key=(name,shortcode,longname)
+        series=self.series.get(key)
+        if series is None:
+            path=None
+            if self.directory:
+                filename=name.strip()+"."+shortcode+("."+longname.strip() if longname else "")
+                path=os.path.join(self.directory,re.sub(r"[^A-Za-z0-9_.-]","_",filename))
+            series=SeriesHistory(self.capacity,self.tiers,path)
+            self.series[key]=series
+        return series
+
+    #the measurements returned by readSensor(), non numeric values are skipped
+    #name: series_name() of the sensor
+    def record(self,name,measurements):
+        import rpi_sensors
+        for unit in measurements:
+            if isinstance(unit.value,(int,long,float)):
+                default=rpi_sensors.units.get(unit.shortcode,rpi_sensors.undefined_unit)[0]
+                self.get(name,unit.shortcode,unit.longname if unit.longname != default else None).append(unit.epoch,float(unit.value))
+
+    def flush(self):
+        for series in self.series.values():
+            series.flush()
+
+    def close(self):
+        for series in self.series.values():
+            series.close()
+        self.series={}
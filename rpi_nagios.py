@@ -4,15 +4,15 @@
 # Stefan Süss - www.sysstem.at
 ###############################################################################
 
-import rpi_version, rpi_sensors
-import argparse,sys
+import rpi_version, rpi_sensors, rpi_thresholds, rpi_stats
+import argparse,sys,time
 #from timeout import timeout
 
-ports = rpi_version.getGPIOPorts()
+ports = None
 outputs=("standard","nagios")
 exitcode=0
 
-def GetArgs():
+def GetArgs(argv=None):
     """
     Supports the command-line arguments listed below.
     """
@@ -22,15 +22,27 @@ def GetArgs():
     parser = argparse.ArgumentParser(description='Process args for NRPE Sensor readings')
     parser.add_argument('-o', '--output',    default='standard',      action='store', help='Define output format')
     parser.add_argument('-a', '--accuracy',  type=int,                action='store', help='Accuracy for measuring middle part of multiple measurements')
-    parser.add_argument('-s', '--sensor',    required=True,           action='store', help='Determines which Sensor is being used')
-    parser.add_argument('-t', '--type',                               action='store', help='Determines which Type of Sensor is being used')
+    parser.add_argument('-s', '--sensor',                             action='store', help='Determines which Sensor is being used')
+    parser.add_argument('-t', '--type',                               action='store', help='Determines which Type of Sensor is being used (DS18B20: device id or alias)')
     parser.add_argument('-p', '--port',      type=int,                action='store', help='Number of GPIO Pin')
     parser.add_argument('-n', '--number',    type=int,                action='store', help='Number of Sensor if more than one is connected')
     parser.add_argument(      '--trigger',   type=int,                action='store', help='Sensor Trigger GPIO Port')
     parser.add_argument(      '--echo',      type=int,                action='store', help='Sensor Echo GPIO Port')
+    parser.add_argument(      '--edge',      default=False,      action='store_true', help='Ultrasonic: wait for the echo with GPIO edge detection')
+    parser.add_argument(      '--pings',     type=int, default=1,     action='store', help='Ultrasonic: pings per reading (median and spread), implies --edge')
+    parser.add_argument(      '--events',    default=False,      action='store_true', help='PIR: count motions with edge detection (use with the collector daemon)')
+    parser.add_argument(      '--oversampling', type=int, default=1, choices=(0,1,2,3), action='store', help='BMP085: 0 fastest (5ms) to 3 least noise (26ms)')
     parser.add_argument(      '--wire1',     default=False,      action='store_true', help='Weather or not use Wiregate')
+    parser.add_argument(      '--all',       default=False,      action='store_true', help='Read all DS18B20 with one conversion')
     parser.add_argument(      '--name',                               action='store', help='Name to give the sensor')
     parser.add_argument(      '--decimals',  type=int, default=1,     action='store', help='Limit output to X decimals')
+    parser.add_argument(      '--history',                            action='store', help='Keep the measurements in ring buffers in this directory')
+    parser.add_argument(      '--socket',                             action='store', help='Ask the collector daemon on this unix socket instead of reading the sensor')
+    parser.add_argument('-b', '--batch',                             action='append', help='Read several sensors at once, e.g. -b "DHT -t 22 -p 4 -w 30 -w 80 -c 35 -c 90"')
+    parser.add_argument(      '--workers',   type=int, default=4,     action='store', help='Number of sensors read at the same time in batch mode')
+    parser.add_argument(      '--deadline',  type=float, default=30,  action='store', help='Seconds a sensor may take in batch mode')
+    parser.add_argument(      '--stats',     default=False,      action='store_true', help='Add read latency, retries and timeouts to the output')
+    parser.add_argument(      '--stats-file',                         action='store', help='Add read latency, retries and timeouts to the ones in this JSON file')
 
 
 
@@ -40,13 +52,26 @@ def GetArgs():
 ###################
     parser.add_argument('-w', '--warning',            action='append', help='Set warning value for Nagios')
     parser.add_argument('-c', '--critical',           action='append', help='Set critical value for Nagios')
+    parser.add_argument(      '--hysteresis', type=float, action='append', help='Margin to get back from warning/critical, per value like -w and -c')
+    parser.add_argument(      '--state',                  action='store', help='File keeping the status of the last check (needed for --hysteresis)')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     return args
 
 
+#GPIO ports of this board. only read from /proc/cpuinfo when a port is given
+def getPorts():
+    global ports
+    if ports is None:
+        ports=rpi_version.getGPIOPorts()
+    return ports
+
 #Checks if all requirements are given when one sensor is selected
 def sanitize(args):
+    if (args.port,args.trigger,args.echo) != (None,None,None):
+        getPorts()
+    if not args.sensor and not args.batch:
+        raise ValueError("you must specify -s or -b")
     if not args.output in outputs:
         raise ValueError("Wrong output! Possible:",outputs)
     if args.port != None and not args.port in ports:
@@ -55,7 +80,7 @@ def sanitize(args):
         raise ValueError("Wrong GPIO port for <trigger>! Possible:",ports)
     if args.echo != None and not args.echo in ports:
         raise ValueError("Wrong GPIO port for <echo>! Possible:",ports)
-    if args.output=="nagios" and not (args.warning and args.critical):
+    if args.output=="nagios" and args.sensor and not (args.warning and args.critical):
         raise AttributeError("you must specify -w and -c when output is set to nagios")
     if args.decimals != None and args.decimals < 0:
         args.decimals=args.decimals*-1
@@ -69,30 +94,33 @@ def getSensor(args):
     sensor=args.sensor.upper()
     if sensor=="DHT" and args.type and args.port:
         return rpi_sensors.DHT(args.name,args.type,args.port)
+    elif sensor=="DS18B20" and args.all:
+        if args.wire1==True:
+            return rpi_sensors.init_onewire_bus(args.name,"/media/1-wire/","temperature")
+        return rpi_sensors.init_onewire_bus(args.name)
     elif sensor=="DS18B20":
         retdevice=None
         # getting devices from either 1wire or gpio
         if args.wire1==True:
-            devices=rpi_sensors.init_onewire_devices("/media/1-wire/","28.*","/temperature")
+            registry=rpi_sensors.get_onewire_registry("/media/1-wire/","temperature")
         else:
-            devices=rpi_sensors.init_onewire_devices()
-
-        if args.number and args.number-1<len(devices):
-            retdevice=devices[args.number-1]
-        elif args.type:
-            for device in devices:
-                # using type, because it does not require INT
-                if args.type in device.device_file:
-                    retdevice=device
+            registry=rpi_sensors.get_onewire_registry()
+
+        if args.number:
+            retdevice=registry.by_number(args.number)
+        if not retdevice and args.type:
+            # using type, because it does not require INT
+            # device id, its serial without family code or an alias from the config file
+            retdevice=registry.lookup(args.type)
         if retdevice:
             retdevice.name=args.name
         return retdevice
     elif sensor=="BMP085":
-        return rpi_sensors.BMP085(args.name)
+        return rpi_sensors.BMP085(args.name,mode=args.oversampling if args.oversampling is not None else 1)
     elif sensor=="PIR" and args.echo:
-        return rpi_sensors.PIR(args.name,args.echo)
+        return rpi_sensors.PIR(args.name,args.echo,args.events)
     elif sensor=="ULTRASONIC" and args.echo and args.trigger:
-        return rpi_sensors.UltraSonic(args.name,args.trigger,args.echo)
+        return rpi_sensors.UltraSonic(args.name,args.trigger,args.echo,args.edge,args.pings or 1)
     elif sensor=="RPI":
         return rpi_sensors.RPiSens(args.name)
     else:
@@ -108,30 +136,13 @@ def formatValue(value,decimals):
         formatedvalue=str(value)
     return formatedvalue
 
+#warning and critical are Nagios ranges, see rpi_thresholds
 def setExitcode(value,warning,critical):
+    raiseExitcode(rpi_thresholds.Rule(warning,critical).evaluate(value))
+
+#highest status wins unknown>critical>warning>ok
+def raiseExitcode(tempexitcode):
     global exitcode
-    tempexitcode=0
-    #if all are numbers it is possible to compare
-    if is_number(value) and is_number(warning) and is_number(critical):
-        if value > float(critical):
-            tempexitcode=2
-        elif value > float(warning):
-            tempexitcode=1
-        else:
-            tempexitcode=0
-    #if all are strings it is only possible to compare to exact match
-    elif isinstance(value,str) and isinstance(warning,str) and isinstance(critical,str): 
-        if value==critical:
-            tempexitcode=2
-        elif value==warning:
-            tempexitcode=1
-        #should be OK
-        else:
-            tempexitcode=0
-    #if all else fails it's unknown status
-    else:
-        tempexitcode=3
-    #highest status wins unknown>critical>warning>ok
     if tempexitcode > exitcode:
         exitcode=tempexitcode
     else:
@@ -145,40 +156,207 @@ def is_number(s):
     except ValueError:
         return False
 
-def main():
+#Reads the selected sensor either directly or from the collector daemon (--socket)
+#returns the name of the sensor and its measurements
+def readMeasurements(args):
+    if args.socket:
+        import rpi_collector
+        try:
+            return rpi_collector.query(args.socket,args)
+        except rpi_collector.CollectorUnavailable:
+            #no daemon running, fall back to reading the hardware ourselves
+            pass
+    sensor=getSensor(args)
+    if not sensor:
+        raise ValueError("Did not get sensor back")
+    if args.accuracy:
+        import rpi_estimators
+        meas=rpi_estimators.measure_sensor(sensor,args.accuracy)
+    else:
+        meas=sensor.readSensor()
+    if args.history and meas:
+        import rpi_history
+        store=rpi_history.HistoryStore(args.history)
+        store.record(rpi_history.series_name(sensor),meas)
+        store.close()
+    return sensor.name,meas
+
+#Builds the status text and the perfdata of one sensor and sets the exitcode
+#prefix is put in front of the perfdata labels to keep them unique in batch mode
+#The n-th warning/critical belongs to the n-th value
+def parseRules(meas,args):
+    return rpi_thresholds.RuleSet.parse(args.warning,args.critical,getattr(args,"hysteresis",None),len(meas))
+
+#Checks all values at once and sets the exitcode, returns the perfdata
+#keys: the statuses in the state file, "<sensor name> <longname>" like the labels
+#of a batch, so checks sharing the file do not overwrite each other
+def checkRules(rules,labels,values,args,keys=None):
+    state=getattr(args,"state",None)
+    keys=keys or labels
+    if state:
+        rules.restore(keys,rpi_thresholds.load_state(state))
+    statuses=rules.evaluate(values)
+    raiseExitcode(max(statuses) if statuses else 0)
+    if state:
+        rpi_thresholds.save_state(state,keys,statuses)
+    return rpi_thresholds.perfdata(labels,values,rules,args.decimals)
+
+def formatText(name,meas,args):
+    return name+" has "+", ".join(formatValue(unit.value,args.decimals)+" "+unit.shortname for unit in meas)
+
+def formatNagios(name,meas,args,prefix=""):
+    rules=parseRules(meas,args)
+    perfdata=checkRules(rules,[prefix+unit.longname for unit in meas],[unit.value for unit in meas],args,
+                        [name+" "+unit.longname for unit in meas])
+    return formatText(name,meas,args),perfdata
+
+#Builds the output for one sensor. In nagios mode the exitcode is set as well
+def formatOutput(name,meas,args):
     outputstr=""
-    outputstrnagios=" | "
 
+    #I wonder if with for loop would be better
+    if args.output == "standard":
+        for unit in meas:
+            outputstr+="["+str(unit.timestamp)+"] "+name+" "+formatValue(unit.value,args.decimals)+" "+unit.shortname+"\n"
+    elif args.output == "nagios":
+        outputstr,outputstrnagios=formatNagios(name,meas,args)
+        outputstr+=" | "+outputstrnagios
+    return outputstr.strip()
+
+#Parses one -b argument: the sensor followed by the same options as a single check
+#output format and decimals are the ones of the whole batch
+def parseSpec(spec,args):
+    import shlex
+    argv=shlex.split(spec)
+    if argv and not argv[0].startswith("-"):
+        argv=["-s"]+argv
+    #argparse exits with 2 (CRITICAL for Nagios) on a wrong option, it is UNKNOWN
     try:
-        args = sanitize(GetArgs())
-	sensor=getSensor(args)
-        if not sensor:
-            raise ValueError("Did not get sensor back")
+        specargs=GetArgs(argv)
+    except SystemExit:
+        raise ValueError("wrong options in batch entry: "+spec)
+    specargs.output=args.output
+    specargs.decimals=args.decimals
+    specargs.socket=args.socket
+    #the mains of rpi_scheduler, rpi_exporter and rpi_trace have no --state
+    specargs.state=specargs.state or getattr(args,"state",None)
+    if not specargs.sensor:
+        raise ValueError("you must specify -s in batch entry: "+spec)
+    return sanitize(specargs)
 
-	meas=sensor.readSensor()
-        if not meas:
-            raise AttributeError("No measurements found")
+#runs in its own process, sends back (name, measurements, error, read stats)
+def readSpecWorker(specargs,connection):
+    try:
+        name,meas=readMeasurements(specargs)
+        error=None
+    except Exception as e:
+        name,meas,error=specargs.name or specargs.sensor,[],str(e) or e.__class__.__name__
+    connection.send((name,meas,error,rpi_stats.snapshot() if rpi_stats.enabled else None))
+    connection.close()
+
+#Reads all sensors of a batch in at most <workers> processes at once
+#a sensor taking longer than <deadline> seconds is killed and reported as timed out
+#returns a list of (name, measurements, error) in the order of the specs
+def readBatch(specs,workers=4,deadline=30):
+    #only batch mode needs them, a single check does not pay for the import
+    import multiprocessing,select
+    if workers < 1:
+        raise ValueError("--workers must be at least 1")
+    results=[None]*len(specs)
+    waiting=list(enumerate(specs))
+    running={}
+    while waiting or running:
+        while waiting and len(running) < workers:
+            index,specargs=waiting.pop(0)
+            reader,writer=multiprocessing.Pipe(False)
+            process=multiprocessing.Process(target=readSpecWorker,args=(specargs,writer))
+            process.daemon=True
+            process.start()
+            writer.close()
+            running[reader]=(index,process,time.time()+deadline)
+        timeout=max(0,min(end for index,process,end in running.values())-time.time())
+        ready,_,_=select.select(running.keys(),[],[],timeout)
+        for reader in ready:
+            index,process,end=running.pop(reader)
+            try:
+                name,meas,error,stats=reader.recv()
+                rpi_stats.add(stats)
+                results[index]=(name,meas,error)
+            except EOFError:
+                results[index]=(specs[index].name or specs[index].sensor,[],"reader died")
+            reader.close()
+            process.join()
+        now=time.time()
+        for reader,(index,process,end) in running.items():
+            if end <= now:
+                process.terminate()
+                process.join()
+                reader.close()
+                del running[reader]
+                results[index]=(specs[index].name or specs[index].sensor,[],"timed out after "+str(deadline)+"s")
+    return results
 
-        #I wonder if with for loop would be better
-        if args.output == "standard":
-            for unit in meas:
-                outputstr+="["+str(unit.timestamp)+"] "+sensor.name+" "+formatValue(unit.value,args.decimals)+" "+unit.shortname+"\n"
-        elif args.output == "nagios":
-            startstr=sensor.name+" has "
-            outputstr+=startstr
-            for unit in meas:
-                if outputstr != startstr:
-                    outputstr+=", "
-                #Match the index of Unit in Meas to index in warnings/criticals provided
-                curwarning=args.warning[meas.index(unit)]
-                curcritical=args.critical[meas.index(unit)]
-                outputstr+=formatValue(unit.value,args.decimals)+" "+unit.shortname
-                outputstrnagios+="'"+unit.longname+"'"+"="+formatValue(unit.value,args.decimals)+";"+curwarning+";"+curcritical+" "
-                setExitcode(unit.value,curwarning,curcritical)
+#One status line for all sensors of a batch, perfdata of all sensors behind it
+def formatBatch(specs,results,args):
+    if args.output == "standard":
+        lines=[]
+        for specargs,(name,meas,error) in zip(specs,results):
+            if error:
+                raiseExitcode(3)
+                lines.append(name+" "+error)
             else:
-                outputstr+=outputstrnagios
+                lines.append(formatOutput(name,meas,specargs))
+        return "\n".join(lines)
+    #the rules of all sensors are checked together
+    texts=[]
+    rules=[]
+    labels=[]
+    values=[]
+    for specargs,(name,meas,error) in zip(specs,results):
+        if error:
+            raiseExitcode(3)
+            texts.append(name+" "+error)
+        elif not meas:
+            raiseExitcode(3)
+            texts.append(name+" No measurements found")
+        else:
+            try:
+                rules.extend(parseRules(meas,specargs).rules)
+            except (IndexError,TypeError):
+                raiseExitcode(3)
+                texts.append(name+" needs "+str(len(meas))+" warning and criticals")
+                continue
+            labels.extend(name+" "+unit.longname for unit in meas)
+            values.extend(unit.value for unit in meas)
+            texts.append(formatText(name,meas,specargs))
+    perfdata=checkRules(rpi_thresholds.RuleSet(rules),labels,values,args)
+    return ("; ".join(texts)+" | "+perfdata).strip()
+
+#Adds the read stats (rpi_stats) to the output, as perfdata in nagios mode
+def formatStats(outputstr,args):
+    if not args.stats:
+        return outputstr
+    if args.output == "nagios":
+        return outputstr+(" " if " | " in outputstr else " | ")+rpi_stats.perfdata()
+    return outputstr+"\n"+rpi_stats.report(rpi_stats.snapshot())
+
+def main():
+    meas=[]
+    args=None
+
+    try:
+        args = sanitize(GetArgs())
+        if args.stats or args.stats_file:
+            rpi_stats.enable()
+        if args.batch:
+            specs=[parseSpec(spec,args) for spec in args.batch]
+            print formatStats(formatBatch(specs,readBatch(specs,args.workers,args.deadline),args),args)
+            exit(exitcode)
+        name,meas=readMeasurements(args)
+        if not meas:
+            raise AttributeError("No measurements found")
 
-        print outputstr.strip()
+        print formatStats(formatOutput(name,meas,args),args)
         exit(exitcode)
         
     #Exceptions maybe need to be fixed for better understandig for the user 
@@ -201,6 +379,13 @@ def main():
         exit(3)
     else:
 	exit(0)
+    finally:
+        #failed reads are counted too
+        if args and args.stats_file:
+            try:
+                rpi_stats.save(args.stats_file)
+            except (IOError,OSError):
+                pass
   
 
 if __name__=="__main__":
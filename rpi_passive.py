@@ -0,0 +1,305 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Passive checks: the Pi reads its sensors itself and pushes the results to
+# Nagios, no NRPE connection, fork and read per service and interval.
+#   python rpi_passive.py --command-file /var/lib/nagios3/rw/nagios.cmd \
+#       --check 60 "Temp garden" "DS18B20 -t garden -w 30 -c 35" \
+#       --check 30 "Humidity" "DHT -t 22 -p 4 -w 30 -w 80 -c 35 -c 90"
+#   --once reads every check one time (e.g. from cron) and submits them together
+#
+# Output and status of a check are the ones of rpi_nagios.py -o nagios.
+# Targets:
+#   --command-file  external command file (FIFO) of Nagios, one
+#                   [time] PROCESS_SERVICE_CHECK_RESULT;host;service;status;output
+#                   line per result
+#   --spool         check_result_path of Nagios, one check result file per batch
+# Results coming in within --window seconds are submitted with one write, of a
+# service only the newest one. When the FIFO has no reader (Nagios stopped) or
+# the spool can not be written, the results are kept in the --backlog file (at
+# most --max-backlog, the oldest are dropped) and sent before the next batch.
+###############################################################################
+
+import argparse,errno,json,os,select,socket,stat,tempfile,threading,time
+import rpi_nagios,rpi_sensors
+
+#writes of up to PIPE_BUF bytes to a FIFO are never mixed with the ones of other writers
+pipe_buf=getattr(select,"PIPE_BUF",512)
+
+#rpi_nagios keeps the status in a global, formatting is done one check at a time
+_format_lock=threading.Lock()
+
+class Result(object):
+    __slots__=("host","service","status","output","epoch")
+
+    def __init__(self,host,service,status,output,epoch=None):
+        self.host=host
+        self.service=service
+        self.status=status
+        #Nagios takes one line, several lines of output are sent as \n
+        self.output=output.strip().replace("\\","\\\\").replace("\n","\\n")
+        self.epoch=int(epoch if epoch is not None else time.time())
+
+    def command(self):
+        line="["+str(self.epoch)+"] PROCESS_SERVICE_CHECK_RESULT;"+self.host+";"+self.service+";"+str(self.status)+";"+self.output
+        #longer lines would not be written in one piece
+        return line[:pipe_buf-1]+"\n"
+
+    def to_list(self):
+        return [self.host,self.service,self.status,self.output,self.epoch]
+
+    @classmethod
+    def from_list(cls,item):
+        result=cls(item[0],item[1],item[2],"",item[4])
+        result.output=item[3]
+        return result
+
+#status and output of one sensor like rpi_nagios.py -o nagios would exit with them
+def check_result(host,service,specargs,name,meas,error=None):
+    if error:
+        return Result(host,service,3,name+" "+error)
+    if not meas:
+        return Result(host,service,3,name+" No measurements found")
+    with _format_lock:
+        rpi_nagios.exitcode=0
+        try:
+            output=rpi_nagios.formatOutput(name,meas,specargs)
+            status=rpi_nagios.exitcode
+        except IndexError:
+            output,status="You need to set "+str(len(meas))+" warning and criticals for sensor",3
+        except Exception as e:
+            output,status=str(e) or e.__class__.__name__,3
+    return Result(host,service,status,output,meas[0].epoch)
+
+#Results which could not be submitted, kept in a file so they survive a restart
+class Backlog(object):
+    def __init__(self,path=None,limit=1000):
+        self.path=path
+        self.limit=limit
+        self.results=[]
+        self.dropped=0
+        if path:
+            try:
+                with open(path) as f:
+                    self.results=[Result.from_list(item) for item in json.load(f)]
+            except (IOError,ValueError):
+                pass
+
+    def __len__(self):
+        return len(self.results)
+
+    def add(self,results):
+        self.results.extend(results)
+        if len(self.results) > self.limit:
+            self.dropped+=len(self.results)-self.limit
+            del self.results[:len(self.results)-self.limit]
+        self.save()
+
+    def take(self):
+        results,self.results=self.results,[]
+        return results
+
+    #written to a new file which replaces the old one, never half a backlog
+    def save(self):
+        if not self.path:
+            return
+        directory=os.path.dirname(os.path.abspath(self.path))
+        handle,temp=tempfile.mkstemp(prefix=".backlog",dir=directory)
+        try:
+            with os.fdopen(handle,"w") as f:
+                json.dump([result.to_list() for result in self.results],f)
+            os.rename(temp,self.path)
+        except (IOError,OSError):
+            if os.path.exists(temp):
+                os.unlink(temp)
+
+#Writes PROCESS_SERVICE_CHECK_RESULT lines to the external command file
+#returns the results which could not be written
+class CommandFile(object):
+    def __init__(self,path):
+        self.path=path
+
+    #lines packed into chunks of at most PIPE_BUF bytes, each chunk is one write
+    def chunks(self,results):
+        chunk,size=[],0
+        for result in results:
+            line=result.command()
+            if chunk and size+len(line) > pipe_buf:
+                yield chunk
+                chunk,size=[],0
+            chunk.append((result,line))
+            size+=len(line)
+        if chunk:
+            yield chunk
+
+    def write(self,results):
+        try:
+            #non blocking: no reader (Nagios stopped) is an error instead of hanging
+            fd=os.open(self.path,os.O_WRONLY|os.O_NONBLOCK|os.O_APPEND)
+        except OSError:
+            return results
+        try:
+            chunks=list(self.chunks(results))
+            for i,chunk in enumerate(chunks):
+                try:
+                    os.write(fd,"".join(line for result,line in chunk))
+                except OSError as e:
+                    if e.errno not in (errno.EAGAIN,errno.EPIPE):
+                        raise
+                    return [result for chunk in chunks[i:] for result,line in chunk]
+        finally:
+            os.close(fd)
+        return []
+
+#Writes a check result file to the check_result_path of Nagios, the .ok file
+#next to it tells Nagios the file is complete
+class SpoolDir(object):
+    def __init__(self,path):
+        self.path=path
+
+    def render(self,results):
+        now=int(time.time())
+        lines=["### Active Check Result File ###","file_time="+str(now),""]
+        for result in results:
+            lines.extend(["### Nagios Service Check Result ###",
+                          "# Time: "+time.ctime(result.epoch),
+                          "host_name="+result.host,
+                          "service_description="+result.service,
+                          "check_type=1",
+                          "check_options=0",
+                          "scheduled_check=0",
+                          "reschedule_check=0",
+                          "latency=0.0",
+                          "start_time="+str(result.epoch)+".0",
+                          "finish_time="+str(result.epoch)+".0",
+                          "early_timeout=0",
+                          "exited_ok=1",
+                          "return_code="+str(result.status),
+                          "output="+result.output,
+                          ""])
+        return "\n".join(lines)+"\n"
+
+    def write(self,results):
+        if not results:
+            return []
+        try:
+            handle,path=tempfile.mkstemp(prefix="c",dir=self.path)
+        except OSError:
+            return results
+        try:
+            with os.fdopen(handle,"w") as f:
+                f.write(self.render(results))
+            os.chmod(path,stat.S_IRUSR|stat.S_IWUSR|stat.S_IRGRP|stat.S_IWGRP)
+            open(path+".ok","w").close()
+        except (IOError,OSError):
+            for name in (path,path+".ok"):
+                if os.path.exists(name):
+                    os.unlink(name)
+            return results
+        return []
+
+#Collects results and submits them every <window> seconds in one batch
+class Submitter(object):
+    def __init__(self,target,window=5,backlog=None):
+        self.target=target
+        self.window=window
+        self.backlog=backlog if backlog is not None else Backlog()
+        self.lock=threading.Lock()
+        #(host, service) -> newest result since the last batch
+        self.pending={}
+        self.submitted=0
+        self.batches=0
+        self.failed=0
+
+    def add(self,result):
+        with self.lock:
+            self.pending[(result.host,result.service)]=result
+
+    #backlog first, so Nagios gets the results of a service in order
+    def flush(self):
+        with self.lock:
+            results=sorted(self.pending.values(),key=lambda result: result.epoch)
+            self.pending={}
+            waiting=len(self.backlog)
+            if not results and not waiting:
+                return 0
+            results=self.backlog.take()+results
+            left=self.target.write(results)
+            self.batches+=1
+            self.submitted+=len(results)-len(left)
+            if left:
+                self.failed+=1
+                self.backlog.add(left)
+            elif waiting:
+                self.backlog.save()
+            return len(results)-len(left)
+
+    #flushes every <window> seconds until <stopped> is set
+    def run(self,stopped):
+        while not stopped.wait(self.window):
+            self.flush()
+        self.flush()
+
+    def stats(self):
+        return {"submitted":self.submitted,"batches":self.batches,"failed":self.failed,
+                "backlog":len(self.backlog),"dropped":self.backlog.dropped}
+
+def GetArgs():
+    parser = argparse.ArgumentParser(description='Submits the sensors as passive check results to Nagios')
+    parser.add_argument(      '--check',     nargs=3, required=True,  action='append', metavar=('SECONDS','SERVICE','SENSOR'), help='Interval, service description and sensor like rpi_nagios.py -b')
+    parser.add_argument(      '--host',      default=socket.gethostname(), action='store', help='Host name in Nagios')
+    parser.add_argument(      '--command-file', default=None,         action='store', help='External command file (FIFO) of Nagios')
+    parser.add_argument(      '--spool',     default=None,            action='store', help='check_result_path of Nagios')
+    parser.add_argument(      '--window',    type=float, default=5,   action='store', help='Seconds results are collected for one write')
+    parser.add_argument(      '--backlog',   default=None,            action='store', help='File keeping the results while Nagios is not reachable')
+    parser.add_argument(      '--max-backlog', type=int, default=1000, action='store', help='Results kept in the backlog at most')
+    parser.add_argument(      '--once',      default=False,      action='store_true', help='Read every check once, submit and exit')
+    parser.add_argument(      '--workers',   type=int, default=4,     action='store', help='Threads (processes with --once) reading sensors')
+    parser.add_argument(      '--deadline',  type=float, default=30,  action='store', help='Seconds a sensor may take with --once')
+    parser.add_argument(      '--decimals',  type=int, default=1,     action='store', help='Limit output to X decimals')
+    args=parser.parse_args()
+    if bool(args.command_file) == bool(args.spool):
+        parser.error("use either --command-file or --spool")
+    return args
+
+def main():
+    args=GetArgs()
+    args.output="nagios"
+    args.socket=None
+    args.state=None
+    checks=[(float(interval),service,rpi_nagios.parseSpec(spec,args)) for interval,service,spec in args.check]
+    target=CommandFile(args.command_file) if args.command_file else SpoolDir(args.spool)
+    submitter=Submitter(target,args.window,Backlog(args.backlog,args.max_backlog))
+    if args.once:
+        results=rpi_nagios.readBatch([specargs for interval,service,specargs in checks],args.workers,args.deadline)
+        for (interval,service,specargs),(name,meas,error) in zip(checks,results):
+            submitter.add(check_result(args.host,service,specargs,name,meas,error))
+        submitter.flush()
+        if len(submitter.backlog):
+            exit(1)
+        return
+    import rpi_scheduler
+    services={}
+    def on_result(job):
+        service,specargs=services[job]
+        submitter.add(check_result(args.host,service,specargs,job.sensor.name,job.measurements,job.error))
+    scheduler=rpi_scheduler.Scheduler(args.workers,on_result=on_result)
+    for interval,service,specargs in checks:
+        sensor=rpi_nagios.getSensor(specargs)
+        if not sensor:
+            raise ValueError("Did not get sensor back: "+service)
+        services[scheduler.add(sensor,interval)]=(service,specargs)
+    thread=threading.Thread(target=submitter.run,args=(scheduler.stopped,))
+    thread.daemon=True
+    thread.start()
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+    thread.join(args.window+5)
+    rpi_sensors.cleanup()
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Sampling policy on top of readSensor: most sensors (room temperature, pressure)
+# barely change between two reads, so
+# - deadband: a value is only passed on when it moved more than the deadband of
+#   its mtype since the last one passed on, or when the last one is older than
+#   the heartbeat (so the receiver knows the sensor is alive)
+# - adaptive interval: a sensor is read less often while its values are stable
+#   (the interval grows by backoff up to max_interval) and more often when they
+#   change (the interval is cut to half of the time the values need to cross
+#   their deadband at the current rate, down to the interval given)
+# - counters of the reads and values which were saved compared to reading every
+#   interval and passing on every value
+#
+# Deadbands are in the base unit of the mtype (rpi_units), so 0.1 for t is 0.1 K
+# (0.18 deg F). Defaults below, overridden by the config file:
+#   [deadband]
+#   t = 0.25
+#   h = 2
+# Values which are no numbers (motion, governor) are passed on when they change.
+#
+#   python rpi_scheduler.py --job 10 "DS18B20 -n 1" --deadband --max-interval 300
+###############################################################################
+
+import ConfigParser
+import rpi_deadline,rpi_sensors,rpi_units
+
+#change per mtype that is passed on, 0 for every change
+deadbands={"t":0.1,"p":20.0,"m":0.01,"h":1.0,"v":0.05,"s":1.0,"r":1.0}
+default_heartbeat=900
+
+#reads the [deadband] section of a config file, a missing file keeps the defaults
+def load_config(path=None):
+    config=ConfigParser.RawConfigParser()
+    config.read(path or rpi_deadline.config_file)
+    if config.has_section("deadband"):
+        for mtype,band in config.items("deadband"):
+            deadbands[mtype]=float(band)
+
+#deadband in the unit of the value, e.g. 0.1 K is 0.18 deg F
+def band(unit,bands=None):
+    bands=deadbands if bands is None else bands
+    return bands.get(unit.mtype,0.0)/rpi_units.factors.get(unit.shortcode,(1.0,0.0))[0]
+
+def is_number(value):
+    return isinstance(value,(int,long,float)) and not isinstance(value,bool)
+
+#interval: the shortest interval (the one of the job)
+#max_interval: longest interval when the values are stable, None for a fixed interval
+#heartbeat: seconds after which a value is passed on even without a change
+#deadband: False passes on every value (adaptive interval only)
+class Policy(object):
+    def __init__(self,interval,max_interval=None,heartbeat=default_heartbeat,deadband=True,bands=None,backoff=1.5):
+        self.min_interval=interval
+        self.max_interval=max(max_interval or interval,interval)
+        self.interval=interval
+        self.heartbeat=heartbeat
+        self.deadband=deadband
+        self.bands=bands
+        self.backoff=backoff
+        #longname -> (value, epoch) passed on last
+        self.emitted={}
+        self.started=None
+        self.last_read=None
+        self.reads=0
+        self.values=0
+        self.passed=0
+
+    #the units of a reading which are passed on, sets the interval for the next read
+    def filter(self,meas,now=None):
+        now=rpi_sensors.monotonic() if now is None else now
+        if self.started is None:
+            self.started=now
+        self.last_read=now
+        self.reads+=1
+        passed=[]
+        #seconds until the fastest changing value crosses its deadband
+        crossing=None
+        for unit in meas:
+            self.values+=1
+            last=self.emitted.get(unit.longname)
+            if last is None:
+                changed=True
+            elif is_number(unit.value) and is_number(last[0]):
+                width=band(unit,self.bands)
+                moved=abs(unit.value-last[0])
+                changed=moved > width
+                if width and moved and now > last[1]:
+                    seconds=width/(moved/(now-last[1]))
+                    crossing=seconds if crossing is None else min(crossing,seconds)
+            else:
+                changed=unit.value != last[0]
+            if changed or not self.deadband or now-last[1] >= self.heartbeat:
+                self.emitted[unit.longname]=(unit.value,now)
+                passed.append(unit)
+        self.passed+=len(passed)
+        self.adapt(crossing)
+        return passed
+
+    def adapt(self,crossing):
+        if crossing is not None and crossing/2 < self.interval:
+            self.interval=max(self.min_interval,crossing/2)
+        else:
+            self.interval=min(self.max_interval,self.interval*self.backoff)
+            if crossing is not None:
+                self.interval=max(self.min_interval,min(self.interval,crossing/2))
+
+    #reads and values saved compared to reading every min_interval and passing on everything
+    def stats(self):
+        elapsed=(self.last_read-self.started) if self.reads else 0.0
+        fixed_reads=int(elapsed/self.min_interval)+1 if self.reads else 0
+        return {"interval":self.interval,"reads":self.reads,"saved_reads":max(0,fixed_reads-self.reads),
+                "values":self.values,"passed":self.passed,"saved_values":self.values-self.passed}
@@ -0,0 +1,291 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Polling scheduler: reads many sensors from one process, every sensor with its
+# own interval, e.g.
+#   python rpi_scheduler.py --job 10 "DS18B20 -n 1" --job 2.5 "DHT -t 22 -p 4" --job 1 "RPI" --job 1 "PIR --echo 17 --events"
+#
+# - every job has a deadline (next_due). The next one is the last deadline plus
+#   the interval (no drift). A little random jitter is added to the time the job
+#   is queued (not to the deadline), so jobs with the same interval do not all
+#   hit the hardware at the same moment. Jobs of one bus have no jitter and start
+#   at the same phase, so their reads fall together and are merged
+# - a sensor is never read faster than its hardware allows (min_period)
+# - jobs due at the same time on the same bus are read in one go, DS18B20 of
+#   one 1-wire bus with one simultaneous conversion (rpi_sensors.OneWireBus)
+# - the timing runs in its own thread, the reads are queued to an executor.
+#   workers=0 reads in the thread which called run(), workers>0 in a thread pool.
+#   Every read has its deadline (rpi_deadline), stop() cancels running reads
+# - stats() gives reads, errors, missed deadlines and the lag between deadline
+#   and the start of the read for every job, and the length of the queue
+# - a job with a sampling policy (rpi_sampling, --deadband/--max-interval) only
+#   passes on values which changed and adapts its interval to the rate of change
+###############################################################################
+
+import Queue,argparse,heapq,itertools,random,sys,threading,time
+import rpi_deadline,rpi_nagios,rpi_sensors
+
+#seconds a sensor needs between two reads
+def min_period(sensor):
+    if isinstance(sensor,rpi_sensors.DHT):
+        import rpi_dht
+        return rpi_dht.min_intervals.get(str(sensor.type),2.0)
+    if isinstance(sensor,(rpi_sensors.OneWire,rpi_sensors.OneWireBus)):
+        #one conversion of a DS18B20 with 12 bit
+        return 0.75
+    if isinstance(sensor,rpi_sensors.UltraSonic):
+        return sensor.ping_spacing*sensor.pings
+    if isinstance(sensor,rpi_sensors.BMP085):
+        return sensor.temperature_wait+sensor.pressure_waits[sensor.mode]
+    return 0.0
+
+#sensors with the same key share a bus and are read one after the other in one task
+def bus_key(sensor):
+    if isinstance(sensor,rpi_sensors.OneWire):
+        #/sys/bus/w1/devices/28-xxx/w1_slave -> /sys/bus/w1/devices/
+        return ("w1",sensor.device_file.rsplit("/",2)[0])
+    if isinstance(sensor,rpi_sensors.BMP085):
+        return ("i2c",sensor.busnum)
+    return None
+
+class Job(object):
+    def __init__(self,sensor,interval,jitter=0.05,policy=None):
+        self.sensor=sensor
+        self.min_period=min_period(sensor)
+        self.interval=max(interval,self.min_period)
+        self.jitter=jitter
+        self.policy=policy
+        if policy:
+            #the savings are counted against the interval the job could really have
+            policy.min_interval=policy.interval=max(policy.min_interval,self.min_period)
+            policy.max_interval=max(policy.max_interval,policy.min_interval)
+        #deadline without jitter, the jitter is only in when the job is queued
+        self.next_due=0.0
+        self.offset=0.0
+        self.last_start=None
+        self.measurements=[]
+        self.error=None
+        self.reads=0
+        self.errors=0
+        self.missed=0
+        self.lag_total=0.0
+        self.lag_max=0.0
+
+    #next deadline from the last one, deadlines which already passed are missed
+    def schedule(self,now):
+        self.next_due+=self.interval
+        if self.next_due < now:
+            skipped=int((now-self.next_due)/self.interval)+1
+            self.missed+=skipped
+            self.next_due+=skipped*self.interval
+        self.offset=random.uniform(-self.jitter,self.jitter)*self.interval
+
+    #time the job is queued: the deadline with the jitter of this read
+    def due(self):
+        due=self.next_due+self.offset
+        #never faster than the hardware allows
+        if self.last_start is not None:
+            due=max(due,self.last_start+self.min_period)
+        return due
+
+    #keeps the values the policy passes on, the next read is due after its interval
+    def sample(self):
+        if self.policy and not self.error:
+            self.measurements=self.policy.filter(self.measurements)
+            self.interval=max(self.policy.interval,self.min_period)
+
+    def stats(self):
+        stats={"name":self.sensor.name,"interval":self.interval,"reads":self.reads,"errors":self.errors,
+               "missed":self.missed,"lag_avg":self.lag_total/self.reads if self.reads else 0.0,"lag_max":self.lag_max}
+        if self.policy:
+            stats["sampling"]=self.policy.stats()
+        return stats
+
+class Scheduler(object):
+    def __init__(self,workers=0,merge_window=0.05,on_result=None):
+        self.workers=workers
+        self.merge_window=merge_window
+        self.on_result=on_result
+        self.jobs=[]
+        self.heap=[]
+        self.counter=itertools.count()
+        self.tasks=Queue.Queue()
+        self.lock=threading.Lock()
+        self.wakeup=threading.Event()
+        self.stopped=threading.Event()
+        #deadlines of the running reads
+        self.reading=set()
+        #bus -> first deadline of its jobs, they share the phase
+        self.phases={}
+
+    def add(self,sensor,interval,jitter=0.05,policy=None):
+        key=bus_key(sensor)
+        #jobs of one bus are read together, jitter would keep them apart
+        job=Job(sensor,interval,0.0 if key else jitter,policy)
+        now=rpi_sensors.monotonic()
+        with self.lock:
+            phase=self.phases.get(key)
+            if phase is None:
+                phase=now+random.uniform(0,jitter*job.interval)
+                if key:
+                    self.phases[key]=phase
+            #the first deadline after now in the phase of the bus
+            job.next_due=phase+max(0,int((now-phase)/job.interval)+1)*job.interval if phase < now else phase
+            self.jobs.append(job)
+            heapq.heappush(self.heap,(job.due(),next(self.counter),job))
+        self.wakeup.set()
+        return job
+
+    #timing thread: queues due jobs, grouped by bus
+    def timer(self):
+        while not self.stopped.is_set():
+            now=rpi_sensors.monotonic()
+            due=[]
+            with self.lock:
+                #a job is back in the heap only after its read, so it is never read twice at once
+                while self.heap and self.heap[0][0] <= now+self.merge_window:
+                    deadline,count,job=heapq.heappop(self.heap)
+                    due.append((deadline,job))
+                timeout=self.heap[0][0]-now if self.heap else 1.0
+            groups={}
+            for deadline,job in due:
+                key=bus_key(job.sensor)
+                groups.setdefault(key if key else id(job),[]).append((deadline,job))
+            for group in groups.values():
+                self.tasks.put(group)
+            self.wakeup.wait(max(0.0,timeout))
+            self.wakeup.clear()
+
+    #reads a group of jobs of one bus, DS18B20 with one conversion for all
+    def execute(self,group):
+        with rpi_deadline.deadline() as read:
+            with self.lock:
+                self.reading.add(read)
+            try:
+                self.read_group(group)
+            finally:
+                with self.lock:
+                    self.reading.discard(read)
+
+    def read_group(self,group):
+        merged={}
+        onewire=[job.sensor for deadline,job in group if isinstance(job.sensor,rpi_sensors.OneWire)]
+        bus_start=rpi_sensors.monotonic()
+        if len(onewire) > 1:
+            bus=rpi_sensors.OneWireBus("bus",onewire,bus_key(onewire[0])[1]+"/")
+            try:
+                with rpi_deadline.deadline(rpi_deadline.get_budget(rpi_sensors.OneWireBus)):
+                    merged=dict((device,[rpi_sensors.MeasurementType(temp_c,"dc")]) for device,temp_c in bus.read_temps())
+            except Exception:
+                rpi_deadline.check()
+                #read them one by one below
+                merged={}
+        for deadline,job in group:
+            start=bus_start if job.sensor in merged else rpi_sensors.monotonic()
+            job.last_start=start
+            lag=max(0.0,start-deadline)
+            job.lag_total+=lag
+            job.lag_max=max(job.lag_max,lag)
+            try:
+                job.measurements=merged[job.sensor] if job.sensor in merged else job.sensor.readSensor()
+                job.error=None
+            except Exception as e:
+                job.errors+=1
+                job.error=str(e) or e.__class__.__name__
+            job.reads+=1
+            job.sample()
+            with self.lock:
+                job.schedule(rpi_sensors.monotonic())
+                heapq.heappush(self.heap,(job.due(),next(self.counter),job))
+            self.wakeup.set()
+            if self.on_result:
+                self.on_result(job)
+
+    def worker(self):
+        while not self.stopped.is_set():
+            try:
+                group=self.tasks.get(timeout=0.5)
+            except Queue.Empty:
+                continue
+            self.execute(group)
+
+    def stats(self):
+        with self.lock:
+            return {"queue":self.tasks.qsize(),"jobs":[job.stats() for job in self.jobs]}
+
+    #runs until stop() or <duration> seconds
+    def run(self,duration=None):
+        threads=[threading.Thread(target=self.timer)]
+        for i in range(self.workers):
+            threads.append(threading.Thread(target=self.worker))
+        for thread in threads:
+            thread.daemon=True
+            thread.start()
+        end=None if duration is None else rpi_sensors.monotonic()+duration
+        while not self.stopped.is_set() and (end is None or rpi_sensors.monotonic() < end):
+            if self.workers:
+                time.sleep(0.5)
+                continue
+            try:
+                group=self.tasks.get(timeout=0.5 if end is None else max(0.0,min(0.5,end-rpi_sensors.monotonic())))
+            except Queue.Empty:
+                continue
+            self.execute(group)
+        self.stop()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+        with self.lock:
+            for read in self.reading:
+                read.cancel()
+
+def GetArgs():
+    parser = argparse.ArgumentParser(description='Reads sensors periodically, each with its own interval')
+    parser.add_argument('-j', '--job',       nargs=2, required=True,  action='append', metavar=('SECONDS','SENSOR'), help='Interval and sensor like rpi_nagios.py -b, e.g. --job 10 "DS18B20 -n 1"')
+    parser.add_argument(      '--workers',   type=int, default=0,     action='store', help='Threads reading sensors (0: main thread)')
+    parser.add_argument(      '--stats',     type=float, default=60,  action='store', help='Print the stats every SECONDS')
+    parser.add_argument(      '--decimals',  type=int, default=1,     action='store', help='Limit output to X decimals')
+    parser.add_argument(      '--deadband',  default=False,      action='store_true', help='Only print values which changed more than the deadband of their type')
+    parser.add_argument(      '--max-interval', type=float, default=None, action='store', help='Read stable sensors less often, up to every SECONDS')
+    parser.add_argument(      '--heartbeat', type=float, default=900, action='store', help='Print a value at least every SECONDS with --deadband')
+    return parser.parse_args()
+
+def main():
+    args=GetArgs()
+    args.output="standard"
+    args.socket=None
+    def on_result(job):
+        if job.error:
+            sys.stdout.write(job.sensor.name+" "+job.error+"\n")
+        elif job.measurements:
+            sys.stdout.write(rpi_nagios.formatOutput(job.sensor.name,job.measurements,args)+"\n")
+    scheduler=Scheduler(args.workers,on_result=on_result)
+    if args.deadband:
+        import rpi_sampling
+        rpi_sampling.load_config()
+    for interval,spec in args.job:
+        specargs=rpi_nagios.parseSpec(spec,args)
+        sensor=rpi_nagios.getSensor(specargs)
+        if not sensor:
+            raise ValueError("Did not get sensor back: "+spec)
+        policy=None
+        if args.deadband or args.max_interval:
+            import rpi_sampling
+            policy=rpi_sampling.Policy(float(interval),args.max_interval,args.heartbeat,args.deadband)
+        scheduler.add(sensor,float(interval),policy=policy)
+    def report():
+        while not scheduler.stopped.wait(args.stats):
+            sys.stderr.write(str(scheduler.stats())+"\n")
+    thread=threading.Thread(target=report)
+    thread.daemon=True
+    thread.start()
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+if __name__=="__main__":
+    main()
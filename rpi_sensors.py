@@ -24,22 +24,100 @@
 # snd-bcm2835, i2c-dev, i2c-bcm2708, spi_bcm2708, w1-gpio, w1-therm
 ###############################################################################
 
-import subprocess,glob,time,datetime
-import RPi.GPIO as GPIO
-from Adafruit_BMP085 import BMP085 as ADA_BMP085
-from timeout import timeout
+import subprocess,collections,glob,os,threading,time,datetime
+from array import array
+import rpi_deadline,rpi_stats
+from rpi_deadline import timeout
 
-GPIO.setmode(GPIO.BCM)
+# Drivers are imported when the first sensor that needs them is created and not
+# at import time, so e.g. a check of the RPi internals or a DS18B20 does not pay
+# for importing RPi.GPIO and setting the GPIO mode
+_drivers={}
+
+def load_driver(name):
+    driver=_drivers.get(name)
+    if driver is None:
+        if name=="gpio":
+            import RPi.GPIO as driver
+            driver.setmode(driver.BCM)
+        elif name=="bmp085":
+            from Adafruit_BMP085 import BMP085 as driver
+        elif name=="smbus":
+            import smbus as driver
+        else:
+            raise ValueError("Unknown driver: "+name)
+        _drivers[name]=driver
+    return driver
+
+#replace a driver, e.g. by a simulation
+def set_driver(name,driver):
+    _drivers[name]=driver
+
+#seconds of a clock which never jumps (time.monotonic is missing in python 2)
+#clock_gettime is looked up with ctypes at the first call
+_clock_gettime=None
+
+def monotonic():
+    global _clock_gettime
+    if hasattr(time,"monotonic"):
+        return time.monotonic()
+    if _clock_gettime is None:
+        import ctypes,ctypes.util
+        class timespec(ctypes.Structure):
+            _fields_=[("tv_sec",ctypes.c_long),("tv_nsec",ctypes.c_long)]
+        librt=ctypes.CDLL(ctypes.util.find_library("rt") or ctypes.util.find_library("c"),use_errno=True)
+        librt.clock_gettime.argtypes=[ctypes.c_int,ctypes.POINTER(timespec)]
+        ts=timespec()
+        #CLOCK_MONOTONIC=1
+        def clock_gettime():
+            librt.clock_gettime(1,ctypes.byref(ts))
+            return ts.tv_sec+ts.tv_nsec*1e-9
+        _clock_gettime=clock_gettime
+    return _clock_gettime()
 
 
 # MeasurementType is to store a Measurement with a value, names, timestamp and basetype of measurement (e.g. meter)
 # the basetype is used for future release for conversion. conversion rate also needed
 
+#dict which can not be changed after it was created
+class FrozenDict(dict):
+    def _readonly(self,*args,**kwargs):
+        raise TypeError("FrozenDict can not be changed")
+    __setitem__=__delitem__=clear=pop=popitem=setdefault=update=_readonly
+
+#longname, shortname and mtype of every shortcode
+units=FrozenDict({
+    "dc":   ("degree Celsius","o C","t"),        #shortname could be "\xb0C"
+    "df":   ("degree Fahrenheit","o F","t"),     #shortname could be "\xb0F"
+    "k":    ("Kelvin","K","t"),
+    "h":    ("percent humidity","%H","h"),
+    "hpa":  ("hecto Pascal","hPa","p"),
+    "pa":   ("Pascal","Pa","p"),
+    "inhg": ("inch of mercury","inHg","p"),
+    "mmhg": ("millimeter of mercury","mmHg","p"),
+    "msea": ("meter sealevel","m","m"),
+    "cm":   ("centi meter","cm","m"),
+    "m":    ("meter","m","m"),
+    "in":   ("inch","in","m"),
+    "md":   ("motion detected","motion","b"),
+    "mhz":  ("Mega Hertz","MHz","s"),            #1 Hertz= 1*s^-1. s=second
+    "v":    ("Volt","V","v"),
+    "cnt":  ("count","count","n"),
+    "s":    ("seconds","s","time"),
+    "pct":  ("percent","%","r"),
+})
+undefined_unit=("undefined longname","undefined shortname","undefined")
+
+#slots instead of a dict per object, many of them are kept for averaging and history
+#the timestamp is stored as epoch seconds and only turned into a datetime when asked for
 class MeasurementType(object):
+    __slots__=("value","_shortcode","longname","shortname","mtype","epoch","_timestamp")
+
     def __init__(self,value,shortcode,longname=None,shortname=None,mtype=None):
         self.value=value
-	self.shortcode=shortcode
-        self.timestamp=datetime.datetime.now()
+        self.shortcode=shortcode
+        self.epoch=time.time()
+        self._timestamp=None
         if (longname and shortname and mtype):
             self.longname=longname
             self.shortname=shortname
@@ -53,88 +131,112 @@ class MeasurementType(object):
     @shortcode.setter
     def shortcode(self,shortcode):
         self._shortcode=shortcode
-        if (shortcode == "dc"):
-            self.longname="degree Celsius"
-            self.shortname="o C"
-            #self.shortname="\xb0C"
-            self.mtype="t"
-        elif (shortcode == "df"):
-            self.longname="degree Fahrenheit"
-            self.shortname="o F"
-            #self.shortname="\xb0F"
-            self.mtype="t"
-        elif (shortcode == "k"):
-            self.longname="Kelvin"
-            self.shortname="K"
-            self.mtype="t"
-        elif (shortcode == "h"):
-            self.longname="percent humidity"
-            self.shortname="%H"
-            self.mtype="h"
-        elif (shortcode == "hpa"):
-            self.longname="hecto Pascal"
-            self.shortname="hPa"
-            self.mtype="p"
-        elif (shortcode == "msea"):
-            self.longname="meter sealevel"
-            self.shortname="m"
-            self.mtype="m"
-        elif (shortcode == "cm"):
-            self.longname="centi meter"
-            self.shortname="cm"
-            self.mtype="m"
-        elif (shortcode == "md"):
-            self.longname="motion detected"
-            self.shortname="motion"
-            self.mtype="b"
-        elif (shortcode == "mhz"):
-            self.longname="Mega Hertz"
-            self.shortname="MHz"
-            #1 Hertz= 1*s^-1. s=second
-            self.mtype="s"
-        elif (shortcode == "v"):
-            self.longname="Volt"
-            self.shortname="V"
-            self.mtype="v"
-        else:
-            self.longname="undefined longname"
-            self.shortname="undefined shortname"
-            self.mtype="undefined"
+        self.longname,self.shortname,self.mtype=units.get(shortcode,undefined_unit)
+
+    @property
+    def timestamp(self):
+        if self._timestamp is None:
+            self._timestamp=datetime.datetime.fromtimestamp(self.epoch)
+        return self._timestamp
+    @timestamp.setter
+    def timestamp(self,timestamp):
+        self._timestamp=timestamp
+        self.epoch=time.mktime(timestamp.timetuple())+timestamp.microsecond/1e6
+
+    #objects with slots need this for pickle protocols below 2
+    def __getstate__(self):
+        return (self.value,self._shortcode,self.longname,self.shortname,self.mtype,self.epoch)
+    def __setstate__(self,state):
+        self.value,self._shortcode,self.longname,self.shortname,self.mtype,self.epoch=state
+        self._timestamp=None
 
     def __str__(self):
         return str(self.value)+" "+self.shortname
 
-#better use of conversions would be to calculate back to base type and afterwards to the desired type
-# e.g. if temp is given in F it should be converted to K and than to e.g. C
-    def convertToFahrenheit(self):
-        if (self.shortcode=="dc"):
-            self.value=self.value*9.0/5.0 + 32
-            self.shortcode="df"
-        elif (self.shortcode=="k"):
-            self.value=(self.value-273.15)*9.0/5.0 + 32
-            self.shortcode="df"
-        else:
+#conversions go through the base unit of the mtype (see rpi_units)
+#like before nothing happens if the unit can not be converted
+    def convertTo(self,shortcode):
+        import rpi_units
+        try:
+            rpi_units.convert_measurement(self,shortcode)
+        except ValueError:
             pass
 
+    def convertToFahrenheit(self):
+        self.convertTo("df")
+
     def convertToCelsius(self):
-        if (self.shortcode=="df"):
-            self.value=(self.value -32)/ 9.0 * 5.0
-            self.shortcode="dc"
-        elif (self.shortcode=="k"):
-            self.value=self.value-273.15
-            self.shortcode="dc"
-        else:
-            pass
+        self.convertTo("dc")
 
     def convertToKelvin(self):
-        if (self.shortcode=="dc"):
-            self.value+=273.15
-            self.shortcode="k"
-        elif (self.shortcode=="df"):
-            self.value=(self.value -32)/ 9.0 * 5.0+273.15
-            self.shortcode="k"
-        else:
+        self.convertTo("k")
+
+#array of 64 bit integers: python 2 has no 'q' typecode, 'l' only has 64 bit on 64 bit systems
+#on a 32 bit Pi doubles are used, they keep nanoseconds since 1970 to ~256ns
+def int64_array():
+    for typecode in ('q','l'):
+        try:
+            if array(typecode).itemsize == 8:
+                return array(typecode)
+        except ValueError:
             pass
+    return array('d')
+
+#Series of one unit of a sensor stored in columns instead of one MeasurementType per value:
+#values as doubles and timestamps as nanoseconds since 1970
+class MeasurementBatch(object):
+    def __init__(self,shortcode,name=None):
+        self.name=name
+        self.shortcode=shortcode
+        self.longname,self.shortname,self.mtype=units.get(shortcode,undefined_unit)
+        self.values=array('d')
+        self.timestamps=int64_array()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self,i):
+        unit=MeasurementType(self.values[i],self.shortcode,self.longname,self.shortname,self.mtype)
+        unit.epoch=self.timestamps[i]/1e9
+        return unit
+
+    def __iter__(self):
+        for i in range(len(self.values)):
+            yield self[i]
+
+    def append(self,value,epoch=None):
+        if epoch is None:
+            epoch=time.time()
+        self.values.append(value)
+        self.timestamps.append(int(epoch*1e9))
+
+    def add(self,unit):
+        self.append(unit.value,unit.epoch)
+
+    def extend(self,units):
+        for unit in units:
+            self.append(unit.value,unit.epoch)
+
+    #the columns as numpy arrays sharing the memory of the batch (numpy needed)
+    def as_numpy(self):
+        import numpy
+        values=numpy.frombuffer(self.values,dtype=numpy.float64) if self.values else numpy.zeros(0)
+        if self.timestamps.typecode == 'd':
+            timestamps=numpy.asarray(self.timestamps,dtype=numpy.int64)
+        else:
+            timestamps=numpy.frombuffer(self.timestamps,dtype=numpy.int64) if self.timestamps else numpy.zeros(0,dtype=numpy.int64)
+        return values,timestamps
+
+    #one batch per position of the readings of a sensor (lists returned by readSensor)
+    @classmethod
+    def from_readings(cls,readings,name=None):
+        batches=[]
+        for reading in readings:
+            for index,unit in enumerate(reading):
+                if index == len(batches):
+                    batches.append(cls(unit.shortcode,name))
+                batches[index].add(unit)
+        return batches
 
 #Base sensor with Name and function to read measurements
 class Sensor(object):
@@ -142,21 +244,35 @@ class Sensor(object):
         self.name=name
     def readSensor(self):
         pass
+    #gives back what the sensor keeps open (files, processes, GPIO edge detection)
+    def close(self):
+        pass
 
 #RPi sensors: mhz, govener, temp, voltage
+#with a RPiSampler the files stay open and vcgencmd is not started for every read
 class RPiSens(Sensor):
-    def __init__(self,name=None):
+    def __init__(self,name=None,sampler=None):
         file="/sys/devices/system/cpu/cpu0/cpufreq/scaling_driver"
         if name==None:
             with open(file, 'r') as f:
                 self.name=f.readline()
         else:
             self.name=name
+        self.sampler=sampler
+    @rpi_stats.timed
     @timeout()
     def readSensor(self):
+        if self.sampler:
+            return [MeasurementType(self.sampler.read_frequencies()[0],"mhz"),MeasurementType(self.sampler.read_temps()[0],"dc"),MeasurementType(self.sampler.read_volts(),"v")]
         #return [MeasurementType(self.read_frequency(),"mhz"),MeasurementType(self.read_governor(),"gov","Govener","Gov.","gov"),MeasurementType(self.read_temp(),"dc"),MeasurementType(self.read_volts(),"v")]
         return [MeasurementType(self.read_frequency(),"mhz"),MeasurementType(self.read_temp(),"dc"),MeasurementType(self.read_volts(),"v")]
 
+    #the files of the sampler and its vcgencmd helper
+    def close(self):
+        if self.sampler:
+            self.sampler.close()
+            self.sampler=None
+
     def read_frequency(self,file="/sys/devices/system/cpu/cpu0/cpufreq/cpuinfo_cur_freq"):
         with open(file, 'r') as f:
             freq = f.readline()
@@ -173,17 +289,141 @@ class RPiSens(Sensor):
 
     def read_volts(self):
         args = ("/usr/bin/vcgencmd","measure_volts")
-        popen = subprocess.Popen(args, stdout=subprocess.PIPE)
-        popen.wait()
-        lines = popen.stdout.readline()
+        rpi_stats.count("spawns")
+        with rpi_stats.timer("vcgencmd"):
+            lines = rpi_deadline.communicate(args)
         return float(lines.split("=")[1].split("V")[0])
 
+#Keeps one helper process running which prints the voltage every <interval> seconds
+#read() gives the last value, so a sample never has to wait for vcgencmd
+class VoltageHelper(object):
+    def __init__(self,interval=5,vcgencmd="/usr/bin/vcgencmd"):
+        self.command=("sh","-c","while :; do "+vcgencmd+" measure_volts || exit; sleep "+str(interval)+"; done")
+        self.volts=None
+        self.process=None
+        self.ready=threading.Event()
+
+    def start(self):
+        rpi_stats.count("spawns")
+        self.process=subprocess.Popen(self.command,stdout=subprocess.PIPE)
+        thread=threading.Thread(target=self.follow,args=(self.process,))
+        thread.daemon=True
+        thread.start()
+
+    def follow(self,process):
+        for line in iter(process.stdout.readline,""):
+            try:
+                self.volts=float(line.split("=")[1].split("V")[0])
+            except (IndexError,ValueError):
+                continue
+            self.ready.set()
+
+    #waits for the first value only
+    def read(self,timeout=5):
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        self.ready.wait(timeout)
+        return self.volts
+
+    def close(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+#RPi internals for high sample rates: all sysfs files are opened once and read
+#again from the start (os.pread is missing in python 2, so it is lseek and read).
+#Covers the frequency of every CPU, every thermal zone and the governor.
+#root can point to a copy of the sysfs tree for testing
+class RPiSampler(object):
+    def __init__(self,root="/",volts=None):
+        self.root=root
+        self.cpus=self.open_files("sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_cur_freq")
+        self.zones=self.open_files("sys/class/thermal/thermal_zone[0-9]*/temp")
+        governor=os.path.join(root,"sys/devices/system/cpu/cpu0/cpufreq/scaling_governor")
+        self.governor_fd=os.open(governor,os.O_RDONLY) if os.path.exists(governor) else None
+        self.volts=volts or VoltageHelper()
+
+    #list of (name, fd) sorted by the number in the name (cpu2 before cpu10)
+    def open_files(self,pattern):
+        import re
+        files=[]
+        for path in glob.glob(os.path.join(self.root,pattern)):
+            name=[part for part in path.split("/") if re.match(r"(cpu|thermal_zone)\d+$",part)][0]
+            files.append((int(re.sub(r"\D","",name)),name,os.open(path,os.O_RDONLY)))
+        return [(name,fd) for number,name,fd in sorted(files)]
+
+    def read_fd(self,fd):
+        os.lseek(fd,0,os.SEEK_SET)
+        return os.read(fd,64)
+
+    #MHz of every cpu
+    def read_frequencies(self):
+        return [float(self.read_fd(fd))/1000 for name,fd in self.cpus]
+
+    #degree Celsius of every thermal zone
+    def read_temps(self):
+        return [float(self.read_fd(fd))/1000 for name,fd in self.zones]
+
+    def read_governor(self):
+        if self.governor_fd is None:
+            return None
+        return self.read_fd(self.governor_fd).strip()
+
+    def read_volts(self):
+        return self.volts.read()
+
+    #names of the values of a burst row
+    def columns(self):
+        return ["time"]+[name+" MHz" for name,fd in self.cpus]+[name+" C" for name,fd in self.zones]+["V"]
+
+    #<count> samples at <rate> per second into one preallocated array of doubles
+    #row i is data[i*len(columns):(i+1)*len(columns)], time is seconds since the start
+    #the voltage is the cached one of the helper
+    def burst(self,count,rate):
+        width=len(self.columns())
+        data=array('d',[0.0])*(count*width)
+        period=1.0/rate
+        cpus=[fd for name,fd in self.cpus]
+        zones=[fd for name,fd in self.zones]
+        volts=self.read_volts()
+        start=monotonic()
+        for i in range(count):
+            delay=start+i*period-monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            row=i*width
+            data[row]=monotonic()-start
+            column=row+1
+            for fd in cpus:
+                data[column]=float(self.read_fd(fd))/1000
+                column+=1
+            for fd in zones:
+                data[column]=float(self.read_fd(fd))/1000
+                column+=1
+            data[column]=volts if volts is not None else float("nan")
+        return data
+
+    def close(self):
+        for name,fd in self.cpus+self.zones:
+            os.close(fd)
+        if self.governor_fd is not None:
+            os.close(self.governor_fd)
+        self.cpus=self.zones=[]
+        self.governor_fd=None
+        self.volts.close()
+
+#parser: turns the driver output into (temperature, humidity), see rpi_dht
+#worker: a rpi_dht.DHTWorker which keeps the driver running for many reads
 class DHT(Sensor):
-    def __init__(self,name,type,read_port):
+    def __init__(self,name,type,read_port,parser=None,worker=None):
+        import rpi_dht
         Sensor.__init__(self,name)
         self.type=type
         self.read_port=read_port
+        self.parser=parser or rpi_dht.AdafruitParser()
+        self.worker=worker
 
+    @rpi_stats.timed
     @timeout()
     def readSensor(self):
         measurements=self.read_temp_hum()
@@ -192,43 +432,19 @@ class DHT(Sensor):
         else:
             return []
     def read_raw(self,dhtdriver):
-        args = ("sudo",dhtdriver, str(self.type), str(self.read_port))
-        popen = subprocess.Popen(args, stdout=subprocess.PIPE)
-        lines=popen.communicate()
-        #return of communicate is tople(stdoutdata, stderrdata)
-        lines=lines[0].strip().split("\n")
-        return lines
+        import rpi_dht
+        return rpi_dht.run_driver(dhtdriver,self.type,self.read_port,sudo=True)
 
-    def read_temp_hum(self,dhtdriver="/etc/nagios/nrpe.d/Adafruit_DHT"):
-        lines = self.read_raw(dhtdriver)
-        
-        #check if DHT is connected
-        if len(lines)<1:
-           print "no such file or not enough rights"
-           return None
-        if len(lines)==1:
-           print lines
-           return None
-        dht_check=lines[1].find("Data (0): 0x0 0x0 0x0 0x0 0x0")
-        if dht_check != -1:
-           return None
-        else:
-            while len(lines) != 3:
-               time.sleep(0.3)
-               lines = self.read_raw(dhtdriver)
-            temp_pos = lines[2].find('Temp = ')
-            hum_pos = lines[2].find('Hum = ')
-            if temp_pos != -1:
-                #Filter empty tuples due to double spaces in Adafruit Driver
-                filtered_output=filter(None, lines[2].split(' '))
-                temp_string = filtered_output[2]
-                temp_c = float(temp_string)
-                temp_c = round(temp_c, 3)
-            if hum_pos != -1:
-                hum_string = filtered_output[6]
-                hum = float(hum_string)
-            return temp_c, hum
-        return None
+    #the driver is called at most <retries> times, with a growing pause in between
+    def read_temp_hum(self,dhtdriver="/etc/nagios/nrpe.d/Adafruit_DHT",retries=5):
+        import rpi_dht
+        if self.worker:
+            return self.worker.read(self.type,self.read_port)
+        try:
+            return rpi_dht.read_with_retries(lambda: self.read_raw(dhtdriver),self.parser,retries)
+        except rpi_dht.DHTError, e:
+            print e
+            return None
        
 class OneWire(Sensor):
     def __init__(self,name,type,device_file,read_port=None):
@@ -237,6 +453,7 @@ class OneWire(Sensor):
         self.read_port=read_port
         self.device_file=device_file
 
+    @rpi_stats.timed
     @timeout()
     def readSensor(self):
         return [MeasurementType(self.read_temp(),"dc")]
@@ -252,82 +469,405 @@ class OneWire(Sensor):
      
     def read_temp(self):
         lines = self.read_temp_raw()
-        if len(lines)==1:
-            return float(lines[0])
-        else:
-            #DS18B20 sometimes give a wrong temperature of 85 deg Celsius
-            while lines[0].strip()[-3:] != 'YES' or (lines[1].find('t=85')!=-1):
-                time.sleep(0.2)
-                lines = self.read_temp_raw()
-            equals_pos = lines[1].find('t=')
-            if equals_pos != -1:
-                temp_string = lines[1][equals_pos+2:]
-                temp_c = float(temp_string) / 1000.0
-                return temp_c
-
-
- 
+        temp_c = parse_temp(lines)
+        #DS18B20 sometimes give a wrong temperature of 85 deg Celsius
+        while temp_c is None:
+            if rpi_stats.enabled:
+                rpi_stats.count("rejected_85" if is_power_on(lines) else "crc_errors")
+                rpi_stats.count("retries")
+            rpi_deadline.sleep(0.2)
+            lines = self.read_temp_raw()
+            temp_c = parse_temp(lines)
+        return temp_c
+
+    #id of the device, e.g. 28-000004a2b3c4 (or 28.A2B3C4000000 with owfs)
+    def device_id(self):
+        return os.path.basename(os.path.dirname(self.device_file))
+
+#temperature in the content of a w1_slave (or owfs temperature) file
+#None if the CRC is wrong or the DS18B20 gave its power on value of 85 deg Celsius
+def parse_temp(lines):
+    if len(lines)==1:
+        return float(lines[0])
+    if len(lines)<2 or lines[0].strip()[-3:] != 'YES':
+        return None
+    equals_pos = lines[1].find('t=')
+    if equals_pos == -1 or lines[1][equals_pos+2:].strip() == '85000':
+        return None
+    return float(lines[1][equals_pos+2:]) / 1000.0
+
+#True if parse_temp gave None for the power on value and not for a wrong CRC
+def is_power_on(lines):
+    return len(lines)>=2 and lines[0].strip()[-3:] == 'YES' and lines[1].strip().endswith('t=85000')
+
+#All DS18B20 of a 1-wire bus read with one conversion.
+#Reading w1_slave files one after another starts a conversion of ~750ms for every
+#device. Here all devices convert at the same time (therm_bulk_read of the w1 master
+#or simultaneous/temperature of owfs) and are read afterwards in one pass.
+#Devices which still give no valid value are read again one by one.
+class OneWireBus(Sensor):
+    def __init__(self,name,devices,base_dir="/sys/bus/w1/devices/",conversion_time=0.75):
+        Sensor.__init__(self,name)
+        #sorted to keep the order of the perfdata stable
+        self.devices=sorted(devices,key=lambda device: device.device_file)
+        self.base_dir=base_dir
+        self.conversion_time=conversion_time
+
+    @rpi_stats.timed
+    @timeout()
+    def readSensor(self):
+        return [MeasurementType(temp_c,"dc","degree Celsius "+device.device_id(),"o C","t") for device,temp_c in self.read_temps()]
+
+    #starts the conversion on all devices. False if the bus does not support it
+    def convert_all(self):
+        with rpi_stats.timer("conversion"):
+            return self.convert()
+
+    def convert(self):
+        bulk_files=glob.glob(self.base_dir+"w1_bus_master*/therm_bulk_read")
+        if bulk_files:
+            for bulk_file in bulk_files:
+                with open(bulk_file,'w') as f:
+                    f.write("trigger\n")
+            #reading therm_bulk_read gives -1 as long as a conversion is running
+            deadline=time.time()+2*self.conversion_time
+            for bulk_file in bulk_files:
+                while time.time() < deadline:
+                    with open(bulk_file,'r') as f:
+                        if f.read().strip() != "-1":
+                            break
+                    rpi_deadline.sleep(0.05)
+            return True
+        simultaneous=self.base_dir+"simultaneous/temperature"
+        if os.path.exists(simultaneous):
+            with open(simultaneous,'w') as f:
+                f.write("1")
+            rpi_deadline.sleep(self.conversion_time)
+            return True
+        return False
+
+    #returns a list of (device, temperature)
+    def read_temps(self):
+        converted=self.convert_all()
+        temps=[]
+        for device in self.devices:
+            temp_c=None
+            if converted:
+                #owfs would start a new conversion when reading temperature
+                latest=os.path.join(os.path.dirname(device.device_file),"latesttemperature")
+                if os.path.exists(latest):
+                    with open(latest,'r') as f:
+                        temp_c=parse_temp(f.readlines())
+                else:
+                    temp_c=parse_temp(device.read_temp_raw())
+            if temp_c is None:
+                rpi_stats.count("fallbacks")
+                temp_c=device.read_temp()
+            temps.append((device,temp_c))
+        return temps
+
+#edge: wait for the edges of the echo with GPIO edge detection instead of polling it
+#pings: number of pings per reading in edge mode, the reading is their median
+#gpio: a module or object with the RPi.GPIO interface, e.g. a simulation
 class UltraSonic(Sensor):
-    def __init__(self,name,trigger,echo):
+    #echo of the HC-SR04 is at most ~23ms long (4m there and back), plus some spare
+    max_echo=0.03
+    #the echo starts ~0.5ms after the trigger
+    max_rise=0.01
+    #time between two pings so the last echo has died away
+    ping_spacing=0.06
+
+    def __init__(self,name,trigger,echo,edge=False,pings=1,gpio=None):
         Sensor.__init__(self,name)
         self.trigger=trigger
         self.echo=echo
+        self.edge=edge or pings > 1
+        self.pings=pings
+        self.gpio=gpio or load_driver("gpio")
+        self.edges=[]
+        self.echo_done=threading.Event()
         self.ultrasonic_setup()
         
     def ultrasonic_setup(self):
-        GPIO.setup(self.trigger,GPIO.OUT)
-        GPIO.setup(self.echo,GPIO.IN)
-        GPIO.output(self.trigger, False)
+        self.gpio.setup(self.trigger,self.gpio.OUT)
+        self.gpio.setup(self.echo,self.gpio.IN)
+        self.gpio.output(self.trigger, False)
+        if self.edge:
+            self.gpio.add_event_detect(self.echo,self.gpio.BOTH,callback=self.echo_edge)
+
+    def close(self):
+        if self.edge:
+            self.gpio.remove_event_detect(self.echo)
 
     def __del__(self):
         cleanup()
 
+    @rpi_stats.timed
     @timeout()
     def readSensor(self):
-        return [MeasurementType(self.measure_distance(),"cm")]
+        if self.edge:
+            distance,spread=self.measure_burst(self.pings)
+            if distance is None:
+                return []
+            if self.pings > 1:
+                return [MeasurementType(distance,"cm"),MeasurementType(spread,"cm","spread centi meter","cm","m")]
+            return [MeasurementType(distance,"cm")]
+        distance=self.measure_distance()
+        if distance is None:
+            rpi_stats.count("lost_echoes")
+            return []
+        return [MeasurementType(distance,"cm")]
+
+    #called by the GPIO library for every edge of the echo pin
+    #the first edge after the trigger is the rising one, the second the falling one
+    def echo_edge(self,channel):
+        self.edges.append(monotonic())
+        if len(self.edges) >= 2:
+            self.echo_done.set()
+
+    #one ping in edge mode, None if no echo came back in time (nothing in range)
+    def measure_distance_edge(self):
+        self.edges=[]
+        self.echo_done.clear()
+        self.gpio.output(self.trigger, True)
+        time.sleep(0.00001)
+        self.gpio.output(self.trigger, False)
+        if not self.echo_done.wait(self.max_rise+self.max_echo):
+            return None
+        start,stop=self.edges[:2]
+        return ((stop-start) * 34300)/2
+
+    #median and spread (median absolute deviation) of <count> pings
+    #pings without echo are left out, (None, None) if none came back
+    def measure_burst(self,count):
+        distances=[]
+        begin=monotonic()
+        for ping in range(count):
+            delay=begin+ping*self.ping_spacing-monotonic()
+            if delay > 0:
+                rpi_deadline.sleep(delay)
+            distance=self.measure_distance_edge()
+            if distance is not None:
+                distances.append(distance)
+            else:
+                rpi_stats.count("lost_echoes")
+        if not distances:
+            return None,None
+        median=median_value(distances)
+        return median,median_value([abs(distance-median) for distance in distances])
     
     #Matt Hawkins
     #http://www.raspberrypi-spy.co.uk/
+    #None if the echo does not rise or fall in time, the loops used to wait
+    #until the timeout for a missing echo
     def measure_distance(self):
-        GPIO.output(self.trigger, True)
+        self.gpio.output(self.trigger, True)
         time.sleep(0.00001)
-        GPIO.output(self.trigger, False)
+        self.gpio.output(self.trigger, False)
         start = time.time()
+        sent = start
 
-        while GPIO.input(self.echo)==0:
+        while self.gpio.input(self.echo)==0:
             start = time.time()
+            if start-sent > self.max_rise:
+                return None
 
-        while GPIO.input(self.echo)==1:
+        stop = start
+        while self.gpio.input(self.echo)==1:
             stop = time.time()
+            if stop-start > self.max_echo:
+                return None
 
         elapsed = stop-start
         distance = (elapsed * 34300)/2
 
         return distance
         
-class BMP085(Sensor,ADA_BMP085):
-    def __init__(self,name,address=0x77,mode=1,debug=False):
+#BMP085 read over I2C (smbus) with one temperature and one pressure conversion per
+#reading, temperature, pressure and altitude are all calculated from them.
+#(the Adafruit driver converts again for every value it is asked for)
+#mode is the oversampling: 0 ultra low power (5ms per pressure conversion) to
+#3 ultra high resolution (26ms), the more samples the less noise.
+#The calibration is read from the EEPROM once per bus and address and kept.
+#bus: an object with the smbus interface, e.g. rpi_fakes.FakeBMP085Bus
+#the methods of the Adafruit driver (readTemperature, readPressure, ...) are
+#still available, the driver is loaded when one of them is used
+class BMP085(Sensor):
+    pressure_waits=(0.005,0.008,0.014,0.026)
+    temperature_wait=0.005
+    #(bus, address) -> calibration
+    calibrations={}
+
+    def __init__(self,name,address=0x77,mode=1,debug=False,busnum=None,bus=None):
         Sensor.__init__(self,name)
-        ADA_BMP085.__init__(self,address, mode, debug)
+        self.address=address
+        self.mode=mode
+        self.debug=debug
+        if bus is None:
+            if busnum is None:
+                import rpi_version
+                #the first boards have the I2C pins on bus 0
+                busnum=rpi_version.getI2CBus()
+            bus=load_driver("smbus").SMBus(busnum)
+        self.busnum=busnum
+        self.bus=bus
+
+    #methods of the Adafruit driver which load it, everything else is no attribute
+    driver_methods=("readTemperature","readPressure","readAltitude","readRawTemp","readRawPressure")
+
+    def __getattr__(self,name):
+        if name not in self.driver_methods:
+            raise AttributeError(name)
+        if "driver" not in self.__dict__:
+            self.driver=load_driver("bmp085")(self.address, self.mode, self.debug)
+        return getattr(self.driver,name)
 
+    @rpi_stats.timed
     @timeout()
     def readSensor(self):
-        return [MeasurementType(self.readTemperature(),"dc"),MeasurementType(float(self.readPressure())/100,"hpa"),MeasurementType(self.readAltitude(),"msea")]
+        temp_c,pressure,altitude=self.read_fused()
+        return [MeasurementType(temp_c,"dc"),MeasurementType(pressure/100.0,"hpa"),MeasurementType(altitude,"msea")]
+
+    #AC1 AC2 AC3 AC4 AC5 AC6 B1 B2 MB MC MD, AC4-AC6 are unsigned
+    def read_calibration(self):
+        key=(self.busnum if self.busnum is not None else self.bus,self.address)
+        calibration=self.calibrations.get(key)
+        if calibration is None:
+            data=self.bus.read_i2c_block_data(self.address,0xAA,22)
+            calibration=[]
+            for i in range(11):
+                value=(data[2*i]<<8)+data[2*i+1]
+                if i not in (3,4,5) and value > 32767:
+                    value-=65536
+                calibration.append(value)
+            self.calibrations[key]=calibration
+        return calibration
+
+    def read_raw_temp(self):
+        self.bus.write_byte_data(self.address,0xF4,0x2E)
+        time.sleep(self.temperature_wait)
+        msb,lsb=self.bus.read_i2c_block_data(self.address,0xF6,2)
+        return (msb<<8)+lsb
+
+    def read_raw_pressure(self):
+        self.bus.write_byte_data(self.address,0xF4,0x34+(self.mode<<6))
+        time.sleep(self.pressure_waits[self.mode])
+        msb,lsb,xlsb=self.bus.read_i2c_block_data(self.address,0xF6,3)
+        return ((msb<<16)+(lsb<<8)+xlsb)>>(8-self.mode)
+
+    #(degree Celsius, Pascal, meter above sea level) from one raw temperature and one raw pressure
+    def read_fused(self,sealevel=101325.0):
+        import rpi_units
+        AC1,AC2,AC3,AC4,AC5,AC6,B1,B2,MB,MC,MD=self.read_calibration()
+        UT=self.read_raw_temp()
+        UP=self.read_raw_pressure()
+        #calculation from the BMP085 datasheet
+        X1=((UT-AC6)*AC5)>>15
+        X2=(MC<<11)//(X1+MD)
+        B5=X1+X2
+        temp_c=((B5+8)>>4)/10.0
+        B6=B5-4000
+        X1=(B2*((B6*B6)>>12))>>11
+        X2=(AC2*B6)>>11
+        X3=X1+X2
+        B3=(((AC1*4+X3)<<self.mode)+2)//4
+        X1=(AC3*B6)>>13
+        X2=(B1*((B6*B6)>>12))>>16
+        X3=((X1+X2)+2)>>2
+        B4=(AC4*(X3+32768))>>15
+        B7=(UP-B3)*(50000>>self.mode)
+        if B7 < 0x80000000:
+            p=(B7*2)//B4
+        else:
+            p=(B7//B4)*2
+        X1=(p>>8)*(p>>8)
+        X1=(X1*3038)>>16
+        X2=(-7357*p)>>16
+        p=p+((X1+X2+3791)>>4)
+        return temp_c,float(p),rpi_units.pressure_to_altitude(float(p),"pa",sealevel)
         
+#events: count motions with an edge callback instead of looking at the pin when read.
+#readSensor then returns the number of motions since the last read, the seconds
+#since the last motion and the percentage of time with motion since the last read.
+#Only the callback thread writes the counters, a read only compares them with
+#the values of the last read, so both sides are O(1) and need no lock
 class PIR(Sensor):
-    def __init__(self,name,echo):
+    def __init__(self,name,echo,events=False,debounce=0.05,gpio=None,keep=64):
         Sensor.__init__(self,name)
         self.echo=echo
         self.__previous_state=0
 	self.__current_state=0
-	GPIO.setup(self.echo,GPIO.IN)
-    
+	self.gpio=gpio or load_driver("gpio")
+	self.gpio.setup(self.echo,self.gpio.IN)
+        self.events=events
+        if events:
+            self.debounce=debounce
+            self.state=0
+            self.last_change=-debounce
+            self.motions=0
+            self.rise_time=None
+            self.high_time=0.0
+            #times (epoch) of the last <keep> motions
+            self.motion_times=collections.deque(maxlen=keep)
+            self.started=monotonic()
+            self.read_at=(self.started,0,0.0)
+            self.gpio.add_event_detect(self.echo,self.gpio.BOTH,callback=self.motion_edge)
+
+    def close(self):
+        if self.events:
+            self.gpio.remove_event_detect(self.echo)
+
+    @rpi_stats.timed
     @timeout()
     def readSensor(self):
+        if self.events:
+            count,since,duty=self.read_events()
+            return [MeasurementType(count,"cnt","motion count","motions","n"),
+                    MeasurementType(since,"s","seconds since last motion","s","time"),
+                    MeasurementType(duty,"pct","motion duty cycle","%","r")]
         return [MeasurementType(self.isMotion(),"md")]
+
+    #called by the GPIO library for every edge, edges closer than <debounce> are ignored
+    def motion_edge(self,channel):
+        now=monotonic()
+        level=self.gpio.input(channel)
+        if level == self.state or now-self.last_change < self.debounce:
+            return
+        self.last_change=now
+        if level:
+            self.rise_time=now
+            self.motion_times.append(time.time())
+            self.motions+=1
+        elif self.rise_time is not None:
+            self.high_time+=now-self.rise_time
+        self.state=level
+
+    #seconds with motion since the start, including a motion which is still going on
+    def motion_time(self,now):
+        rise_time=self.rise_time
+        if self.state and rise_time is not None:
+            return self.high_time+now-rise_time
+        return self.high_time
+
+    #(motions, seconds since the last motion, percent of time with motion) since the last read
+    def read_events(self):
+        now=monotonic()
+        last_read,last_motions,last_motion_time=self.read_at
+        motions=self.motions
+        motion_time=self.motion_time(now)
+        self.read_at=(now,motions,motion_time)
+        if self.state:
+            since=0.0
+        elif self.motion_times:
+            since=time.time()-self.motion_times[-1]
+        else:
+            #no motion since the start
+            since=now-self.started
+        duty=100.0*(motion_time-last_motion_time)/(now-last_read) if now > last_read else 0.0
+        return motions-last_motions,since,duty
     
     def isMotion(self):
-        self.__current_state=GPIO.input(self.echo)
+        self.__current_state=self.gpio.input(self.echo)
         if self.__current_state==1 and self.__previous_state==0:
             self.__previous_state=1
             return True
@@ -336,90 +876,296 @@ class PIR(Sensor):
         return False
 
 
-#Measure Average is for future release. It's for measuring multiple times, sort measurements, cut the two outer thirds and make an average of the last third
-#I think this is like in ski jumping but they only cut the highest and lowest  
+#Measure Average is for measuring multiple times, sort measurements, cut the two outer thirds and make an average of the last third
+#I think this is like in ski jumping but they only cut the highest and lowest
+#the work is done by rpi_estimators, for a continuous stream of samples use rpi_estimators.SlidingWindow
 def measure_average(measurement_function,accuracy,sleeptime=0):
+    import rpi_estimators
+    measurements=collect_measurements(measurement_function,accuracy,sleeptime)
+    window=rpi_estimators.SlidingWindow(accuracy)
+    try:
+        for measurement in measurements:
+            window.add(float(measurement))
+    except TypeError, te:
+        return None
+    return window.trimmed_mean()
 
-        all=0     #all together
-        measurement_now=0
-
-        measurements=[]
-        #collect all measurements
-        for round in range(0,accuracy):
-            #measure
-            measurement_now=measurement_function()
-            #add to list
-            measurements.append(measurement_now)
-            #add to total measurement
-            all+=measurement_now
-            time.sleep(sleeptime)
-        #when all data collected sort the list
-        measurements.sort()
-        #accuracy method only makes sense from 4 measurements
-        if accuracy > 3:
-            #cut the collected data in 3 parts: low-mid-high (the count of mid data is always >= low or high)
-            for round in range(0,int(accuracy/3)):
-                #remove last item
-                pop=measurements.pop()
-                #remove high data from collected data
-                all-=pop
-                #remove first item
-                pop=measurements.pop(0)
-                #remove low data from collected data
-                all-=pop
-        #return average of collected data where low and high data was cut
-        try:
-            return all/(accuracy-2*int(accuracy/3))
-        except TypeError, te:
-            return None
-
-#same here but it's for multiple measurements.
-#needs improvment for non digit values
-#needs renaming for lists instead of tuples
-#maybe this will go to a single function
+#same here but it's for multiple measurements. every position of the tuples is averaged on its own
 def measure_average_tuples(measurement_function,accuracy,sleeptime=0):
-    measurement_now=0
+    import rpi_estimators
+    measurements=collect_measurements(measurement_function,accuracy,sleeptime)
+    try:
+        return rpi_estimators.trimmed_mean_columns(measurements)
+    except (TypeError,ValueError), te:
+        return None
+
+def median_value(values):
+    values=sorted(values)
+    middle=len(values)//2
+    if len(values)%2:
+        return values[middle]
+    return (values[middle-1]+values[middle])/2.0
 
+#calls measurement_function accuracy times, sleeping only between the measurements
+def collect_measurements(measurement_function,accuracy,sleeptime=0):
     measurements=[]
-    #collect all measurements
     for round in range(0,accuracy):
-        #measure
-        measurement_now=measurement_function()
-        #add to list
-        measurements.append(measurement_now)
-        time.sleep(sleeptime)
-    #when all data collected sort the list
-    measurements.sort()
-    #accuracy method only makes sense from 4 measurements
-    if accuracy > 3:
-        #cut the collected data in 3 parts: low-mid-high (the count of mid data is always >= low or high)
-        for round in range(0,int(accuracy/3)):
-            #remove last item
-            measurements.pop()
-            #remove first item
-            measurements.pop(0)
-    #return average of collected data where low and high data was cut
-    #http://stackoverflow.com/questions/12412546/average-tuple-of-tuples
-    try:
-        return tuple(map(lambda y: sum(y)/float(len(y)),zip(*measurements)))
-    except TypeError, te:
-        return None
+        if round and sleeptime:
+            time.sleep(sleeptime)
+        measurements.append(measurement_function())
+    return measurements
 
 #cleanup GPIO ports. currently only needed for ultrasonic sensor
+#nothing to do if no sensor ever loaded the GPIO driver
 def cleanup():
-    GPIO.cleanup()    
+    if "gpio" in _drivers:
+        _drivers["gpio"].cleanup()
+
+#devices of the w1-gpio master, can point to a copy of the tree for testing
+w1_base_dir="/sys/bus/w1/devices/"
 
 #gets all 1-wire devices.
 #currently only temperature (28*) devices are known to me
-def init_onewire_devices(base_dir="/sys/bus/w1/devices/",sens_dir="28*",sub_dir="/w1_slave"):
+def init_onewire_devices(base_dir=None,sens_dir="28*",sub_dir="/w1_slave"):
+    base_dir=base_dir or w1_base_dir
     onewire_devices=[]
     for device in get_onewire_devices(base_dir,sens_dir,sub_dir):
         onewire_devices.append(OneWire("DS18B20","Temperature",device))
     return onewire_devices
 
+#all DS18B20 of the registry of a base dir read with one conversion
+#sub_dir: file of the temperature, None for w1_slave (owfs: "temperature")
+def init_onewire_bus(name="DS18B20",base_dir=None,sub_dir=None):
+    registry=get_onewire_registry(base_dir,sub_dir)
+    return OneWireBus(name,registry.devices(w1_temp_family),registry.base_dir)
+
 #getting the OS files of the 1-wire devices
 def get_onewire_devices(base_dir,sens_dir,sub_dir):
     device_files=[]
     for device_folder in glob.glob(base_dir + sens_dir):
         device_files.append(device_folder + sub_dir)
     return device_files
+
+#1-wire family codes of the temperature sensors: name and the file with the temperature
+w1_families={
+    "10":("DS18S20","w1_slave"),
+    "22":("DS1822","w1_slave"),
+    "28":("DS18B20","w1_slave"),
+    "3b":("DS1825","w1_slave"),
+    "42":("DS28EA00","w1_slave"),
+}
+#the registry of the last check, so the next one does not have to look at every device
+#in a directory of the service, a cache other users can write is not read
+w1_cache_file="/var/cache/rpi_sensors/w1.json"
+#family of the devices counted by -n and read by --all
+w1_temp_family="28"
+
+#family code of a device id, 28-000004a2b3c4 (w1-gpio) or 28.A2B3C4000000 (owfs)
+def w1_family(device_id):
+    import re
+    return re.split(r"[-.]",device_id,1)[0].lower()
+
+#True if only root or this user can change the file and its directory
+def is_trusted(path):
+    try:
+        for name in (path,os.path.dirname(os.path.abspath(path))):
+            info=os.lstat(name)
+            if info.st_uid not in (0,os.getuid()) or info.st_mode & 0o022:
+                return False
+    except OSError:
+        return False
+    return True
+
+#writes <data> as JSON to a new file in the directory of <path> and renames it,
+#a symlink at <path> is replaced and not followed
+def write_json(path,data):
+    import json,tempfile
+    directory=os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory,0o755)
+    handle,temp=tempfile.mkstemp(prefix=".w1",dir=directory)
+    try:
+        with os.fdopen(handle,'w') as f:
+            json.dump(data,f)
+        os.chmod(temp,0o644)
+        os.rename(temp,path)
+    except (IOError,OSError):
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+
+#1-wire devices by id and alias (O(1)). The devices are only looked up again when
+#the bus master reports other slaves (w1_master_slaves, with owfs the directory)
+#aliases: {alias: device id}, e.g. from the [w1_aliases] section of the config file
+#sub_dir: file of the temperature, None for the one of the family (owfs: "temperature")
+#check_interval: seconds in which the bus is asked only once (long running processes)
+class OneWireRegistry(object):
+    def __init__(self,base_dir=None,aliases=None,families=w1_families,sub_dir=None,cache_file=None,check_interval=1.0):
+        self.base_dir=base_dir or w1_base_dir
+        self.aliases=dict(aliases or {})
+        self.families=families
+        self.sub_dir=sub_dir
+        self.cache_file=cache_file
+        self.check_interval=check_interval
+        self.checked=None
+        self.masters=None
+        self.signature=None
+        #device ids in the order of the directory (like glob), id -> file, serial -> id
+        self.ids=[]
+        self.paths={}
+        self.serials={}
+        self.sensors={}
+        self.load()
+
+    #what the bus reports as connected, changes when a slave is added or removed
+    def read_signature(self):
+        if not self.masters:
+            self.masters=sorted(glob.glob(os.path.join(self.base_dir,"w1_bus_master*","w1_master_slaves")))
+        if self.masters:
+            slaves=[]
+            try:
+                for master in self.masters:
+                    with open(master,'r') as f:
+                        slaves.append(f.read())
+            except IOError:
+                #the master is gone (module unloaded), look for it again next time
+                self.masters=None
+                return None
+            return "".join(slaves)
+        return "\n".join(sorted(os.listdir(self.base_dir))) if os.path.isdir(self.base_dir) else ""
+
+    #file of a device id, None for an id which is no device directory of a known family
+    def path(self,device_id):
+        family=self.families.get(w1_family(device_id))
+        if not family or os.sep in device_id or device_id in (os.curdir,os.pardir):
+            return None
+        return os.path.join(self.base_dir,device_id,self.sub_dir or family[1])
+
+    #only the ids are taken from the cache, their files are built again below the base dir
+    def load(self):
+        if not self.cache_file or not is_trusted(self.cache_file):
+            return
+        import json
+        try:
+            with open(self.cache_file,'r') as f:
+                cache=json.load(f)
+            if cache.get("base_dir") != self.base_dir or cache.get("sub_dir") != self.sub_dir:
+                return
+            ids=[unicode(device_id).encode("utf-8") for device_id in cache["ids"]]
+            signature=cache["signature"]
+        except (IOError,ValueError,KeyError,TypeError):
+            return
+        paths=dict((device_id,self.path(device_id)) for device_id in ids)
+        if None not in paths.values():
+            self.index(ids,paths)
+            self.signature=signature
+
+    def save(self):
+        if not self.cache_file:
+            return
+        try:
+            write_json(self.cache_file,{"base_dir":self.base_dir,"sub_dir":self.sub_dir,"signature":self.signature,"ids":self.ids})
+        except (IOError,OSError):
+            #no cache, the next check looks at the devices again
+            pass
+
+    def index(self,ids,paths):
+        import re
+        self.ids=list(ids)
+        self.paths=dict(paths)
+        self.serials=dict((re.split(r"[-.]",device_id,1)[-1].lower(),device_id) for device_id in self.ids)
+        self.sensors=dict((device_id,sensor) for device_id,sensor in self.sensors.items() if self.paths.get(device_id) == sensor.device_file)
+
+    #looks at the devices again if the bus changed, True if it did
+    def refresh(self,force=False):
+        now=monotonic()
+        if not force and self.checked is not None and now-self.checked < self.check_interval:
+            return False
+        self.checked=now
+        signature=self.read_signature()
+        if signature == self.signature and not force:
+            return False
+        ids=[]
+        paths={}
+        if os.path.isdir(self.base_dir):
+            for device_id in os.listdir(self.base_dir):
+                path=self.path(device_id)
+                if path:
+                    ids.append(device_id)
+                    paths[device_id]=path
+        self.index(ids,paths)
+        self.signature=signature
+        self.save()
+        return True
+
+    def find(self,key):
+        if key in self.paths:
+            return key
+        key=self.aliases.get(key,key)
+        if key in self.paths:
+            return key
+        return self.serials.get(key.lower())
+
+    #device id of an id, the serial of an id (without family code) or an alias
+    def resolve(self,key):
+        self.refresh()
+        device_id=self.find(key)
+        if device_id is None and self.checked is not None:
+            #maybe connected since the last look at the bus
+            self.checked=None
+            if self.refresh():
+                device_id=self.find(key)
+        return device_id
+
+    def sensor(self,device_id):
+        sensor=self.sensors.get(device_id)
+        if sensor is None:
+            sensor=OneWire(self.families.get(w1_family(device_id),("1-wire",))[0],"Temperature",self.paths[device_id])
+            self.sensors[device_id]=sensor
+        return sensor
+
+    #OneWire of an id or alias, None if it is not connected
+    def lookup(self,key):
+        device_id=self.resolve(key)
+        if device_id is None:
+            return None
+        return self.sensor(device_id)
+
+    #OneWire of the <number>th DS18B20 (from 1), None if there are less
+    #only the DS18B20 are counted, like the 28* devices before the other families
+    def by_number(self,number):
+        ids=self.family_ids(w1_temp_family)
+        if 0 < number <= len(ids):
+            return self.sensor(ids[number-1])
+        return None
+
+    #ids of the devices of a family, of all families for None
+    def family_ids(self,family=None):
+        self.refresh()
+        return [device_id for device_id in self.ids if family is None or w1_family(device_id) == family]
+
+    def devices(self,family=None):
+        return [self.sensor(device_id) for device_id in self.family_ids(family)]
+
+#aliases of the [w1_aliases] section of the config file, e.g. garden = 28-000004a2b3c4
+def load_w1_aliases(path=None):
+    import ConfigParser
+    config=ConfigParser.RawConfigParser()
+    config.optionxform=str
+    config.read(path or rpi_deadline.config_file)
+    if config.has_section("w1_aliases"):
+        return dict(config.items("w1_aliases"))
+    return {}
+
+_w1_registries={}
+
+#registry of a base dir, kept for the lifetime of the process (e.g. the collector)
+def get_onewire_registry(base_dir=None,sub_dir=None):
+    base_dir=base_dir or w1_base_dir
+    key=(base_dir,sub_dir)
+    registry=_w1_registries.get(key)
+    if registry is None:
+        cache_file=w1_cache_file if base_dir == "/sys/bus/w1/devices/" else None
+        registry=OneWireRegistry(base_dir,load_w1_aliases(),sub_dir=sub_dir,cache_file=cache_file)
+        _w1_registries[key]=registry
+    return registry
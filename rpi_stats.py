@@ -0,0 +1,285 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Instrumentation of the sensor reads, to see why a check is slow: DS18B20 CRC
+# retries, a 1-wire conversion which stalls, DHT driver spawns, vcgencmd, ...
+#
+# Per sensor (name) counted are:
+#   reads, errors (exception or no measurement), timeouts (DeadlineExceeded),
+#   retries, crc_errors, rejected_85 (DS18B20 power on value), spawns (processes
+#   started), fallbacks (bus devices read again one by one), lost_echoes
+# and latency histograms of the read and its slow steps (conversion, driver,
+# vcgencmd).
+#
+# Off by default. When off, a read costs one flag check more and the counting
+# in the retry loops is skipped. Turned on with enable(), e.g. by
+#   python rpi_nagios.py -s DS18B20 -n 1 -o nagios -w 30 -c 35 --stats --stats-file /var/lib/rpi_sensors/stats.json
+# --stats adds the counters to the perfdata, --stats-file adds them to the ones
+# of the earlier checks in a JSON file (print it with: python rpi_stats.py FILE)
+###############################################################################
+
+import bisect,functools,os,sys,threading
+import rpi_deadline
+
+enabled=False
+#upper bounds of the latency buckets in seconds, the last bucket has no bound
+buckets=(0.0001,0.00025,0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30)
+counters=("reads","errors","timeouts","retries","crc_errors","rejected_85","spawns","fallbacks","lost_echoes")
+
+_lock=threading.Lock()
+_local=threading.local()
+#name -> SensorStats
+sensors={}
+
+def enable(on=True):
+    global enabled
+    enabled=on
+
+#rpi_sensors imports this module, so it is imported at the first call
+def _now():
+    import rpi_sensors
+    return rpi_sensors.monotonic()
+
+class Histogram(object):
+    def __init__(self):
+        self.counts=[0]*(len(buckets)+1)
+        self.total=0.0
+        self.max=0.0
+
+    def add(self,seconds):
+        self.counts[bisect.bisect_left(buckets,seconds)]+=1
+        self.total+=seconds
+        self.max=max(self.max,seconds)
+
+    def count(self):
+        return sum(self.counts)
+
+    #upper bound of the bucket the <fraction> of the values are in, max for the last one
+    def quantile(self,fraction):
+        count=self.count()
+        if not count:
+            return 0.0
+        seen=0
+        for i,n in enumerate(self.counts):
+            seen+=n
+            if seen >= fraction*count:
+                return min(buckets[i],self.max) if i < len(buckets) else self.max
+        return self.max
+
+    def merge(self,other):
+        self.counts=[a+b for a,b in zip(self.counts,other.counts)]
+        self.total+=other.total
+        self.max=max(self.max,other.max)
+
+    def to_dict(self):
+        return {"counts":self.counts,"sum":self.total,"max":self.max}
+
+    @classmethod
+    def from_dict(cls,data):
+        histogram=cls()
+        if len(data["counts"]) == len(histogram.counts):
+            histogram.counts=list(data["counts"])
+        histogram.total=data["sum"]
+        histogram.max=data["max"]
+        return histogram
+
+class SensorStats(object):
+    def __init__(self):
+        self.counters=dict((name,0) for name in counters)
+        #step -> Histogram, "read" is the whole readSensor
+        self.latency={}
+
+    def merge(self,other):
+        for name,value in other.counters.items():
+            self.counters[name]=self.counters.get(name,0)+value
+        for step,histogram in other.latency.items():
+            self.latency.setdefault(step,Histogram()).merge(histogram)
+
+    def to_dict(self):
+        return {"counters":self.counters,"latency":dict((step,histogram.to_dict()) for step,histogram in self.latency.items())}
+
+    @classmethod
+    def from_dict(cls,data):
+        stats=cls()
+        stats.counters.update(data.get("counters",{}))
+        stats.latency=dict((step,Histogram.from_dict(histogram)) for step,histogram in data.get("latency",{}).items())
+        return stats
+
+def get(name):
+    stats=sensors.get(name)
+    if stats is None:
+        stats=sensors.setdefault(name,SensorStats())
+    return stats
+
+#name of the sensor read in this thread, counts of drivers go to it
+def current():
+    names=getattr(_local,"names",None)
+    return names[-1] if names else "-"
+
+def count(counter,n=1,name=None):
+    if not enabled:
+        return
+    with _lock:
+        stats=get(name or current())
+        stats.counters[counter]=stats.counters.get(counter,0)+n
+
+def observe(step,seconds,name=None):
+    if not enabled:
+        return
+    with _lock:
+        get(name or current()).latency.setdefault(step,Histogram()).add(seconds)
+
+class _Timer(object):
+    def __init__(self,step):
+        self.step=step
+
+    def __enter__(self):
+        self.start=_now()
+        return self
+
+    def __exit__(self,*exc):
+        observe(self.step,_now()-self.start)
+        return False
+
+class _NoTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        return False
+
+_no_timer=_NoTimer()
+
+#with timer("conversion"): ... adds the time of a step to the current sensor
+def timer(step):
+    return _Timer(step) if enabled else _no_timer
+
+#decorator for readSensor: latency, errors and timeouts of every read
+#put above @timeout() so an isolated read is measured with its process
+def timed(function):
+    @functools.wraps(function)
+    def wrapper(self,*args,**kwargs):
+        if not enabled:
+            return function(self,*args,**kwargs)
+        names=getattr(_local,"names",None)
+        if names is None:
+            names=_local.names=[]
+        names.append(self.name)
+        start=_now()
+        try:
+            result=function(self,*args,**kwargs)
+        except rpi_deadline.DeadlineExceeded:
+            count("timeouts")
+            count("errors")
+            raise
+        except Exception:
+            count("errors")
+            raise
+        else:
+            if not result:
+                count("errors")
+            return result
+        finally:
+            observe("read",_now()-start)
+            count("reads")
+            names.pop()
+    return wrapper
+
+#{"sensors": {name: {"counters": {...}, "latency": {step: {"counts", "sum", "max"}}}}}
+def snapshot():
+    with _lock:
+        return {"buckets":list(buckets),"sensors":dict((name,stats.to_dict()) for name,stats in sensors.items())}
+
+#adds a snapshot (e.g. of a batch worker process) to the stats of this process
+def add(data):
+    if not data or list(data.get("buckets",buckets)) != list(buckets):
+        return
+    with _lock:
+        for name,stats in data.get("sensors",{}).items():
+            get(name).merge(SensorStats.from_dict(stats))
+
+def reset():
+    with _lock:
+        sensors.clear()
+
+#adds the stats of this process to the ones in a JSON file. Several checks can
+#write the same file: they take turns on <path>.lock, the file is written new
+#and renamed, so a symlink at <path> is replaced and not followed
+def save(path):
+    #only --stats-file needs them, every check imports this module
+    import fcntl,json,tempfile
+    lock=os.open(path+".lock",os.O_WRONLY|os.O_CREAT|os.O_NOFOLLOW,0o644)
+    try:
+        fcntl.flock(lock,fcntl.LOCK_EX)
+        try:
+            data=load(path)
+        except (IOError,ValueError):
+            data={}
+        merged={}
+        if list(data.get("buckets",buckets)) == list(buckets):
+            for name,stats in data.get("sensors",{}).items():
+                merged[name]=SensorStats.from_dict(stats)
+        with _lock:
+            for name,stats in sensors.items():
+                merged.setdefault(name,SensorStats()).merge(stats)
+        handle,temp=tempfile.mkstemp(prefix=".stats",dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(handle,"w") as f:
+                json.dump({"buckets":list(buckets),"sensors":dict((name,stats.to_dict()) for name,stats in merged.items())},f)
+            os.chmod(temp,0o644)
+            os.rename(temp,path)
+        except (IOError,OSError):
+            if os.path.exists(temp):
+                os.unlink(temp)
+            raise
+    finally:
+        os.close(lock)
+
+def load(path):
+    import json
+    with open(path) as f:
+        return json.load(f)
+
+#in the perfdata even when 0, the others only once they happened
+always=("reads","errors","timeouts")
+
+#'<name> <counter>'=<n>c and read latency p50/p95/max for every sensor
+def perfdata(names=None):
+    items=[]
+    with _lock:
+        for name in sorted(sensors):
+            if names is not None and name not in names:
+                continue
+            stats=sensors[name]
+            for counter in counters:
+                value=stats.counters.get(counter,0)
+                if value or counter in always:
+                    items.append("'"+name+" "+counter+"'="+str(value)+"c")
+            for step in sorted(stats.latency):
+                histogram=stats.latency[step]
+                for label,value in (("p50",histogram.quantile(0.5)),("p95",histogram.quantile(0.95)),("max",histogram.max)):
+                    items.append("'"+name+" "+step+" "+label+"'="+"{0:.6f}".format(value)+"s")
+    return " ".join(items)
+
+#one line per sensor and step, for the stats file
+def report(data):
+    lines=[]
+    for name,stats in sorted(data.get("sensors",{}).items()):
+        lines.append(name+": "+", ".join(counter+" "+str(stats["counters"].get(counter,0)) for counter in counters))
+        for step,histogram in sorted(stats.get("latency",{}).items()):
+            histogram=Histogram.from_dict(histogram)
+            count=histogram.count()
+            lines.append("  "+step+": "+str(count)+" times, avg %.4fs p50 %.4fs p95 %.4fs max %.4fs" % (
+                histogram.total/count if count else 0.0,histogram.quantile(0.5),histogram.quantile(0.95),histogram.max))
+    return "\n".join(lines)
+
+def main():
+    if len(sys.argv) != 2:
+        print "usage: python rpi_stats.py FILE"
+        exit(3)
+    print report(load(sys.argv[1]))
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Nagios thresholds parsed once into rules and checked for all values of a run
+#
+# Range syntax of the Nagios plugin guidelines:
+#   30      alert above 30 (like the old checks, a negative value is no alert)
+#   10:     alert below 10
+#   ~:5     alert above 5
+#   10:20   alert below 10 or above 20
+#   @10:20  alert from 10 to 20 (inclusive)
+# A threshold which is no number or range (e.g. a governor) alerts on an equal value.
+#
+# Hysteresis: a metric in warning or critical only gets back to a lower status
+# when it is inside the range by the hysteresis, so a value around a threshold
+# does not flap, e.g. -w 30 -c 35 --hysteresis 0.5: warning at 30.1, ok again at 29.5.
+# The status of the last check is taken from a state file (rpi_nagios.py --state)
+# or kept in the RuleSet by long running processes.
+#
+# RuleSet.evaluate() checks all values of a run at once (numpy if installed).
+###############################################################################
+
+import os,re
+
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
+OK,WARNING,CRITICAL,UNKNOWN=0,1,2,3
+
+_range=re.compile(r"^(@)?(?:(~|[-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)?(:))?([-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)?$")
+
+def to_number(value):
+    if isinstance(value,bool):
+        return float(value)
+    if isinstance(value,(int,long,float)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError,ValueError):
+        return None
+
+#One threshold: alert outside of low..high (or inside with @), text for non numeric ones
+class Range(object):
+    __slots__=("spec","low","high","inside","text")
+
+    def __init__(self,spec):
+        self.spec=spec=str(spec).strip()
+        self.low=float("-inf")
+        self.high=float("inf")
+        self.inside=False
+        self.text=None
+        match=_range.match(spec)
+        if not match or not (match.group(3) or match.group(4)) or spec in ("@",":","@:"):
+            self.text=spec
+            return
+        inside,low,colon,high=match.groups()
+        try:
+            if colon is None:
+                #legacy: a bare number only alerts above it
+                self.high=float(high)
+            else:
+                if low and low != "~":
+                    self.low=float(low)
+                if high:
+                    self.high=float(high)
+        except ValueError:
+            self.low,self.high,self.text=float("-inf"),float("inf"),spec
+            return
+        self.inside=bool(inside)
+
+    #True if value alerts, <margin> moves the bounds so the value has to be that far
+    #inside the range to stop an alert that is already on
+    def alerts(self,value,margin=0.0):
+        if self.text is not None:
+            return str(value) == self.text
+        value=to_number(value)
+        if value is None:
+            raise TypeError("not a number")
+        if self.inside:
+            return self.low-margin <= value <= self.high+margin
+        return value < self.low+margin or value > self.high-margin
+
+    def __str__(self):
+        return self.spec
+
+#warning and critical range of one metric
+class Rule(object):
+    __slots__=("warning","critical","hysteresis","state")
+
+    def __init__(self,warning,critical,hysteresis=0.0,state=OK):
+        self.warning=warning if isinstance(warning,Range) else Range(warning)
+        self.critical=critical if isinstance(critical,Range) else Range(critical)
+        self.hysteresis=float(hysteresis or 0)
+        self.state=state
+
+    #status of a value, the status of the last check is the one of the rule
+    def evaluate(self,value,previous=None):
+        previous=self.state if previous is None else previous
+        numeric=to_number(value) is not None and not isinstance(value,basestring)
+        #like the old checks: text thresholds only for text values, numbers only for numbers
+        if (self.critical.text is None) != numeric or (self.warning.text is None) != numeric:
+            return UNKNOWN
+        try:
+            if self.critical.alerts(value,self.hysteresis if previous == CRITICAL else 0.0):
+                return CRITICAL
+            if self.warning.alerts(value,self.hysteresis if previous in (WARNING,CRITICAL) else 0.0):
+                return WARNING
+        except TypeError:
+            return UNKNOWN
+        return OK
+
+#the rules of all metrics of a check, compiled from the -w/-c/--hysteresis lists
+#IndexError if there are less thresholds than values like formatNagios always did
+class RuleSet(object):
+    def __init__(self,rules):
+        self.rules=list(rules)
+        self.compiled=None
+
+    @classmethod
+    def parse(cls,warnings,criticals,hysteresis=None,count=None):
+        count=len(warnings) if count is None else count
+        hysteresis=hysteresis or []
+        return cls([Rule(warnings[i],criticals[i],hysteresis[i] if i < len(hysteresis) else 0.0) for i in range(count)])
+
+    def __len__(self):
+        return len(self.rules)
+
+    #arrays of the numeric rules for numpy: bounds, inside, hysteresis
+    def compile(self):
+        if self.compiled is None:
+            columns=[(rule.warning.low,rule.warning.high,rule.warning.inside,rule.critical.low,rule.critical.high,rule.critical.inside,rule.hysteresis)
+                     for rule in self.rules]
+            self.compiled=[numpy.array(column,dtype=float) for column in zip(*columns)] if columns else None
+        return self.compiled
+
+    #status of every value, values[i] is checked with rules[i]
+    #previous: statuses of the last check (default: the ones kept in the rules)
+    def evaluate(self,values,previous=None):
+        if previous is None:
+            previous=[rule.state for rule in self.rules]
+        numeric=all(rule.warning.text is None and rule.critical.text is None and isinstance(value,(int,long,float))
+                    for rule,value in zip(self.rules,values))
+        if numpy is None or not numeric or len(values) != len(self.rules) or not values:
+            statuses=[rule.evaluate(value,state) for rule,value,state in zip(self.rules,values,previous)]
+        else:
+            wlow,whigh,winside,clow,chigh,cinside,hysteresis=self.compile()
+            value=numpy.array(values,dtype=float)
+            state=numpy.array(previous,dtype=float)
+            def alerts(low,high,inside,margin):
+                return numpy.where(inside > 0,(low-margin <= value) & (value <= high+margin),(value < low+margin) | (value > high-margin))
+            critical=alerts(clow,chigh,cinside,numpy.where(state == CRITICAL,hysteresis,0.0))
+            warning=alerts(wlow,whigh,winside,numpy.where((state == WARNING) | (state == CRITICAL),hysteresis,0.0))
+            statuses=numpy.where(critical,CRITICAL,numpy.where(warning,WARNING,OK)).tolist()
+        for rule,status in zip(self.rules,statuses):
+            rule.state=status
+        return statuses
+
+    #statuses of the last check by metric label, e.g. from the state file
+    def restore(self,labels,states):
+        for rule,label in zip(self.rules,labels):
+            rule.state=states.get(label,OK)
+
+#'label'=value;warning;critical for every metric, joined once
+def perfdata(labels,values,rules,decimals=None):
+    items=[]
+    for label,value,rule in zip(labels,values,rules.rules if isinstance(rules,RuleSet) else rules):
+        items.append("'"+label+"'="+format_value(value,decimals)+";"+rule.warning.spec+";"+rule.critical.spec)
+    return " ".join(items)
+
+#like rpi_nagios.formatValue, text is printed as it is
+def format_value(value,decimals=None):
+    if decimals is None:
+        return str(value)
+    try:
+        return "{0:.{1}f}".format(value,decimals)
+    except ValueError:
+        return str(value)
+
+#{label: status} of the last check, empty if there is no state file yet
+def load_state(path):
+    import json
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError,ValueError):
+        return {}
+
+#several checks (NRPE) share the file: they take turns on <path>.lock, read it
+#again and write it new (renamed over the old one), so no status gets lost
+def save_state(path,labels,statuses):
+    #only checks with --state need them
+    import fcntl,json,tempfile
+    try:
+        lock=os.open(path+".lock",os.O_WRONLY|os.O_CREAT|os.O_NOFOLLOW,0o644)
+    except OSError:
+        return
+    try:
+        fcntl.flock(lock,fcntl.LOCK_EX)
+        states=load_state(path)
+        states.update(zip(labels,statuses))
+        handle,temp=tempfile.mkstemp(prefix=".state",dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(handle,"w") as f:
+                json.dump(states,f)
+            os.chmod(temp,0o644)
+            os.rename(temp,path)
+        except (IOError,OSError):
+            if os.path.exists(temp):
+                os.unlink(temp)
+    except (IOError,OSError):
+        pass
+    finally:
+        os.close(lock)
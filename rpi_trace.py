@@ -0,0 +1,318 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Records what the hardware answered and replays it through the same Sensor
+# classes, e.g. to run months of readings through averaging, history and the
+# thresholds in minutes.
+#
+# record: python rpi_trace.py record /var/tmp/trace.bin -b "DS18B20 -n 1" -b "DHT -t 22 -p 4" --interval 10
+# replay: python rpi_trace.py replay /var/tmp/trace.bin --speed 100 --history /tmp/history
+#         (--speed 0 replays as fast as possible)
+#
+# Recorded are the raw answers, not the measurements:
+#   OneWire.read_temp_raw           content of w1_slave
+#   DHT.read_raw                    output lines of the driver (without DHT worker)
+#   UltraSonic.measure_distance(_edge)  the distance of every ping
+#   BMP085.read_calibration, read_raw_temp, read_raw_pressure  register values
+# Replay puts them back in place of these methods, everything above them
+# (retries, 85 deg C filter, median of pings, the BMP085 math) runs unchanged.
+#
+# File: "RSTR", version (1 byte), then records of
+#   kind (1 byte), source (2 bytes), time (8 bytes, micro seconds since 1970),
+#   length (4 bytes), payload
+# A source record (kind 0) comes before the first record of a source and has
+# the class and arguments of the sensor as JSON.
+###############################################################################
+
+import argparse,collections,json,struct,sys,threading,time
+import rpi_deadline,rpi_sensors
+
+_magic="RSTR"
+_version=1
+_record=struct.Struct("<BHqI")
+
+KIND_SOURCE=0
+KIND_W1=1
+KIND_DHT=2
+KIND_DISTANCE=3
+KIND_BMP_CALIBRATION=4
+KIND_BMP_TEMP=5
+KIND_BMP_PRESSURE=6
+
+_distance=struct.Struct("<d")
+_int=struct.Struct("<i")
+_calibration=struct.Struct("<11i")
+
+class TraceError(Exception):
+    pass
+
+#the trace of a source has no more records
+class EndOfTrace(TraceError):
+    pass
+
+def encode_distance(distance):
+    return "" if distance is None else _distance.pack(distance)
+
+def decode_distance(payload):
+    return _distance.unpack(payload)[0] if payload else None
+
+#class and arguments to create the sensor again when replaying
+def describe(sensor):
+    if isinstance(sensor,rpi_sensors.OneWire):
+        return {"class":"OneWire","name":sensor.name,"device_file":sensor.device_file}
+    if isinstance(sensor,rpi_sensors.DHT):
+        return {"class":"DHT","name":sensor.name,"type":sensor.type,"port":sensor.read_port}
+    if isinstance(sensor,rpi_sensors.UltraSonic):
+        return {"class":"UltraSonic","name":sensor.name,"trigger":sensor.trigger,"echo":sensor.echo,"edge":sensor.edge,"pings":sensor.pings}
+    if isinstance(sensor,rpi_sensors.BMP085):
+        return {"class":"BMP085","name":sensor.name,"address":sensor.address,"mode":sensor.mode}
+    raise TraceError("Can not record "+sensor.__class__.__name__)
+
+class Recorder(object):
+    def __init__(self,path):
+        self.file=open(path,"wb")
+        self.file.write(_magic+chr(_version))
+        self.lock=threading.Lock()
+        self.sources=0
+        self.records=0
+
+    def write(self,kind,source,payload):
+        with self.lock:
+            self.file.write(_record.pack(kind,source,int(time.time()*1e6),len(payload))+payload)
+            self.records+=1
+
+    def add_source(self,description):
+        with self.lock:
+            source=self.sources
+            self.sources+=1
+        self.write(KIND_SOURCE,source,json.dumps(description))
+        return source
+
+    #the method <name> of the sensor object writes what it returns
+    def wrap(self,sensor,name,kind,source,encode):
+        method=getattr(sensor,name)
+        def recorded(*args,**kwargs):
+            result=method(*args,**kwargs)
+            self.write(kind,source,encode(result))
+            return result
+        setattr(sensor,name,recorded)
+
+    #records the raw reads of a sensor, a OneWireBus is recorded per device
+    def attach(self,sensor):
+        if isinstance(sensor,rpi_sensors.OneWireBus):
+            for device in sensor.devices:
+                self.attach(device)
+            return sensor
+        source=self.add_source(describe(sensor))
+        #the records are written by this process, never by a read in a child (rpi_deadline)
+        sensor.in_process=True
+        if isinstance(sensor,rpi_sensors.OneWire):
+            self.wrap(sensor,"read_temp_raw",KIND_W1,source,"".join)
+        elif isinstance(sensor,rpi_sensors.DHT):
+            self.wrap(sensor,"read_raw",KIND_DHT,source,"\n".join)
+        elif isinstance(sensor,rpi_sensors.UltraSonic):
+            self.wrap(sensor,"measure_distance",KIND_DISTANCE,source,encode_distance)
+            self.wrap(sensor,"measure_distance_edge",KIND_DISTANCE,source,encode_distance)
+        elif isinstance(sensor,rpi_sensors.BMP085):
+            self.wrap(sensor,"read_calibration",KIND_BMP_CALIBRATION,source,lambda calibration: _calibration.pack(*calibration))
+            self.wrap(sensor,"read_raw_temp",KIND_BMP_TEMP,source,_int.pack)
+            self.wrap(sensor,"read_raw_pressure",KIND_BMP_PRESSURE,source,_int.pack)
+        return sensor
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+#(kind, source, time in seconds, payload) of every record of a trace file
+def read_records(path):
+    with open(path,"rb") as f:
+        header=f.read(len(_magic)+1)
+        if header[:len(_magic)] != _magic or ord(header[-1:] or "\0") != _version:
+            raise TraceError(path+" is no trace of version "+str(_version))
+        while True:
+            data=f.read(_record.size)
+            if len(data) < _record.size:
+                return
+            kind,source,micros,length=_record.unpack(data)
+            payload=f.read(length)
+            if len(payload) < length:
+                return
+            yield kind,source,micros/1e6,payload
+
+#Feeds a trace back through the sensor classes.
+#speed: 1 the readings come as fast as they were recorded, 100 a hundred times
+#faster, None or 0 without waiting
+class Replay(object):
+    def __init__(self,path,speed=1.0):
+        self.speed=speed or None
+        self.descriptions={}
+        self.queues=collections.defaultdict(collections.deque)
+        for kind,source,seconds,payload in read_records(path):
+            if kind == KIND_SOURCE:
+                self.descriptions[source]=json.loads(payload)
+            else:
+                self.queues[source].append((kind,seconds,payload))
+        self.sensors={}
+        self.calibrations={}
+        self.start=None
+        self.trace_start=None
+        #time of the record replayed last, the epoch of the readings
+        self.now=None
+
+    #waits until a record of <seconds> is due. Called before a read and not in it,
+    #so the pause does not count against the budget of the read (rpi_deadline)
+    def wait(self,seconds):
+        if self.trace_start is None:
+            self.start=rpi_sensors.monotonic()
+            self.trace_start=seconds
+        if self.speed:
+            delay=(seconds-self.trace_start)/self.speed-(rpi_sensors.monotonic()-self.start)
+            if delay > 0:
+                time.sleep(delay)
+
+    #the next record of a source
+    def next(self,source,kind):
+        queue=self.queues[source]
+        if not queue:
+            raise EndOfTrace(self.descriptions[source]["name"])
+        record_kind,seconds,payload=queue[0]
+        if record_kind != kind:
+            raise TraceError("expected record %d of source %d, found %d" % (kind,source,record_kind))
+        queue.popleft()
+        self.now=seconds
+        return payload
+
+    #the calibration is read once by a BMP085 and then only taken from the cache
+    def calibration(self,source):
+        queue=self.queues[source]
+        if queue and queue[0][0] == KIND_BMP_CALIBRATION:
+            self.calibrations[source]=list(_calibration.unpack(self.next(source,KIND_BMP_CALIBRATION)))
+        if source not in self.calibrations:
+            raise TraceError("no BMP085 calibration in the trace")
+        return self.calibrations[source]
+
+    #sensor object of a source with the recorded answers in place of the hardware
+    def sensor(self,source):
+        if source in self.sensors:
+            return self.sensors[source]
+        import rpi_fakes
+        description=self.descriptions[source]
+        name=description["name"]
+        cls=description["class"]
+        if cls == "OneWire":
+            sensor=rpi_sensors.OneWire(name,"Temperature",description["device_file"])
+            sensor.read_temp_raw=lambda: self.next(source,KIND_W1).splitlines(True)
+        elif cls == "DHT":
+            sensor=rpi_sensors.DHT(name,description["type"],description["port"])
+            sensor.read_raw=lambda *args: self.next(source,KIND_DHT).split("\n")
+        elif cls == "UltraSonic":
+            sensor=rpi_sensors.UltraSonic(name,description["trigger"],description["echo"],description["edge"],description["pings"],gpio=rpi_fakes.FakeGPIO())
+            sensor.measure_distance=sensor.measure_distance_edge=lambda: decode_distance(self.next(source,KIND_DISTANCE))
+        elif cls == "BMP085":
+            sensor=rpi_sensors.BMP085(name,description["address"],description["mode"],bus=rpi_fakes.FakeBMP085Bus())
+            sensor.read_calibration=lambda: self.calibration(source)
+            sensor.read_raw_temp=lambda: _int.unpack(self.next(source,KIND_BMP_TEMP))[0]
+            sensor.read_raw_pressure=lambda: _int.unpack(self.next(source,KIND_BMP_PRESSURE))[0]
+        else:
+            raise TraceError("Can not replay "+cls)
+        #the records are taken from this process
+        sensor.in_process=True
+        self.sensors[source]=sensor
+        return sensor
+
+    #reads the sensors in the order they were read when recording until the trace
+    #is used up. yields (sensor, measurements), the epoch of the measurements is
+    #the time of the recording
+    def readings(self):
+        while True:
+            pending=[(queue[0][1],source) for source,queue in self.queues.items() if queue]
+            if not pending:
+                return
+            seconds,source=min(pending)
+            sensor=self.sensor(source)
+            self.wait(seconds)
+            try:
+                #pauses between retries and pings are in the recorded times already
+                with rpi_deadline.no_sleep():
+                    meas=sensor.readSensor()
+            except EndOfTrace:
+                self.queues[source].clear()
+                continue
+            for unit in meas:
+                unit.epoch=self.now
+            yield sensor,meas
+
+def GetArgs():
+    parser = argparse.ArgumentParser(description='Record the raw answers of the sensors or replay them')
+    parser.add_argument('command',       choices=("record","replay"),   action='store', help='record or replay')
+    parser.add_argument('trace',                                        action='store', help='Trace file')
+    parser.add_argument('-b', '--batch',                                action='append', help='Sensor to record with the options of rpi_nagios.py, e.g. "DHT -t 22 -p 4"')
+    parser.add_argument(      '--interval',  type=float, default=10,    action='store', help='Seconds between two recorded reads')
+    parser.add_argument(      '--duration',  type=float, default=None,  action='store', help='Seconds to record (default: until stopped)')
+    parser.add_argument(      '--speed',     type=float, default=1,     action='store', help='Replay speed, 0 for as fast as possible')
+    parser.add_argument(      '--history',   default=None,              action='store', help='Keep the replayed measurements in ring buffers in this directory')
+    parser.add_argument(      '--quiet',     default=False,        action='store_true', help='Do not print the replayed measurements')
+    parser.add_argument(      '--decimals',  type=int, default=1,       action='store', help='Limit output to X decimals')
+    return parser.parse_args()
+
+def record(args):
+    import rpi_nagios
+    args.output="standard"
+    args.socket=None
+    recorder=Recorder(args.trace)
+    sensors=[]
+    for spec in args.batch or []:
+        sensor=rpi_nagios.getSensor(rpi_nagios.parseSpec(spec,args))
+        if not sensor:
+            raise ValueError("Did not get sensor back: "+spec)
+        sensors.append(recorder.attach(sensor))
+    end=None if args.duration is None else time.time()+args.duration
+    try:
+        while end is None or time.time() < end:
+            start=time.time()
+            for sensor in sensors:
+                try:
+                    sensor.readSensor()
+                except Exception as e:
+                    print sensor.name,e
+            recorder.flush()
+            time.sleep(max(0,args.interval-(time.time()-start)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+    print recorder.records,"records of",recorder.sources,"sources"
+
+def replay(args):
+    import rpi_nagios
+    args.output="standard"
+    store=None
+    if args.history:
+        import rpi_history
+        store=rpi_history.HistoryStore(args.history)
+    count=0
+    for sensor,meas in Replay(args.trace,args.speed).readings():
+        count+=1
+        if store and meas:
+            store.record(rpi_history.series_name(sensor),meas)
+        if not args.quiet and meas:
+            print rpi_nagios.formatOutput(sensor.name,meas,args)
+    if store:
+        store.close()
+    print >>sys.stderr,count,"readings replayed"
+
+def main():
+    args=GetArgs()
+    if args.command=="record":
+        record(args)
+    else:
+        replay(args)
+
+if __name__=="__main__":
+    main()
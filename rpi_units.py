@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Unit conversion through the base unit of every mtype:
+#   t (temperature): Kelvin, p (pressure): Pascal, m (distance): meter
+# Every unit is base = value * scale + offset, so a conversion between two units
+# is one multiplication and one addition for a whole series of values.
+# Lists, array('d'), numpy arrays and MeasurementBatch are converted in one call
+# (vectorized with numpy if it is installed).
+###############################################################################
+
+from array import array
+import rpi_sensors
+
+try:
+    import numpy
+except ImportError:
+    numpy=None
+
+base_units={"t":"k","p":"pa","m":"m"}
+
+#shortcode -> (scale, offset) to the base unit
+factors={
+    "k":    (1.0,0.0),
+    "dc":   (1.0,273.15),
+    "df":   (5.0/9.0,273.15-32*5.0/9.0),
+    "pa":   (1.0,0.0),
+    "hpa":  (100.0,0.0),
+    "inhg": (3386.389,0.0),
+    "mmhg": (133.322387415,0.0),
+    "m":    (1.0,0.0),
+    "msea": (1.0,0.0),
+    "cm":   (0.01,0.0),
+    "in":   (0.0254,0.0),
+}
+
+def mtype(shortcode):
+    return rpi_sensors.units.get(shortcode,rpi_sensors.undefined_unit)[2]
+
+#(scale, offset) from one unit to the other
+#ValueError if a unit is unknown or both are not of the same mtype
+def conversion(from_code,to_code):
+    if from_code not in factors or to_code not in factors:
+        raise ValueError("No conversion known for "+str(from_code)+" to "+str(to_code))
+    if mtype(from_code) != mtype(to_code):
+        raise ValueError("Can not convert "+mtype(from_code)+" to "+mtype(to_code))
+    from_scale,from_offset=factors[from_code]
+    to_scale,to_offset=factors[to_code]
+    return from_scale/to_scale,(from_offset-to_offset)/to_scale
+
+#values * scale + offset in the container the values came in
+def apply(values,scale,offset):
+    if numpy is not None and isinstance(values,numpy.ndarray):
+        return values*scale+offset
+    if isinstance(values,(int,long,float)):
+        return values*scale+offset
+    if numpy is not None:
+        converted=numpy.asarray(values,dtype=float)*scale+offset
+        if isinstance(values,array):
+            return array('d',converted.tobytes())
+        return converted.tolist()
+    converted=[value*scale+offset for value in values]
+    if isinstance(values,array):
+        return array('d',converted)
+    return converted
+
+#a value or a series of values from one unit to the other
+def convert(values,from_code,to_code):
+    scale,offset=conversion(from_code,to_code)
+    return apply(values,scale,offset)
+
+#changes a MeasurementType in place
+def convert_measurement(unit,to_code):
+    unit.value=convert(unit.value,unit.shortcode,to_code)
+    unit.shortcode=to_code
+    return unit
+
+#new MeasurementBatch with the values in another unit, timestamps are copied
+def convert_batch(batch,to_code):
+    converted=rpi_sensors.MeasurementBatch(to_code,batch.name)
+    converted.values=convert(batch.values,batch.shortcode,to_code)
+    converted.timestamps=batch.timestamps[:]
+    return converted
+
+#meter above sea level of pressures (international barometric formula, like the BMP085 driver)
+def pressure_to_altitude(pressures,shortcode="hpa",sealevel=101325.0):
+    pascal=convert(pressures,shortcode,"pa")
+    if isinstance(pascal,(int,long,float)):
+        return 44330.0*(1.0-(pascal/sealevel)**(1/5.255))
+    if numpy is not None:
+        altitudes=44330.0*(1.0-numpy.power(numpy.asarray(pascal,dtype=float)/sealevel,1/5.255))
+        if isinstance(pressures,numpy.ndarray):
+            return altitudes
+        return array('d',altitudes.tobytes()) if isinstance(pressures,array) else altitudes.tolist()
+    altitudes=[44330.0*(1.0-(p/sealevel)**(1/5.255)) for p in pascal]
+    return array('d',altitudes) if isinstance(pressures,array) else altitudes
+
+#MeasurementBatch of altitudes from a batch of pressures (e.g. of a BMP085)
+def altitude_batch(batch,sealevel=101325.0):
+    altitudes=rpi_sensors.MeasurementBatch("msea",batch.name)
+    altitudes.values=pressure_to_altitude(batch.values,batch.shortcode,sealevel)
+    altitudes.timestamps=batch.timestamps[:]
+    return altitudes
@@ -3,20 +3,42 @@
 ################################################
 # Stefan Süss - www.sysstem.at
 ################################################
+# Board of this Pi from the Revision in /proc/cpuinfo: the old codes (2012-2014)
+# from the list, the new bit field codes (since the Pi 2) are decoded:
+#   NOQuuuWuFMMMCCCCPPPPTTTTTTTTRRRR
+#   F new style, MMM memory, CCCC manufacturer, PPPP processor, TTTTTTTT type,
+#   RRRR pcb revision, W warranty void (overvolted)
+# The GPIO ports and the I2C bus follow from the board.
+#
+# /proc/cpuinfo is parsed once per process.
+################################################
 
 # Listmodel from http://elinux.org/RPi_HardwareHistory
 class BoardRevision(object):
-        def __init__(self,revision,releasedate,model,pcbrevision,memory,notes):
+        def __init__(self,revision,releasedate,model,pcbrevision,memory,notes,ports=None,processor="BCM2835",manufacturer=None):
             self.revision=revision
             self.releasedate=releasedate
             self.model=model
             self.pcbrevision=pcbrevision
             self.memory=memory
             self.notes=notes
+            self.processor=processor
+            self.manufacturer=manufacturer
+            #the GPIO ports of the first boards follow from the pcb revision
+            if ports is None:
+                ports={1.0:pcb_r1_gpio_ports,2.0:pcb_r2_gpio_ports}.get(pcbrevision,())
+            self.ports=ports
+            #the first boards have the I2C pins on bus 0
+            self.i2c_bus=0 if ports == pcb_r1_gpio_ports else 1
 
 #http://elinux.org/RPi_Low-level_peripherals#GPIO_hardware_hacking
 pcb_r1_gpio_ports= (0,1,4,7,8,9,10,11,14,15,17,18,21,22,23,24,25)
 pcb_r2_gpio_ports= (2,3,4,7,8,9,10,11,14,15,17,18,22,23,24,25,27,28,29,30,31)            
+#40 pin header (A+, B+ and all later boards)
+header40_gpio_ports=tuple(range(2,28))
+#compute modules: SODIMM (CM1, CM3, CM4S) and the CM4/CM5 connector
+cm_gpio_ports=tuple(range(0,46))
+cm4_gpio_ports=tuple(range(0,28))
             
 # Listcontent from http://elinux.org/RPi_HardwareHistory
 boardrevisionlist=[]
@@ -32,49 +54,118 @@ boardrevisionlist.append(BoardRevision(0x0009,"Q1 2013","A",2.0,256000000,"(Mfg
 boardrevisionlist.append(BoardRevision(0x000d,"Q4 2012","B",2.0,512000000,"(Mfg by Egoman)"))
 boardrevisionlist.append(BoardRevision(0x000e,"Q4 2012","B",2.0,512000000,"(Mfg by Sony)"))
 boardrevisionlist.append(BoardRevision(0x000f,"Q4 2012","B",2.0,512000000,"(Mfg by Qisda)"))
+boardrevisionlist.append(BoardRevision(0x0010,"Q3 2014","B+",1.0,512000000,"(Mfg by Sony)",header40_gpio_ports))
+boardrevisionlist.append(BoardRevision(0x0011,"Q2 2014","Compute Module",1.0,512000000,"(Mfg by Sony)",cm_gpio_ports))
+boardrevisionlist.append(BoardRevision(0x0012,"Q4 2014","A+",1.1,256000000,"(Mfg by Sony)",header40_gpio_ports))
+boardrevisionlist.append(BoardRevision(0x0013,"Q1 2015","B+",1.2,512000000,"(Mfg by Embest)",header40_gpio_ports))
+boardrevisionlist.append(BoardRevision(0x0014,"Q2 2014","Compute Module",1.0,512000000,"(Mfg by Embest)",cm_gpio_ports))
+boardrevisionlist.append(BoardRevision(0x0015,"","A+",1.1,256000000,"(Mfg by Embest)",header40_gpio_ports))
+#revision -> BoardRevision
+boardrevisions=dict((boardrevision.revision,boardrevision) for boardrevision in boardrevisionlist)
+
+#tables of the new style revision codes, indexed by the value of the field
+memory_sizes=(256000000,512000000,1000000000,2000000000,4000000000,8000000000,16000000000)
+manufacturers=("Sony UK","Egoman","Embest","Sony Japan","Embest","Stadium")
+processors=("BCM2835","BCM2836","BCM2837","BCM2711","BCM2712")
+board_types=("A","B","A+","B+","2B","Alpha","CM1",None,"3B","Zero","CM3",None,"Zero W","3B+","3A+","Internal",
+             "CM3+","4B","Zero 2 W","400","CM4","CM4S","Internal","5","CM5","500","CM5 Lite")
+new_style_flag=1<<23
+#warranty bit: old codes 0x1000000, new style codes bit 25
+old_overvolt_flag=1<<24
+new_overvolt_flag=1<<25
+
+cpuinfo_file="/proc/cpuinfo"
+#fields of the board, the ones per cpu are not kept
+board_fields=("Hardware","Revision","Serial","Model")
+#fields of /proc/cpuinfo of this process
+_cpuinfo=None
+#decoded new style revisions
+_decoded={}
+
+def board_ports(model):
+    if model in ("CM1","CM3","CM3+","CM4S"):
+        return cm_gpio_ports
+    if model in ("CM4","CM5","CM5 Lite"):
+        return cm4_gpio_ports
+    if model in ("A","B"):
+        return pcb_r2_gpio_ports
+    if model in (None,"Alpha","Internal"):
+        return ()
+    return header40_gpio_ports
+
+def field(table,index):
+    return table[index] if index < len(table) else None
+
+#BoardRevision of a new style revision code
+def decodeRevision(code):
+    board=_decoded.get(code)
+    if board is None:
+        model=field(board_types,(code>>4)&0xFF)
+        manufacturer=field(manufacturers,(code>>16)&0xF)
+        board=BoardRevision(code,"",model or "unknown",1+(code&0xF)/10.0,field(memory_sizes,(code>>20)&0x7),
+                            "(Mfg by "+manufacturer+")" if manufacturer else "",board_ports(model),
+                            field(processors,(code>>12)&0xF),manufacturer)
+        _decoded[code]=board
+    return board
+
+#key: value of every line of /proc/cpuinfo, the last one wins (Revision, Serial, Hardware, Model)
+def parseCpuinfo(path=None):
+    info={}
+    with open(path or cpuinfo_file,"r") as file:
+        for line in file:
+            key,separator,value=line.partition(":")
+            if separator:
+                info[key.strip()]=value.strip()
+    return info
+
+#board fields of /proc/cpuinfo, parsed at the first call of the process
+def getCpuinfo():
+    global _cpuinfo
+    if _cpuinfo is not None:
+        return _cpuinfo
+    try:
+        info=parseCpuinfo()
+    except IOError:
+        #no cpuinfo (not a Pi), not kept so it is tried again
+        return {}
+    _cpuinfo=dict((key,info[key]) for key in board_fields if key in info)
+    return _cpuinfo
 
 def getRevision():
-    revisionstring="Revision"
-    revision="unknown BoardRevision"
-    with open("/proc/cpuinfo","r") as file:
-        for line in file.readlines():
-            if line.find(revisionstring)!=-1:
-                revision="0x"+line.split(":")[1][1:-1]           
-    return revision
+    revision=getCpuinfo().get("Revision")
+    if not revision:
+        return "unknown BoardRevision"
+    return "0x"+revision
 
-def getBoardRevision(revision=getRevision()):
+#revision is read when the function is called, not when the module is imported
+def getBoardRevision(revision=None):
+    if revision is None:
+        revision=getRevision()
     try:
-        #only check the last 2 Bytes for revision (ignore overvoltage indicator)
-        #http://elinux.org/RPi_HardwareHistory
-        revision=int(revision,16)&0xFFFF
-    except ValueError:
-        revision=revision
-    for boardrevision in boardrevisionlist:
-        if revision == boardrevision.revision:
-            return boardrevision
-    return "unknown BoardRevision"
+        code=int(revision,16)
+    except (TypeError,ValueError):
+        return boardrevisions.get(revision,"unknown BoardRevision")
+    if code&new_style_flag:
+        return decodeRevision(code)
+    #only check the last 2 Bytes for revision (ignore overvoltage indicator)
+    #http://elinux.org/RPi_HardwareHistory
+    return boardrevisions.get(code&0xFFFF,"unknown BoardRevision")
 
 def getGPIOPorts():
-    rpi=getBoardRevision()
-    try:
-        if rpi.pcbrevision == 1.0:
-            return pcb_r1_gpio_ports
-        if rpi.pcbrevision == 2.0:
-            return pcb_r2_gpio_ports
-        else:
-            return ()
-    except AttributeError:
-        return ()
+    return getattr(getBoardRevision(),"ports",())
+
+def getI2CBus():
+    return getattr(getBoardRevision(),"i2c_bus",1)
         
 def hasBeenOverVolted():
-    ovvalue=0x1000000
     try:
-        ov=int(getRevision(),16)&ovvalue
-        if ov==ovvalue:
-            return 1
-        else:
-            return 0
+        code=int(getRevision(),16)
     #could not determine due to error in reading Revision
     except ValueError:
         return -1
+    ovvalue=new_overvolt_flag if code&new_style_flag else old_overvolt_flag
+    if code&ovvalue==ovvalue:
+        return 1
+    else:
+        return 0
         
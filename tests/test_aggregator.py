@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Batch codec and framing of the agent/collector protocol (rpi_aggregator)
+#   python -m unittest discover -s tests
+###############################################################################
+
+import unittest
+import rpi_aggregator
+
+class BatchTest(unittest.TestCase):
+    def test_round_trip(self):
+        readings=[("DS18B20","dc",0,21.5,1500000000.25),
+                  ("K\xc3\xbcche","rh",1,45.0,1500000000.5),
+                  ("PIR","mo",0,True,1500000001.0),
+                  ("PIR","mo",1,False,1500000001.0),
+                  ("RPI","cg",2,"ondemand",1500000002.0),
+                  ("DHT","dc",0,None,1500000003.0)]
+        decoded=rpi_aggregator.decode_batch(rpi_aggregator.encode_batch(readings))
+        self.assertEqual(len(decoded),len(readings))
+        for reading,(sensor,shortcode,position,value,epoch) in zip(readings,decoded):
+            self.assertEqual(sensor,reading[0].decode("utf-8"))
+            self.assertEqual((shortcode,position,value),reading[1:4])
+            self.assertAlmostEqual(epoch,reading[4],places=5)
+        self.assertEqual(decoded[1][0],u"K\xfcche")
+
+    #readings of several threads come out sorted by time
+    def test_sorted_by_time(self):
+        readings=[("a","dc",0,1.0,20.0),("b","dc",0,2.0,10.0)]
+        decoded=rpi_aggregator.decode_batch(rpi_aggregator.encode_batch(readings))
+        self.assertEqual([reading[0] for reading in decoded],[u"b",u"a"])
+
+    def test_empty(self):
+        self.assertEqual(rpi_aggregator.decode_batch(rpi_aggregator.encode_batch([])),[])
+
+    #a name longer than a string of the table is cut, not a character of it
+    def test_long_name(self):
+        name="\xc3\xbc"*200
+        sensor=rpi_aggregator.decode_batch(rpi_aggregator.encode_batch([(name,"dc",0,1.0,1.0)]))[0][0]
+        self.assertEqual(sensor,u"\xfc"*127)
+
+    def test_broken_batch(self):
+        payload=rpi_aggregator.encode_batch([("DS18B20","dc",0,21.5,1.0)])
+        self.assertRaises(rpi_aggregator.ProtocolError,rpi_aggregator.decode_batch,payload[:-3])
+
+class FrameReaderTest(unittest.TestCase):
+    def test_split_frames(self):
+        data=rpi_aggregator.frame(1,7,"abc")+rpi_aggregator.frame(2,8)
+        reader=rpi_aggregator.FrameReader()
+        frames=[]
+        for i in range(len(data)):
+            frames.extend(reader.feed(data[i]))
+        self.assertEqual(frames,[(1,7,"abc"),(2,8,"")])
+        self.assertEqual(reader.buffer,"")
+
+    def test_too_large(self):
+        data=rpi_aggregator.frame(1,1,"x"*(rpi_aggregator.max_payload+1))
+        self.assertRaises(rpi_aggregator.ProtocolError,rpi_aggregator.FrameReader().feed,data)
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# BMP085 math against the example of the datasheet (rpi_fakes.FakeBMP085Bus)
+#   python -m unittest discover -s tests
+###############################################################################
+
+import unittest
+import rpi_fakes,rpi_sensors
+
+class BMP085Test(unittest.TestCase):
+    def setUp(self):
+        rpi_sensors.BMP085.calibrations.clear()
+
+    def read(self,mode):
+        bus=rpi_fakes.FakeBMP085Bus()
+        return rpi_sensors.BMP085("BMP085",mode=mode,bus=bus).read_fused(),bus
+
+    def test_datasheet_example(self):
+        (temp_c,pressure,altitude),bus=self.read(0)
+        self.assertEqual(temp_c,15.0)
+        self.assertEqual(pressure,69964.0)
+        self.assertEqual(bus.transactions,5)
+
+    #the same pressure in every oversampling mode, up to the rounding of the integer math
+    def test_all_modes(self):
+        for mode in range(4):
+            (temp_c,pressure,altitude),bus=self.read(mode)
+            self.assertEqual(temp_c,15.0)
+            self.assertAlmostEqual(pressure,69964.0,delta=2)
+
+    def test_calibration_read_once(self):
+        bus=rpi_fakes.FakeBMP085Bus()
+        sensor=rpi_sensors.BMP085("BMP085",bus=bus)
+        sensor.read_fused()
+        transactions=bus.transactions
+        sensor.read_fused()
+        self.assertEqual(bus.transactions-transactions,4)
+
+    def test_no_driver_for_unknown_attributes(self):
+        sensor=rpi_sensors.BMP085("BMP085",bus=rpi_fakes.FakeBMP085Bus())
+        self.assertIsNone(getattr(sensor,"x",None))
+        self.assertFalse(hasattr(sensor,"readHumidity"))
+        self.assertNotIn("driver",sensor.__dict__)
+
+if __name__=="__main__":
+    unittest.main()
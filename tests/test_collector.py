@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Sensors of the collector daemon on fake GPIO pins (rpi_collector)
+#   python -m unittest discover -s tests
+###############################################################################
+
+import time,unittest
+import rpi_collector,rpi_fakes,rpi_sensors
+
+class IdleTest(unittest.TestCase):
+    def setUp(self):
+        self.gpio=rpi_fakes.FakeGPIO()
+        rpi_fakes.install(gpio=self.gpio)
+        self.collector=rpi_collector.Collector(idle=60)
+
+    def tearDown(self):
+        self.collector.close()
+
+    def add(self,spec):
+        spec=dict(dict((k,None) for k in rpi_collector.spec_keys),**spec)
+        entry=rpi_collector.Entry(spec)
+        self.collector.entries[tuple(spec.get(k) for k in rpi_collector.spec_keys)]=entry
+        self.collector.refresh(entry)
+        return entry
+
+    #a PIR asked for again after it was dropped sets up its pin again
+    def test_pir_events(self):
+        spec={"sensor":"PIR","echo":17,"events":True}
+        entry=self.add(spec)
+        self.assertIsNone(entry.error)
+        self.assertIn(17,self.gpio.callbacks)
+        self.collector.drop_idle(time.time()+61)
+        self.assertEqual(self.collector.entries,{})
+        self.assertNotIn(17,self.gpio.callbacks)
+        self.assertIsNone(self.add(spec).error)
+
+    def test_ultrasonic_edge(self):
+        self.gpio.echo(23,24,100.0)
+        spec={"sensor":"ULTRASONIC","trigger":23,"echo":24,"edge":True,"pings":1}
+        self.assertIsNone(self.add(spec).error)
+        self.collector.drop_idle(time.time()+61)
+        self.assertNotIn(24,self.gpio.callbacks)
+
+    #entries asked for within idle are kept
+    def test_recent(self):
+        self.add({"sensor":"PIR","echo":17,"events":True})
+        self.collector.drop_idle(time.time())
+        self.assertEqual(len(self.collector.entries),1)
+
+if __name__=="__main__":
+    unittest.main()
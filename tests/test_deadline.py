@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Deadlines, cancelling and isolated reads (rpi_deadline)
+#   python -m unittest discover -s tests
+###############################################################################
+
+import os,shutil,tempfile,threading,unittest
+import rpi_deadline
+
+class Probe(object):
+    @rpi_deadline.timeout(5)
+    def readSensor(self):
+        return os.getpid()
+
+class IsolateTest(unittest.TestCase):
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+        self.isolated=set(rpi_deadline.isolated)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        rpi_deadline.isolated.clear()
+        rpi_deadline.isolated.update(self.isolated)
+
+    def load(self,text):
+        path=os.path.join(self.directory,"rpi_sensors.cfg")
+        with open(path,"w") as f:
+            f.write(text)
+        rpi_deadline.load_config(path)
+
+    def test_none_by_default(self):
+        self.load("[budgets]\nDHT = 30\n")
+        self.assertFalse(rpi_deadline.is_isolated(Probe))
+        self.assertEqual(Probe().readSensor(),os.getpid())
+
+    def test_opt_in(self):
+        self.load("[isolate]\nclasses = Probe\n")
+        self.assertTrue(rpi_deadline.is_isolated(Probe))
+        self.assertNotEqual(Probe().readSensor(),os.getpid())
+
+    #no fork while other threads run
+    def test_not_with_threads(self):
+        self.load("[isolate]\nclasses = Probe\n")
+        stop=threading.Event()
+        thread=threading.Thread(target=stop.wait)
+        thread.start()
+        try:
+            self.assertEqual(Probe().readSensor(),os.getpid())
+        finally:
+            stop.set()
+            thread.join()
+
+class CancelTest(unittest.TestCase):
+    def test_nested(self):
+        with rpi_deadline.deadline(10) as outer:
+            with rpi_deadline.deadline(20) as inner:
+                self.assertLessEqual(inner.end,outer.end)
+                outer.cancel()
+                self.assertRaises(rpi_deadline.DeadlineExceeded,rpi_deadline.check)
+            self.assertEqual(outer.children,[])
+
+if __name__=="__main__":
+    unittest.main()
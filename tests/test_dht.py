@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# DHT worker on a fake driver script (rpi_fakes.write_dht_driver)
+#   python -m unittest discover -s tests
+###############################################################################
+
+import os,shutil,tempfile,time,unittest
+import rpi_dht,rpi_fakes
+
+class DHTServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def server(self,fail_rate):
+        driver=rpi_fakes.write_dht_driver(os.path.join(self.directory,"dht"),fail_rate=fail_rate)
+        return rpi_dht.DHTServer(driver,retries=1,max_age=30)
+
+    #the last good reading of <age> seconds ago
+    def remember(self,server,age):
+        epoch=time.time()-age
+        server.sensors[("22","4")]=(epoch,{"temp":20.0,"hum":40.0,"time":epoch,"cached":False})
+
+    def test_read(self):
+        reply=self.server(0.0).read(22,4)
+        self.assertEqual((reply["temp"],reply["hum"],reply["cached"]),(21.3,45.2,False))
+
+    def test_failed_read_gives_recent_reading(self):
+        server=self.server(1.0)
+        self.remember(server,5)
+        reply=server.read(22,4)
+        self.assertEqual((reply["temp"],reply["cached"]),(20.0,True))
+
+    #a dead sensor does not report its last value forever
+    def test_failed_read_after_max_age(self):
+        server=self.server(1.0)
+        self.remember(server,60)
+        self.assertIn("error",server.read(22,4))
+        server.sensors[("22","4")]=(time.time()-5,server.sensors[("22","4")][1])
+        self.assertIn("error",server.read(22,4))
+
+class DHTWorkerTest(unittest.TestCase):
+    #sudo never gets a driver from the command line
+    def test_sudo_args(self):
+        worker=rpi_dht.DHTWorker()
+        self.assertEqual(worker.args[0],"sudo")
+        self.assertNotIn("--driver",worker.args)
+        self.assertRaises(ValueError,rpi_dht.DHTWorker,"/tmp/dht")
+        self.assertIn("--driver",rpi_dht.DHTWorker("/tmp/dht",sudo=False).args)
+
+if __name__=="__main__":
+    unittest.main()
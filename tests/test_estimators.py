@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Sliding window estimators against sorting the window again (rpi_estimators)
+#   python -m unittest discover -s tests
+###############################################################################
+
+import random,unittest
+import rpi_estimators
+
+def median(values):
+    values=sorted(values)
+    n=len(values)
+    if n%2:
+        return values[n//2]
+    return (values[n//2-1]+values[n//2])/2.0
+
+def trimmed_mean(values):
+    cut=rpi_estimators.trim_count(len(values))
+    values=sorted(values)[cut:len(values)-cut]
+    return sum(values)/float(len(values))
+
+class SlidingWindowTest(unittest.TestCase):
+    def test_against_sorting(self):
+        generator=random.Random(3)
+        window=rpi_estimators.SlidingWindow(15)
+        samples=[]
+        for i in range(200):
+            value=round(generator.gauss(20,2),1)
+            window.add(value)
+            samples=(samples+[value])[-15:]
+            self.assertEqual(len(window),len(samples))
+            self.assertEqual(window.median(),median(samples))
+            self.assertAlmostEqual(window.trimmed_mean(),trimmed_mean(samples))
+            center=median(samples)
+            self.assertAlmostEqual(window.mad(),median([abs(sample-center) for sample in samples]))
+
+    def test_empty(self):
+        window=rpi_estimators.SlidingWindow(5)
+        self.assertIsNone(window.median())
+        self.assertIsNone(window.trimmed_mean())
+        self.assertIsNone(window.mad())
+
+    #one spike does not move the median
+    def test_spike(self):
+        window=rpi_estimators.SlidingWindow(5)
+        for value in (21.0,21.1,85.0,21.2,21.1):
+            window.add(value)
+        self.assertEqual(window.median(),21.1)
+
+class ColumnsTest(unittest.TestCase):
+    def test_columns(self):
+        samples=[(21.0,40.0),(21.2,41.0),(30.0,99.0),(21.1,40.5),(10.0,0.0),(21.3,40.2)]
+        self.assertEqual(rpi_estimators.median_columns(samples),(21.15,40.35))
+        means=rpi_estimators.trimmed_mean_columns(samples)
+        self.assertAlmostEqual(means[0],21.15)
+        self.assertAlmostEqual(means[1],40.35)
+
+    def test_too_few(self):
+        self.assertIsNone(rpi_estimators.median_columns([]))
+        self.assertIsNone(rpi_estimators.trimmed_mean_columns([]))
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Ring buffers, late records, migration and series of the history (rpi_history)
+#   python -m unittest discover -s tests
+###############################################################################
+
+import os,shutil,tempfile,unittest
+import rpi_fakes,rpi_history,rpi_sensors
+
+class InsertTest(unittest.TestCase):
+    def times(self,ring):
+        return [ring[i][0] for i in range(len(ring))]
+
+    def test_late_record(self):
+        ring=rpi_history.RingBuffer(5)
+        for timestamp in (10,20,40):
+            ring.insert((timestamp,1.0))
+        self.assertTrue(ring.insert((30,2.0)))
+        self.assertEqual(self.times(ring),[10,20,30,40])
+        self.assertEqual(ring[2],(30,2.0))
+
+    #the ring wraps around while the later records are moved
+    def test_late_record_full(self):
+        ring=rpi_history.RingBuffer(4)
+        for timestamp in (10,20,30,40,50,60):
+            ring.insert((timestamp,1.0))
+        self.assertTrue(ring.insert((45,2.0)))
+        self.assertEqual(self.times(ring),[40,45,50,60])
+
+    def test_older_than_all(self):
+        ring=rpi_history.RingBuffer(2)
+        ring.insert((10,1.0))
+        ring.insert((20,1.0))
+        self.assertFalse(ring.insert((5,1.0)))
+        self.assertEqual(self.times(ring),[10,20])
+
+    def test_same_time(self):
+        ring=rpi_history.RingBuffer(5)
+        for record in ((10,1.0),(30,1.0),(10,2.0)):
+            ring.insert(record)
+        self.assertEqual([ring[i] for i in range(3)],[(10,1.0),(10,2.0),(30,1.0)])
+
+class FileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+        self.path=os.path.join(self.directory,"ring")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fill(self,capacity,count):
+        ring=rpi_history.RingBuffer(capacity,self.path)
+        for i in range(count):
+            ring.append((i+1,float(i)))
+        ring.set_spare((99,1.0))
+        ring.close()
+
+    #the newest records are kept, the spare record too
+    def test_migrate_smaller(self):
+        self.fill(10,8)
+        ring=rpi_history.RingBuffer(4,self.path)
+        self.assertEqual([ring[i][0] for i in range(len(ring))],[5,6,7,8])
+        self.assertEqual(ring.get_spare(),(99,1.0))
+        self.assertEqual(rpi_history.read_header(self.path)[3],4)
+        self.assertFalse(os.path.exists(self.path+".migrate"))
+        ring.close()
+
+    def test_migrate_larger(self):
+        self.fill(4,6)
+        ring=rpi_history.RingBuffer(10,self.path)
+        self.assertEqual([ring[i][0] for i in range(len(ring))],[3,4,5,6])
+        ring.append((7,0.0))
+        self.assertEqual(len(ring),5)
+        ring.close()
+
+    def test_other_format(self):
+        self.fill(4,1)
+        self.assertRaises(ValueError,rpi_history.RingBuffer,4,self.path,rpi_history.tier_format)
+
+class SeriesTest(unittest.TestCase):
+    #a late value goes into its closed bucket of the tiers
+    def test_late_value(self):
+        base=1500000000
+        series=rpi_history.SeriesHistory(100,((60,10),))
+        for epoch,value in ((0,1.0),(30,3.0),(61,5.0),(125,7.0),(45,2.0)):
+            series.append(base+epoch,value)
+        self.assertEqual([value for epoch,value in series.query(base,base+200)],[1.0,3.0,2.0,5.0,7.0])
+        buckets=series.query_tier(60,base,base+200)
+        self.assertEqual(buckets[0],(base,1.0,3.0,2.0,3))
+        self.assertEqual([bucket[4] for bucket in buckets],[3,1,1])
+
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tree=None
+
+    def tearDown(self):
+        if self.tree:
+            self.tree.close()
+
+    #every DS18B20 of a bus and both values of an UltraSonic have their own series
+    def test_values_of_one_reading(self):
+        self.tree=rpi_fakes.FakeW1Tree(count=2,temp=20.0)
+        bus=self.tree.bus()
+        bus.conversion_time=0.0
+        store=rpi_history.HistoryStore()
+        store.record(rpi_history.series_name(bus),bus.readSensor())
+        spread=rpi_sensors.MeasurementType(0.5,"cm","spread centi meter","cm","m")
+        store.record("ULTRASONIC",[rpi_sensors.MeasurementType(100.0,"cm"),spread])
+        self.assertEqual(len(store.series),4)
+        self.assertEqual(store.get("ULTRASONIC","cm").query(0)[0][1],100.0)
+
+    #two DS18B20 which keep the default name
+    def test_default_names(self):
+        self.tree=rpi_fakes.FakeW1Tree(count=2)
+        names=[rpi_history.series_name(device) for device in self.tree.devices()]
+        self.assertEqual(sorted(names),["DS18B20 "+device_id for device_id in self.tree.device_ids])
+        self.assertEqual(rpi_history.series_name(rpi_sensors.DHT("DHT",22,4)),"DHT 4")
+
+if __name__=="__main__":
+    unittest.main()
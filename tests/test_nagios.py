@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Batch entries of the other CLIs and the shared hysteresis state (rpi_nagios)
+#   python -m unittest discover -s tests
+###############################################################################
+
+import StringIO,argparse,os,shutil,sys,tempfile,unittest
+import rpi_exporter,rpi_nagios,rpi_scheduler,rpi_sensors,rpi_thresholds
+
+class ParseSpecTest(unittest.TestCase):
+    def setUp(self):
+        self.argv=sys.argv
+
+    def tearDown(self):
+        sys.argv=self.argv
+
+    #like their main(): the namespace of these CLIs has no --state
+    def test_scheduler(self):
+        sys.argv=["rpi_scheduler.py","--job","1","RPI"]
+        args=rpi_scheduler.GetArgs()
+        args.output="standard"
+        args.socket=None
+        specargs=rpi_nagios.parseSpec(args.job[0][1],args)
+        self.assertEqual(specargs.sensor,"RPI")
+        self.assertIsNone(specargs.state)
+
+    def test_exporter(self):
+        sys.argv=["rpi_exporter.py","-b","RPI --state /tmp/x.state"]
+        args=rpi_exporter.GetArgs()
+        args.output="standard"
+        args.decimals=1
+        args.socket=None
+        self.assertEqual(rpi_nagios.parseSpec(args.batch[0],args).state,"/tmp/x.state")
+
+    #argparse prints its usage to stderr
+    def test_wrong_option(self):
+        args=argparse.Namespace(output="nagios",decimals=1,socket=None)
+        stderr=sys.stderr
+        sys.stderr=StringIO.StringIO()
+        try:
+            self.assertRaises(ValueError,rpi_nagios.parseSpec,"RPI --no-such-option",args)
+        finally:
+            sys.stderr=stderr
+
+class StateTest(unittest.TestCase):
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+        self.state=os.path.join(self.directory,"nagios.state")
+        rpi_nagios.exitcode=0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        rpi_nagios.exitcode=0
+
+    def check(self,name,value):
+        args=argparse.Namespace(warning=["30"],critical=["35"],hysteresis=["0.5"],decimals=1,state=self.state)
+        return rpi_nagios.formatNagios(name,[rpi_sensors.MeasurementType(value,"dc")],args)[1]
+
+    #two checks with the same label share the file without taking over each other's status
+    def test_checks_share_the_file(self):
+        self.check("DHT",31.0)
+        self.check("DS18B20",29.8)
+        self.assertEqual(rpi_thresholds.load_state(self.state),{"DHT degree Celsius":1,"DS18B20 degree Celsius":0})
+        self.check("DHT",29.8)
+        self.assertEqual(rpi_thresholds.load_state(self.state)["DHT degree Celsius"],1)
+
+if __name__=="__main__":
+    unittest.main()
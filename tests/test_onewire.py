@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# w1_slave parser and DS18B20 reads on a fake 1-wire tree (rpi_fakes.FakeW1Tree)
+#   python -m unittest discover -s tests
+###############################################################################
+
+import unittest
+import rpi_deadline,rpi_fakes,rpi_sensors
+
+def lines(millis,crc=True):
+    return rpi_fakes.w1_slave(millis,crc).splitlines(True)
+
+class ParseTempTest(unittest.TestCase):
+    def test_valid(self):
+        self.assertEqual(rpi_sensors.parse_temp(lines(21500)),21.5)
+        self.assertEqual(rpi_sensors.parse_temp(lines(-10125)),-10.125)
+
+    def test_crc_error(self):
+        self.assertIsNone(rpi_sensors.parse_temp(lines(21500,crc=False)))
+        self.assertFalse(rpi_sensors.is_power_on(lines(21500,crc=False)))
+
+    #85 degrees is the value of a DS18B20 right after power on
+    def test_power_on(self):
+        self.assertIsNone(rpi_sensors.parse_temp(lines(85000)))
+        self.assertTrue(rpi_sensors.is_power_on(lines(85000)))
+
+    #owfs gives the temperature alone
+    def test_owfs(self):
+        self.assertEqual(rpi_sensors.parse_temp(["  21.5\n"]),21.5)
+
+    def test_no_temperature(self):
+        self.assertIsNone(rpi_sensors.parse_temp([]))
+        self.assertIsNone(rpi_sensors.parse_temp([lines(21500)[0],"\n"]))
+
+class FakeW1TreeTest(unittest.TestCase):
+    def setUp(self):
+        self.tree=None
+
+    def tearDown(self):
+        if self.tree:
+            self.tree.close()
+
+    def test_devices(self):
+        self.tree=rpi_fakes.FakeW1Tree(count=3,temp=20.0)
+        temps=[device.readSensor()[0].value for device in self.tree.devices()]
+        self.assertEqual(sorted(temps),[20.0,20.1,20.2])
+
+    #wrong values are read again until a valid one comes
+    def test_retries(self):
+        self.tree=rpi_fakes.FakeW1Tree(temp=21.5,crc_error_rate=0.3,power_on_rate=0.3,seed=1)
+        device=self.tree.devices()[0]
+        with rpi_deadline.no_sleep():
+            temps=[device.read_temp() for i in range(10)]
+        self.assertEqual(temps,[21.5]*10)
+        self.assertGreater(self.tree.crc_errors,0)
+        self.assertGreater(self.tree.power_on_values,0)
+        self.assertEqual(self.tree.reads,10+self.tree.crc_errors+self.tree.power_on_values)
+
+    def test_bus(self):
+        self.tree=rpi_fakes.FakeW1Tree(count=2,temp=18.0)
+        bus=self.tree.bus()
+        bus.conversion_time=0.0
+        self.assertEqual([unit.value for unit in bus.readSensor()],[18.0,18.1])
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Deadband and adaptive interval of the sampling policy (rpi_sampling)
+#   python -m unittest discover -s tests
+###############################################################################
+
+import unittest
+import rpi_sampling,rpi_sensors
+
+def reading(*values):
+    return [rpi_sensors.MeasurementType(value,"dc") for value in values]
+
+class PolicyTest(unittest.TestCase):
+    def policy(self,**kwargs):
+        options=dict(max_interval=100,heartbeat=900,bands={"t":0.1})
+        options.update(kwargs)
+        return rpi_sampling.Policy(10,**options)
+
+    def test_deadband(self):
+        policy=self.policy()
+        self.assertEqual(len(policy.filter(reading(20.0),0)),1)
+        self.assertEqual(policy.filter(reading(20.05),15),[])
+        self.assertEqual(len(policy.filter(reading(20.15),30)),1)
+
+    #stable values: the interval grows by backoff up to max_interval
+    def test_backoff(self):
+        policy=self.policy()
+        now=0
+        for i in range(10):
+            policy.filter(reading(20.0),now)
+            now+=policy.interval
+        self.assertEqual(policy.interval,100)
+
+    #a slow change cuts the grown interval to half the time to cross the deadband
+    def test_cut_down(self):
+        policy=self.policy()
+        policy.filter(reading(20.0),0)
+        self.assertEqual(policy.interval,15)
+        policy.filter(reading(20.04),15)
+        self.assertAlmostEqual(policy.interval,18.75)
+        #20.04 was not passed on: 0.09 in 30 s since 20.0
+        policy.filter(reading(20.09),30)
+        self.assertAlmostEqual(policy.interval,50/3.0)
+
+    #a jump goes back to the interval of the job at once
+    def test_jump(self):
+        policy=self.policy()
+        for now in (0,15,37.5):
+            policy.filter(reading(20.0),now)
+        policy.filter(reading(25.0),70)
+        self.assertEqual(policy.interval,10)
+
+    def test_heartbeat(self):
+        policy=self.policy(heartbeat=60)
+        policy.filter(reading(20.0),0)
+        self.assertEqual(policy.filter(reading(20.0),30),[])
+        self.assertEqual(len(policy.filter(reading(20.0),60)),1)
+        self.assertEqual(policy.filter(reading(20.0),90),[])
+
+    def test_no_deadband(self):
+        policy=self.policy(deadband=False)
+        policy.filter(reading(20.0),0)
+        self.assertEqual(len(policy.filter(reading(20.0),15)),1)
+
+    #values which are no numbers are passed on when they change
+    def test_text(self):
+        policy=self.policy()
+        governor=lambda value: [rpi_sensors.MeasurementType(value,"gov","Governor","Gov.","gov")]
+        policy.filter(governor("ondemand"),0)
+        self.assertEqual(policy.filter(governor("ondemand"),15),[])
+        self.assertEqual(len(policy.filter(governor("powersave"),30)),1)
+
+    #compared to a read every 10 s for 60 s (7 reads) passing on all 14 values
+    def test_stats(self):
+        policy=self.policy()
+        for now,temp_c in ((0,20.0),(15,20.0),(37.5,20.5),(47.5,20.5),(60,20.5)):
+            policy.filter(reading(temp_c)+[rpi_sensors.MeasurementType(40.0,"h")],now)
+        stats=policy.stats()
+        self.assertEqual((stats["reads"],stats["saved_reads"]),(5,2))
+        self.assertEqual((stats["values"],stats["passed"],stats["saved_values"]),(10,3,7))
+
+    def test_stats_before_a_read(self):
+        stats=self.policy().stats()
+        self.assertEqual((stats["reads"],stats["saved_reads"],stats["saved_values"]),(0,0,0))
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+###############################################################################
+# Stefan Süss - www.sysstem.at
+###############################################################################
+# Nagios ranges, rules and hysteresis (rpi_thresholds)
+#   python -m unittest discover -s tests
+###############################################################################
+
+import unittest
+import rpi_thresholds
+from rpi_thresholds import OK,WARNING,CRITICAL,UNKNOWN
+
+class RangeTest(unittest.TestCase):
+    def alerts(self,spec,values):
+        threshold=rpi_thresholds.Range(spec)
+        return [threshold.alerts(value) for value in values]
+
+    def test_above(self):
+        self.assertEqual(self.alerts("30",[-40,30,30.1]),[False,False,True])
+
+    def test_below(self):
+        self.assertEqual(self.alerts("10:",[9.9,10,100]),[True,False,False])
+
+    def test_no_lower_bound(self):
+        self.assertEqual(self.alerts("~:5",[-100,5,5.1]),[False,False,True])
+
+    def test_outside(self):
+        self.assertEqual(self.alerts("10:20",[9.9,10,20,20.1]),[True,False,False,True])
+
+    def test_inside(self):
+        self.assertEqual(self.alerts("@10:20",[9.9,10,20,20.1]),[False,True,True,False])
+
+    def test_text(self):
+        self.assertEqual(self.alerts("powersave",["powersave","ondemand"]),[True,False])
+
+class RuleTest(unittest.TestCase):
+    def test_statuses(self):
+        rule=rpi_thresholds.Rule("30","35")
+        self.assertEqual([rule.evaluate(value) for value in (20,30.1,35.1)],[OK,WARNING,CRITICAL])
+
+    #-w 30 -c 35 --hysteresis 0.5: warning at 30.1, ok again at 29.5
+    def test_hysteresis(self):
+        rule=rpi_thresholds.Rule("30","35",0.5)
+        self.assertEqual(rule.evaluate(29.8,OK),OK)
+        self.assertEqual(rule.evaluate(29.8,WARNING),WARNING)
+        self.assertEqual(rule.evaluate(29.5,WARNING),OK)
+        self.assertEqual(rule.evaluate(34.8,CRITICAL),CRITICAL)
+        self.assertEqual(rule.evaluate(34.5,CRITICAL),WARNING)
+
+    def test_state_of_rule(self):
+        rule=rpi_thresholds.Rule("30","35",0.5,state=WARNING)
+        self.assertEqual(rule.evaluate(29.8),WARNING)
+
+    def test_unknown(self):
+        self.assertEqual(rpi_thresholds.Rule("30","35").evaluate("ondemand"),UNKNOWN)
+        self.assertEqual(rpi_thresholds.Rule("powersave","performance").evaluate(20.0),UNKNOWN)
+
+    def test_text(self):
+        rule=rpi_thresholds.Rule("powersave","performance")
+        self.assertEqual([rule.evaluate(value) for value in ("ondemand","powersave","performance")],[OK,WARNING,CRITICAL])
+
+class RuleSetTest(unittest.TestCase):
+    #the statuses are kept in the rules for the next check
+    def test_evaluate(self):
+        rules=rpi_thresholds.RuleSet.parse(["30","10:"],["35","5:"],["0.5"])
+        self.assertEqual(rules.evaluate([30.1,7.0]),[WARNING,WARNING])
+        self.assertEqual(rules.evaluate([29.8,9.9]),[WARNING,WARNING])
+        self.assertEqual(rules.evaluate([29.4,4.0]),[OK,CRITICAL])
+
+    def test_restore(self):
+        rules=rpi_thresholds.RuleSet.parse(["30"],["35"],["0.5"])
+        rules.restore(["temp"],{"temp":WARNING})
+        self.assertEqual(rules.evaluate([29.8]),[WARNING])
+
+    def test_too_few_thresholds(self):
+        self.assertRaises(IndexError,rpi_thresholds.RuleSet.parse,["30"],["35"],None,2)
+
+if __name__=="__main__":
+    unittest.main()